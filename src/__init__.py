@@ -31,6 +31,7 @@ def create_app():
 
     initialize_extensions(app)
     register_blueprints(app)
+    start_background_jobs(app)
     return app
 
 
@@ -53,3 +54,13 @@ def register_blueprints(app):
     # Since the application instance is now created, register each Blueprint
     # with the Flask application instance (app)
     app.register_blueprint(api, url_prefix='/api')
+
+
+def start_background_jobs(app):
+    # Periodic database clean-up, see MAINTENANCE_INTERVAL_MINUTES
+    from src.services.maintenance import maintenance_job
+    # Semantic descriptions share the ontologies parsed here
+    from src.services.ontology import preload
+
+    maintenance_job.start()
+    preload()
@@ -4,7 +4,7 @@ import logging
 from config import settings
 from werkzeug.exceptions import Forbidden, Unauthorized
 from src import basic_auth, token_auth
-from src.models.user_model import User, NewUserSchema, UserSchema
+from src.models.user_model import User, NewUserSchema, UserSchema, KeyDerivationBusy
 
 @basic_auth.verify_password
 def verify_password(email, password):
@@ -13,8 +13,12 @@ def verify_password(email, password):
     if user_data is None:
         return None
 
-    if user.is_password_correct(email, password):
-        return user
+    try:
+        if user.is_password_correct(email, password):
+            return user
+    except KeyDerivationBusy as e:
+        logging.warning(str(e))
+        abort(503)
 
 
 @basic_auth.error_handler
@@ -31,7 +35,17 @@ def basic_auth_error(status=401):
 @token_auth.verify_token
 def verify_token(auth_token):
     user = User()
-    return user.verify_auth_token(auth_token)
+    if user.verify_auth_token(auth_token):
+        return user.email
+    return None
+
+
+@token_auth.get_user_roles
+def get_user_roles(email):
+    # Admins are configured by email, the role users give themselves when registering is not trusted
+    if email in settings.get('ADMIN_USERS', []):
+        return ['admin']
+    return []
 
 
 @token_auth.error_handler
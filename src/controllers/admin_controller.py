@@ -0,0 +1,42 @@
+from flask import request, Response, json, Blueprint, jsonify, abort
+from apifairy import body, other_responses, response, authenticate
+from src import basic_auth, token_auth
+import logging
+from config import settings
+from src.storage import get_stats
+from src.models.user_model import token_cache, kdf_pool
+from src.services.maintenance import maintenance_job
+from src.services.idempotency import idempotency_store
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+# admin controller blueprint to be registered with api blueprint
+admin_blueprint = Blueprint("admin", __name__, template_folder='templates')
+
+
+@admin_blueprint.route('/storage_stats', methods=["GET"])
+@authenticate(token_auth, role='admin')
+def storage_stats():
+    """Return the counters of the storage engines, the token cache, the password hashing pool, the idempotency keys and the maintenance job"""
+    try:
+        return {"storage": get_stats(), "token_cache": token_cache.stats(), "kdf_pool": kdf_pool.stats(),
+                "idempotency": idempotency_store.stats(), "maintenance": maintenance_job.stats()}, 200
+
+    except Exception as e:
+        error = {"status": "failed", "message": "Error Occured", "error": str(e)}
+        logging.error(str(e))
+        return error, 500
+
+
+@admin_blueprint.route('/maintenance', methods=["POST"])
+@authenticate(token_auth, role='admin')
+def run_maintenance():
+    """Purge expired tokens and stale records and compact the database now"""
+    try:
+        return {"maintenance": maintenance_job.run()}, 200
+
+    except Exception as e:
+        error = {"status": "failed", "message": "Error Occured", "error": str(e)}
+        logging.error(str(e))
+        return error, 500
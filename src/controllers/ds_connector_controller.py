@@ -1,7 +1,10 @@
 from flask import request, Response, json, Blueprint, jsonify, abort
 from src.models.ds_connector_model import DataSpaceConnector, DataSpaceConnectorSchema, DataSpaceConnectorSchemaResponse, ConnectorGetSchema
 from src.models.error_model import ErrorReponseSchema
-from apifairy import body, other_responses, response, authenticate
+from src.models.query_model import ListArgsSchema
+from src.storage import InvalidQuery
+from src.services.idempotency import idempotent
+from apifairy import arguments, body, other_responses, response, authenticate
 from src.connectors.true_connector import TrueConnector
 import logging
 from config import settings
@@ -17,9 +20,10 @@ ds_resource_model = DataSpaceResource()
 
 
 @ds_connector.route('/add_connector', methods = ["POST"])
+@authenticate(token_auth)
+@idempotent
 @response(DataSpaceConnectorSchemaResponse)
 @other_responses({409: (ErrorReponseSchema, 'Id already exists')})
-@authenticate(token_auth)
 @body(DataSpaceConnectorSchema)
 def add_connector(kwargs):
     """Add a new data space connector instance"""
@@ -85,6 +89,25 @@ def get_connector(kwargs):
         
         
 
+@ds_connector.route('/list', methods=["GET"])
+@authenticate(token_auth)
+@arguments(ListArgsSchema)
+@other_responses({400: ErrorReponseSchema})
+def list_connectors(args):
+    """List the registered connectors one page at a time"""
+    try:
+        return ds_connector_model.list_connectors(limit=args['limit'], after=args['after'], fields=args.get('fields')), 200
+
+    except InvalidQuery as e:
+        error = {"status": "failed", "message": "Error Occured", "error": str(e)}
+        return error, 400
+
+    except Exception as e:
+        error = {"status": "failed", "message": "Error Occured", "error": str(e)}
+        logging.error("Error Occured %s", error)
+        return error, 500
+
+
 @ds_connector.route('/register_resource/<resource_id>', methods=["POST"])
 @authenticate(token_auth)
 @body(ResourceRegistrationPayloadSchema)
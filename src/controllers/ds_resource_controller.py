@@ -1,7 +1,11 @@
 from flask import request, Response, json, Blueprint, jsonify, abort
-from src.models.ds_resource_model import DataSpaceResource, DataSpaceResourceSchema, DataSpaceResourceSchemaResponse, DataSpaceResourceDescriptionSchema, ArtifactDownloadResponse
+from src.models.ds_resource_model import DataSpaceResource, DataSpaceResourceSchema, BulkResourceSchema, DataSpaceResourceSchemaResponse, DataSpaceResourceDescriptionSchema, ArtifactDownloadResponse
 from src.models.error_model import ErrorReponseSchema
-from apifairy import body, other_responses, response, authenticate
+from src.models.query_model import ListArgsSchema, BatchGetSchema
+from src.storage import InvalidQuery
+from src.services.streaming import read_records
+from src.services.idempotency import idempotent
+from apifairy import arguments, body, other_responses, response, authenticate
 import logging
 from config import settings
 from src import basic_auth, token_auth
@@ -15,11 +19,13 @@ logging.basicConfig(level=logging.DEBUG)
 # user controller blueprint to be registered with api blueprint
 ds_resource = Blueprint("dataspace_resource", __name__, template_folder='templates')
 ds_resource_model = DataSpaceResource()
+bulk_resource_schema = BulkResourceSchema()
 
 
 
 @ds_resource.route('/create_resource', methods = ["POST"])
 #@authenticate(token_auth)
+@idempotent
 @response(DataSpaceResourceSchemaResponse)
 @body(DataSpaceResourceSchema)
 def create_resource(kwargs):
@@ -57,6 +63,64 @@ def create_resource(kwargs):
         logging.error("Error Occured %s", error)
         return error, 500
     
+@ds_resource.route('/bulk_create', methods=["POST"])
+#@authenticate(token_auth)
+@other_responses({400: ErrorReponseSchema})
+def bulk_create():
+    """Create many resources with their policies at once
+
+    The body is a JSON array, or one entry per line with the content type
+    application/x-ndjson, of resources with a list of policies. The valid
+    entries are stored in one transaction and every entry is reported on in
+    the order it was sent.
+    """
+    try:
+        entries = read_records(settings.get('BULK_MAX_ITEMS', 5000))
+    except ValueError as e:
+        error = {"status": "failed", "message": "Error Occured", "error": str(e)}
+        return error, 400
+
+    try:
+        results = [None] * len(entries)
+        accepted = []
+        for index, entry in enumerate(entries):
+            errors = bulk_resource_schema.validate(entry) if isinstance(entry, dict) else {"_schema": ["Expected an object"]}
+            if errors:
+                results[index] = {"index": index, "status": "failed", "error": errors}
+            else:
+                accepted.append(index)
+
+        created = ds_resource_model.create_resources([bulk_resource_schema.load(entries[index]) for index in accepted])
+        for index, resource in zip(accepted, created):
+            results[index] = {"index": index, "status": "created", "resource": resource}
+
+        return {"created": len(created), "failed": len(results) - len(created), "results": results}, 200
+
+    except Exception as e:
+        error = {"status": "failed", "message": "Error Occured", "error":  str(e)}
+        logging.error("Error Occured %s", error)
+        return error, 500
+
+
+@ds_resource.route('/list', methods=["GET"])
+#@authenticate(token_auth)
+@arguments(ListArgsSchema)
+@other_responses({400: ErrorReponseSchema})
+def list_resources(args):
+    """List the resources one page at a time"""
+    try:
+        return ds_resource_model.list_resources(limit=args['limit'], after=args['after'], fields=args.get('fields')), 200
+
+    except InvalidQuery as e:
+        error = {"status": "failed", "message": "Error Occured", "error": str(e)}
+        return error, 400
+
+    except Exception as e:
+        error = {"status": "failed", "message": "Error Occured", "error": str(e)}
+        logging.error("Error Occured %s", error)
+        return error, 500
+
+
 @ds_resource.route('/get_resource/<resource_id>', methods=["GET"])
 #@authenticate(token_auth)
 @response(DataSpaceResourceSchemaResponse)
@@ -80,6 +144,21 @@ def get_resource(resource_id):
         return jsonify(error), 500
     
     
+@ds_resource.route('/batch_get', methods=["POST"])
+#@authenticate(token_auth)
+@body(BatchGetSchema)
+@other_responses({400: ErrorReponseSchema})
+def batch_get(kwargs):
+    """Retrieve many resources by their unique hash identifiers"""
+    try:
+        return ds_resource_model.get_resources(kwargs['ids']), 200
+
+    except Exception as e:
+        error = {"status": "failed", "message": "Error occurred", "error": str(e)}
+        logging.error("Error occurred %s", error)
+        return error, 500
+
+
 @ds_resource.route('/create_resource_description/<resource_id>', methods=["POST"])
 #@authenticate(token_auth)
 @response(DataSpaceResourceDescriptionSchema)
@@ -1,10 +1,15 @@
 from flask import request, Response, json, Blueprint, jsonify, abort
 from src.models.fl_service import FLService, FLServiceSchema, FLServiceSchemaResponse, MLSemanticSchema
 from src.models.error_model import ErrorReponseSchema
-from apifairy import body, other_responses, response, authenticate
-from cords_semantics.semantics import FlSemanticManager
+from src.models.query_model import QuerySchema, ListArgsSchema, BatchGetSchema
+from src.storage import InvalidQuery
+from src.services.streaming import stream_records, wants_ndjson
+from src.services.idempotency import idempotent
+from apifairy import arguments, body, other_responses, response, authenticate
+from src.services.ontology import SharedFlSemanticManager
 from cords_semantics.mlflow import convert_tags_to_dictionary, extract_mlflow_semantics
 from src import basic_auth, token_auth
+import itertools
 import logging
 from config import settings
 
@@ -23,11 +28,13 @@ fl_service_schema = FLServiceSchema()
 fl_service_response_schema = FLServiceSchemaResponse()
 error_response_schema = ErrorReponseSchema()
 ml_semantic_schema = MLSemanticSchema()
+query_schema = QuerySchema()
 fl_service = FLService()
 
 
 @fl_services.route('/add', methods = ["POST"])
 # @authenticate(token_auth)
+@idempotent
 def add_service(kwargs):
     """Add a new FL service entry"""
     print(kwargs)
@@ -95,17 +102,67 @@ def get_service(fl_service_id):
         error = {"status": "failed", "message": "Error Occurred", "error": str(e)}
         return error, 500
     
+@fl_services.route('/batch_get', methods=["POST"])
+# @authenticate(token_auth)
+@body(BatchGetSchema)
+@other_responses({400: error_response_schema})
+def batch_get(kwargs):
+    """Retrieve many FL service entries by their IDs"""
+    try:
+        return fl_service.get_fl_services(kwargs['ids']), 200
+
+    except Exception as e:
+        logging.error(str(e))
+        error = {"status": "failed", "message": "Error Occurred", "error": str(e)}
+        return error, 500
+
+
 @fl_services.route('/list', methods=["GET"])
-def list_services():
-    """List all available FL services"""
+@arguments(ListArgsSchema)
+@other_responses({400: error_response_schema})
+def list_services(args):
+    """List the available FL services, one page at a time if limit or after is given
+
+    Without them all services are streamed, as newline delimited JSON if
+    the Accept header asks for application/x-ndjson.
+    """
     try:
-        services = fl_service.get_all_services()
+        if any(args.get(name) is not None for name in ('limit', 'after', 'fields')):
+            return fl_service.list_services(limit=args['limit'], after=args['after'], fields=args.get('fields')), 200
 
-        if services:
-            return jsonify(services), 200
+        services = fl_service.iter_services()
+        first = next(services, None)
+
+        if first is not None:
+            return stream_records(itertools.chain([first], services))
+        elif wants_ndjson():
+            return stream_records([], ndjson=True)
         else:
             return {"status": "success", "message": "No FL services available"}, 200
 
+    except InvalidQuery as e:
+        error = {"status": "failed", "message": "Error Occurred", "error": str(e)}
+        return error, 400
+
+    except Exception as e:
+        logging.error(str(e))
+        error = {"status": "failed", "message": "Error Occurred", "error": str(e)}
+        return error, 500
+
+
+@fl_services.route('/query', methods=["POST"])
+@body(query_schema)
+@other_responses({400: error_response_schema})
+def query_services(query):
+    """Query FL service entries one page at a time"""
+    try:
+        page = fl_service.query_models(query['filters'], sort=query['sort'], limit=query['limit'], cursor=query['cursor'])
+        return page, 200
+
+    except InvalidQuery as e:
+        error = {"status": "failed", "message": "Error Occurred", "error": str(e)}
+        return error, 400
+
     except Exception as e:
         logging.error(str(e))
         error = {"status": "failed", "message": "Error Occurred", "error": str(e)}
@@ -162,7 +219,7 @@ def update_service(fl_service_id, kwargs):
 def generate_semantics(fl_service_id):
     """Generate semantic description"""
     try:
-        fl_semantic_manager = FlSemanticManager('data/cords_federated_learning.rdf')
+        fl_semantic_manager = SharedFlSemanticManager()
 
         service = fl_service.get_fl_service(fl_service_id)[0]
         
@@ -1,13 +1,19 @@
 from flask import request, Response, json, Blueprint, jsonify, abort
-from apifairy import body, other_responses, response, authenticate
+from apifairy import arguments, body, other_responses, response, authenticate
 from cords_semantics.semantics import FlSemanticManager
 from cords_semantics.mlflow import convert_tags_to_dictionary, extract_mlflow_semantics
 from src import basic_auth, token_auth
 import mlflow
+import itertools
 import logging
 from config import settings
 from src.models.fl_service import FLService
 from src.models.ds_resource_model import DataSpaceResource
+from src.models.error_model import ErrorReponseSchema
+from src.models.query_model import PageArgsSchema, ChangeStreamArgsSchema
+from src.storage import InvalidQuery
+from src.services.streaming import stream_records, stream_events, wants_ndjson
+from src.services.idempotency import idempotent
 
 
 
@@ -23,7 +29,11 @@ front_end= Blueprint("front_end", __name__, template_folder='templates')
 fl_service = FLService()
 ds_resource_model = DataSpaceResource()
 
+# Event type of the changes of every table streamed by /service_changes
+CHANGE_EVENT_TYPES = {'fl_services': 'fl_service', 'resource': 'resource', 'policies': 'policy'}
+
 @front_end.route('/add_fl_service', methods = ["POST"])
+@idempotent
 def add_service():
     """Add a new FL service entry"""
     try:
@@ -99,17 +109,87 @@ def add_service():
 
 
 @front_end.route('/list_service_summary', methods=["GET"])
-def list_services():
-    """List all available FL services"""
+@arguments(PageArgsSchema)
+@other_responses({400: ErrorReponseSchema})
+def list_services(args):
+    """List all available FL services, one page at a time if limit or after is given
+
+    Without them all entries are streamed, as newline delimited JSON if
+    the Accept header asks for application/x-ndjson.
+    """
     try:
-        fl_service = FLService()
-        services = fl_service.get_service_summary()
+        if args['limit'] is not None or args['after'] is not None:
+            return fl_service.get_service_summary(limit=args['limit'], after=args['after']), 200
+
+        services = fl_service.iter_service_summary()
+        first = next(services, None)
 
-        if services:
-            return jsonify(services), 200
+        if first is not None:
+            return stream_records(itertools.chain([first], services))
+        elif wants_ndjson():
+            return stream_records([], ndjson=True)
         else:
             return {"status": "success", "message": "No FL services available"}, 200
 
+    except InvalidQuery as e:
+        error = {"status": "failed", "message": "Error Occurred", "error": str(e)}
+        return error, 400
+
+    except Exception as e:
+        logging.error(str(e))
+        error = {"status": "failed", "message": "Error Occurred", "error": str(e)}
+        return error, 500
+
+
+
+@front_end.route('/service_changes', methods=["GET"])
+@arguments(ChangeStreamArgsSchema)
+@other_responses({400: ErrorReponseSchema, 503: ErrorReponseSchema})
+def stream_service_changes(args):
+    """Stream the changes of FL services, resources and policies as server-sent events
+
+    Every event has the type fl_service, resource or policy and carries the
+    operation (insert, update or remove), the document ID and the document
+    as written, null for removals. A client reconnecting with the Last-Event-ID
+    header, or the last_event_id argument, receives the changes it missed.
+    If those are no longer kept, a reset event tells it to reload the
+    service summary instead. The tables have to be listed in
+    CHANGE_FEED_TABLES, otherwise the stream is not available.
+    """
+    try:
+        if not fl_service.tracks_service_changes():
+            error = {"status": "failed", "message": "Error Occurred",
+                     "error": "The change feed does not track FL services, resources and policies"}
+            return error, 503
+
+        after = request.headers.get('Last-Event-ID') or args['last_event_id']
+        try:
+            after = int(after) if after is not None else None
+        except ValueError:
+            error = {"status": "failed", "message": "Error Occurred", "error": "Malformed Last-Event-ID"}
+            return error, 400
+
+        def generate(after):
+            if after is not None and fl_service.missed_service_changes(after):
+                # The client reloads the summary and continues from here
+                after = fl_service.db.changes.last_seq()
+                yield after, 'reset', {'reason': 'changes no longer available'}
+            changes = fl_service.iter_service_changes(
+                after=after,
+                duration=settings.get('CHANGE_STREAM_DURATION', 300),
+                heartbeat=settings.get('CHANGE_STREAM_HEARTBEAT', 15),
+            )
+            for event in changes:
+                if event is None:
+                    yield None
+                    continue
+                yield event.seq, CHANGE_EVENT_TYPES[event.table], {
+                    'op': event.op, 'key': event.key, 'document': event.after,
+                    'version': event.version, 'timestamp': event.timestamp,
+                }
+
+        return stream_events(generate(after), retry_ms=settings.get('CHANGE_STREAM_RETRY_MS', 3000))
+
     except Exception as e:
         logging.error(str(e))
         error = {"status": "failed", "message": "Error Occurred", "error": str(e)}
@@ -1,8 +1,12 @@
 from flask import request, Response, json, Blueprint, jsonify, abort
 from src.models.ml_model import MlModel, MLModelSchema, MLModelSchemaResponse, MLSemanticSchema
 from src.models.error_model import ErrorReponseSchema
-from apifairy import body, other_responses, response, authenticate
-from cords_semantics.semantics import MlSemanticManager
+from src.models.query_model import QuerySchema, ListArgsSchema, BatchGetSchema
+from src.storage import InvalidQuery
+from src.services.streaming import read_records
+from src.services.idempotency import idempotent
+from apifairy import arguments, body, other_responses, response, authenticate
+from src.services.ontology import SharedMlSemanticManager
 from cords_semantics.mlflow import convert_tags_to_dictionary, extract_mlflow_semantics
 from src import basic_auth, token_auth
 import mlflow
@@ -20,11 +24,13 @@ ml_model_schema = MLModelSchema()
 ml_model_response_schema = MLModelSchemaResponse()
 error_response_schema = ErrorReponseSchema()
 ml_semantic_schema = MLSemanticSchema()
+query_schema = QuerySchema()
 new_model = MlModel()
 
 
 @ml_models.route('/add_model', methods = ["POST"])
 @authenticate(token_auth)
+@idempotent
 @response(ml_model_response_schema, 201)
 @other_responses({400: error_response_schema})
 @body(ml_model_schema)
@@ -60,6 +66,48 @@ def add_model(kwargs):
         return error, 500
 
 
+@ml_models.route('/bulk_add', methods=["POST"])
+@authenticate(token_auth)
+@other_responses({400: error_response_schema})
+def bulk_add():
+    """Add many ml model entries at once
+
+    The body is a JSON array of models, or one model per line with the
+    content type application/x-ndjson. Every model is reported on in the
+    order it was sent, the valid ones are stored in one write.
+    """
+    try:
+        models = read_records(settings.get('BULK_MAX_ITEMS', 5000))
+    except ValueError as e:
+        error = {"status": "failed", "message": "Error Occured", "error": str(e)}
+        return error, 400
+
+    try:
+        results = [None] * len(models)
+        accepted = []
+        for index, model in enumerate(models):
+            errors = ml_model_schema.validate(model) if isinstance(model, dict) else {"_schema": ["Expected an object"]}
+            if errors:
+                results[index] = {"index": index, "status": "failed", "error": errors}
+            else:
+                accepted.append(index)
+
+        added = new_model.add_models([models[index] for index in accepted])
+        for index, result in zip(accepted, added):
+            if isinstance(result, dict):
+                results[index] = {"index": index, "status": "created", "model": result}
+            else:
+                results[index] = {"index": index, "status": "failed", "error": result}
+
+        created = sum(1 for result in results if result["status"] == "created")
+        return {"created": created, "failed": len(results) - created, "results": results}, 200
+
+    except Exception as e:
+        logging.error(str(e))
+        error = {"status": "failed", "message": "Error Occured", "error":  str(e)}
+        return error, 500
+
+
 @ml_models.route('/get_model/<string:model_id>', methods = ["GET"])
 @response(MLModelSchemaResponse)
 @other_responses({404: 'Entry not found'})
@@ -78,6 +126,60 @@ def get_model(model_id):
 
 
 
+@ml_models.route('/batch_get', methods=["POST"])
+@authenticate(token_auth)
+@body(BatchGetSchema)
+@other_responses({400: error_response_schema})
+def batch_get(kwargs):
+    """Return many ML Model entries by their IDs"""
+    try:
+        return new_model.get_models(kwargs['ids']), 200
+
+    except Exception as e:
+        logging.error(str(e))
+        error = {"status": "failed", "message": "Error Occured", "error":  str(e)}
+        return error, 500
+
+
+@ml_models.route('/list', methods=["GET"])
+@authenticate(token_auth)
+@arguments(ListArgsSchema)
+@other_responses({400: ErrorReponseSchema})
+def list_models(args):
+    """List ML Model entries one page at a time"""
+    try:
+        return new_model.list_models(limit=args['limit'], after=args['after'], fields=args.get('fields')), 200
+
+    except InvalidQuery as e:
+        error = {"status": "failed", "message": "Error Occured", "error": str(e)}
+        return error, 400
+
+    except Exception as e:
+        error = {"status": "failed", "message": "Error Occured", "error": str(e)}
+        logging.error(str(e))
+        return error, 500
+
+
+@ml_models.route('/query_models', methods=['POST'])
+@authenticate(token_auth)
+@body(query_schema)
+@other_responses({400: error_response_schema})
+def query_models(query):
+    """Query ML Model entries one page at a time"""
+    try:
+        page = new_model.query_models(query['filters'], sort=query['sort'], limit=query['limit'], cursor=query['cursor'])
+        return page, 200
+
+    except InvalidQuery as e:
+        error = {"status": "failed", "message": "Error Occured", "error":  str(e)}
+        return error, 400
+
+    except Exception as e:
+        logging.error(str(e))
+        error = {"status": "failed", "message": "Error Occured", "error":  str(e)}
+        return error, 500
+
+
 @ml_models.route('/update_model/<string:model_id>', methods=['PUT'])
 @body(ml_model_schema)
 @authenticate(token_auth)
@@ -121,7 +223,7 @@ def generate_semantics(model_id):
     """Generate semantic description"""
     try:
         mlflow.set_tracking_uri(settings.MLFLOW_URI)
-        semantic_manager = MlSemanticManager('data/cordsml.rdf')
+        semantic_manager = SharedMlSemanticManager()
         
         ml_flow_run_id = new_model.get_mlflow_run_id(model_id)
         logging.info("run id retrieved :%s", ml_flow_run_id)
@@ -1,9 +1,13 @@
 from flask import request, Response, json, Blueprint, jsonify, abort
-from apifairy import body, other_responses, response, authenticate
+from apifairy import arguments, body, other_responses, response, authenticate
 from src import basic_auth, token_auth
 import logging
 from config import settings
 from src.models.policy_model import PolicyModel, PolicyPayload
+from src.models.error_model import ErrorReponseSchema
+from src.models.query_model import ListArgsSchema
+from src.storage import InvalidQuery
+from src.services.idempotency import idempotent
 
 logging.basicConfig(level=logging.DEBUG)  
 
@@ -26,6 +30,7 @@ new_policy = PolicyModel()
 
 @policy_blueprint.route('/add_policy', methods = ["POST"])
 #@authenticate(token_auth)
+@idempotent
 @body(PolicyPayload)
 def add_policy(kwargs):
     """Add a new policy and link it to a resource"""
@@ -73,6 +78,25 @@ def get_policy(resource_id):
         abort(404)
 
 
+@policy_blueprint.route('/list', methods=["GET"])
+#@authenticate(token_auth)
+@arguments(ListArgsSchema)
+@other_responses({400: ErrorReponseSchema})
+def list_policies(args):
+    """List the policies one page at a time"""
+    try:
+        return new_policy.list_policies(limit=args['limit'], after=args['after'], fields=args.get('fields')), 200
+
+    except InvalidQuery as e:
+        error = {"status": "failed", "message": "Error Occured", "error": str(e)}
+        return error, 400
+
+    except Exception as e:
+        error = {"status": "failed", "message": "Error Occured", "error": str(e)}
+        logging.error("Error Occured %s", error)
+        return error, 500
+
+
 @policy_blueprint.route('/remove_policy/<string:policy_id>', methods = ["DELETE"])
 # @response(MLModelSchemaResponse)
 # @other_responses({404: 'Entry not found'})
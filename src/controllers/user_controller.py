@@ -59,4 +59,20 @@ def get_auth_token():
     user = basic_auth.current_user()
     token = user.generate_auth_token()
 
-    return dict(token=token)
\ No newline at end of file
+    return dict(token=token)
+
+
+
+@users_blueprint.route('/revoke-auth-token', methods=['POST'])
+@authenticate(token_auth)
+def revoke_auth_token():
+    """Revoke the authentication token used for this request"""
+    try:
+        user = User()
+        user.auth_token = token_auth.get_auth().token
+        user.revoke_auth_token()
+        return {"status": "success"}, 200
+
+    except Exception as e:
+        error = {"status": "failed", "message": "Error Occured", "error":  str(e)}
+        return error, 500
@@ -1,6 +1,7 @@
 
-from tinydb import TinyDB, Query
+from tinydb import Query
 from src import ma
+from src.storage import get_db
 import re
 import hashlib
 import json
@@ -123,7 +124,8 @@ class DataSpaceConnector():
         Initialize the connection to the database.
         :param db_path: Path to the TinyDB database file.
         """
-        self.db = TinyDB(db_path)
+        self.db = get_db(db_path)
+        self.connectors = self.db.table("connectors")
 
     def add_connector(self, id, name, type, description, public_key, access_url, reverseProxyUrl):
         """
@@ -150,13 +152,12 @@ class DataSpaceConnector():
             'timestamp': str(datetime.now().isoformat())
         }
         
-        ConnectorQuery = Query()
-        found = self.db.search(ConnectorQuery.id == id)
+        found = self.connectors.lookup(id=id)
         if found:
             # If the ID already exists, return an error message
             return False, 409
 
-        if self.db.insert(document):
+        if self.connectors.insert(document):
                 return document, 201
         else:
             return False, 500
@@ -169,13 +170,23 @@ class DataSpaceConnector():
         :param id: Identifier for the connector.
         :return: Connector document or None if not found.
         """
-        ConnectorQuery = Query()
-        result = self.db.search(ConnectorQuery.id == id)
+        result = self.connectors.lookup(id=id)
         if result:
             return result[0]
         else:
             return None
 
+    def list_connectors(self, limit=None, after=None, fields=None):
+        """
+        List the connectors in a stable order, one page at a time.
+        :param limit: Maximum number of connectors to return.
+        :param after: The next_cursor of the previous page.
+        :param fields: Names of the fields to return, all fields if not given.
+        :return: Dictionary with the connectors of the page and the cursor of the next page.
+        """
+        page = self.connectors.query(limit=limit, cursor=after, fields=fields)
+        return {'results': page.items, 'next_cursor': page.next_cursor}
+
     def update_connector(self, id, **updates):
         """
         Update an existing connector's details based on the provided updates.
@@ -184,12 +195,11 @@ class DataSpaceConnector():
         :param updates: A dictionary of attributes to update.
         :return: Updated document or False if the update failed.
         """
-        ConnectorQuery = Query()
-        found = self.db.search(ConnectorQuery.id == id)
+        found = self.connectors.lookup(id=id)
         if not found:
             return False, 404
 
-        updated_count = self.db.update(updates, ConnectorQuery.id == id)
+        updated_count = len(self.connectors.update(updates, doc_ids=[doc.doc_id for doc in found]))
         if updated_count > 0:
             return self.get_connector(id)
         else:
@@ -1,7 +1,9 @@
 
-from tinydb import TinyDB, Query, table
+from tinydb import Query, table
 from tinydb.table import Document
 from src import ma
+from src.storage import get_db
+from src.storage.ids import generate_id, id_scheme
 import re
 import hashlib
 import json
@@ -18,9 +20,11 @@ import zipfile
 
 from src.models.ml_model import MlModel
 from src.models.fl_service import FLService
+from src.models.policy_model import PolicyModel, ResourcePolicySchema
 
 model = MlModel()
 fl_service = FLService()
+policy_model = PolicyModel()
 
 
 class DataSpaceResourceSchemaResponse(ma.Schema):
@@ -74,6 +78,15 @@ class DataSpaceResourceSchema(ma.Schema):
     )
 
 
+class BulkResourceSchema(DataSpaceResourceSchema):
+    """Schema of a resource created together with its policies."""
+    policies = fields.List(
+        fields.Nested(ResourcePolicySchema),
+        missing=list,
+        description="Policies linked to the resource."
+    )
+
+
 class DataSpaceResourceDescriptionSchema(ma.Schema):
     """Schema a Data Space Connector."""
     resource_id = fields.String(
@@ -181,7 +194,7 @@ class DataSpaceResource():
         Initialize the connection to the database.
         :param db_path: Path to the TinyDB database file.
         """
-        self.db = TinyDB(db_path)
+        self.db = get_db(db_path)
         self.resource = self.db.table("resource")
 
     def create_resource(self, connector_id, asset_id, _type='model'):
@@ -194,24 +207,7 @@ class DataSpaceResource():
         
         :return: Returns the resource document with a hash and timestamp if successfully inserted, otherwise returns False.
         """
-        # Create timestamp for the creation moment
-        timestamp = str(datetime.now().isoformat())
-        
-        # Prepare the document
-        document = {
-            'connector_id': connector_id,
-            'asset_id': asset_id,
-            'type': _type,
-            'timestamp': timestamp,
-            'doc_type': 'resource',
-        }
-        
-        # Convert document to string and encode it to generate a hash
-        document_string = str(document).encode('utf-8')
-        hash_digest = hashlib.sha256(document_string).hexdigest()
-
-        # Add hash to the document
-        document['resource_id'] = hash_digest
+        document = self._build_resource(connector_id, asset_id, _type)
 
         # Insert the new resource into the database
         logging.info("Adding the resource : {0}".format(str(document)))
@@ -220,6 +216,44 @@ class DataSpaceResource():
         else:
             return False, 500
         
+    def create_resources(self, entries):
+        """
+        Create many resources together with their policies in one transaction.
+
+        Either every resource and policy is stored or, if a write fails,
+        none of them is.
+
+        :param entries: List of dictionaries with connector_id, asset_id, type and a list of
+                        policies, each a dictionary with policy_type and policy_metadata.
+        :return: List of the created resource documents in the given order, each with
+                 the created policy documents under 'policies'.
+        """
+        documents = []
+        resource_ids = set()
+        for entry in entries:
+            document = self._build_resource(entry['connector_id'], entry['asset_id'], entry.get('type', 'model'))
+            # Equal resources built within the same microsecond get the same hash
+            while document['resource_id'] in resource_ids:
+                document = self._build_resource(entry['connector_id'], entry['asset_id'], entry.get('type', 'model'))
+            resource_ids.add(document['resource_id'])
+            documents.append(document)
+
+        requested = [
+            (document['resource_id'], policy['policy_type'], policy['policy_metadata'])
+            for document, entry in zip(documents, entries) for policy in entry.get('policies', [])
+        ]
+
+        logging.info("Adding {0} resources with {1} policies".format(len(documents), len(requested)))
+        with self.db.transaction():
+            if documents:
+                self.resource.insert_multiple(documents)
+            policies = policy_model.add_policies(requested)
+
+        policies_by_resource = {}
+        for policy in policies:
+            policies_by_resource.setdefault(policy['resource_id'], []).append(policy)
+        return [dict(document, policies=policies_by_resource.get(document['resource_id'], [])) for document in documents]
+
     def get_resource(self, resource_id):
         """
         Retrieve a resource by its hash (resource_id).
@@ -227,13 +261,37 @@ class DataSpaceResource():
         :param resource_id: The hash identifier of the resource.
         :return: Resource document if found, otherwise None.
         """
-        ResourceQuery = Query()
-        result = self.resource.search(ResourceQuery.resource_id == resource_id)
+        result = self.resource.snapshot().lookup(resource_id=resource_id)
         if result:
             return result[0]
         else:
             return None
 
+    def get_resources(self, resource_ids):
+        """
+        Retrieve many resources by their hashes (resource_id) in one pass.
+
+        :param resource_ids: The hash identifiers of the resources.
+        :return: Dictionary with the found resources in the requested order and the IDs not found.
+        """
+        resource_ids = list(dict.fromkeys(resource_ids))
+        found = self.resource.lookup_many('resource_id', resource_ids)
+        return {
+            'found': [found[resource_id][0] for resource_id in resource_ids if resource_id in found],
+            'missing': [resource_id for resource_id in resource_ids if resource_id not in found],
+        }
+
+    def list_resources(self, limit=None, after=None, fields=None):
+        """
+        List the resources in a stable order, one page at a time.
+        :param limit: Maximum number of resources to return.
+        :param after: The next_cursor of the previous page.
+        :param fields: Names of the fields to return, all fields if not given.
+        :return: Dictionary with the resources of the page and the cursor of the next page.
+        """
+        page = self.resource.query(limit=limit, cursor=after, fields=fields)
+        return {'results': page.items, 'next_cursor': page.next_cursor}
+
     def update_resource(self, resource_id, **updates):
         """
         Update details of an existing resource.
@@ -242,20 +300,25 @@ class DataSpaceResource():
         :param updates: Keyword arguments representing the fields to update.
         :return: Updated resource document or False if update fails.
         """
-        ResourceQuery = Query()
-        found = self.resource.search(ResourceQuery.resource_id == resource_id)
+        found = self.resource.lookup(resource_id=resource_id)
         if not found:
             return False, 404
 
-        # Update the resource in the database
-        updated_count = self.db.update(updates, ResourceQuery.resource_id == resource_id)
-        if updated_count > 0:
-            # Recalculate hash if the document changes
-            updated_document = self.db.get(ResourceQuery.resource_id == resource_id)
+        def apply_updates(document):
+            if id_scheme() == 'ulid':
+                # The ID keeps the creation time, so it does not change with the contents
+                return dict(updates)
+            # Recalculate hash from the updated document
+            updated_document = dict(document)
+            updated_document.update(updates)
             updated_document_string = str(updated_document).encode('utf-8')
             new_hash = hashlib.sha256(updated_document_string).hexdigest()
-            self.resource.update({'resource_id': new_hash}, ResourceQuery.resource_id == resource_id)
-            return self.resource.get(ResourceQuery.resource_id == new_hash), 200
+            return dict(updates, resource_id=new_hash)
+
+        # Update the resource in the database, retrying on concurrent changes
+        updated_document = self.resource.modify(found[0].doc_id, apply_updates)
+        if updated_document is not None:
+            return updated_document, 200
         else:
             return False, 500
         
@@ -278,9 +341,7 @@ class DataSpaceResource():
                 might vary depending on the connector specified.
         """
     
-        ResourceQuery = Query()
-    
-        found = self.resource.search(ResourceQuery.resource_id == resource_id)
+        found = self.resource.lookup(resource_id=resource_id)
 
         if found:
             response = {
@@ -321,14 +382,32 @@ class DataSpaceResource():
             return False, 500
 
 
+    def _build_resource(self, connector_id, asset_id, _type):
+        # Create timestamp for the creation moment
+        timestamp = str(datetime.now().isoformat())
+        
+        # Prepare the document
+        document = {
+            'connector_id': connector_id,
+            'asset_id': asset_id,
+            'type': _type,
+            'timestamp': timestamp,
+            'doc_type': 'resource',
+        }
+        
+        # Convert document to string and encode it to generate a hash
+        document_string = str(document).encode('utf-8')
+
+        # Add hash to the document
+        document['resource_id'] = generate_id(lambda: hashlib.sha256(document_string).hexdigest())
+        return document
+
     def download_resource(self, resource_id, sink_ip, port):
         
         filename = "artifacts/{0}.zip".format(resource_id)
         save_as = "{0}.zip".format(resource_id)
 
-        ResourceQuery = Query()
-    
-        found = self.resource.search(ResourceQuery.resource_id == resource_id)
+        found = self.resource.lookup(resource_id=resource_id)
 
         if found:
             print(found)
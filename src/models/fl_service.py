@@ -1,13 +1,17 @@
 
-from tinydb import TinyDB, Query,table
+from tinydb import Query,table
 from tinydb.table import Document
 from src import ma
+from src.storage import get_db, DEFAULT_QUERY_LIMIT
+from src.storage.ids import generate_id
+from src.models.service_summary import get_summary_view, SERVICES_TABLE, RESOURCES_TABLE, POLICIES_TABLE
+import time
 import re
 import hashlib
 import json
 from datetime import datetime
 from marshmallow import Schema, fields, validate
-from cords_semantics.semantics import FlSemanticManager
+from src.services.ontology import SharedFlSemanticManager
 from cords_semantics.mlflow import convert_tags_to_dictionary, extract_mlflow_semantics
 import mlflow
 import logging
@@ -191,8 +195,9 @@ class FLService():
         Initialize the connection to the database.
         :param db_path: Path to the TinyDB database file.
         """
-        self.db = TinyDB(db_path)
+        self.db = get_db(db_path)
         self.fl_services = self.db.table("fl_services")
+        self.summary_view = get_summary_view(self.db)
         self.Model = Query()
 
     def add_fl_service(self, name, description, fl_session,
@@ -226,7 +231,7 @@ class FLService():
         }
 
         # Generate a unique model ID based on document content
-        fl_service_id = self._create_hashed_id(document)
+        fl_service_id = generate_id(lambda: self._create_hashed_id(document))
         document["fl_service_id"] = fl_service_id
 
         # Validate the MLFlow model path before insertion
@@ -247,8 +252,8 @@ class FLService():
         :param published_status: The new published status (True/False).
         :return: The updated document if successful, False otherwise.
         """
-        Model = Query()
-        if self.fl_services.update({'publised': published_status, 'timestamp': str(datetime.now().isoformat())}, Model.fl_service_id == fl_service_id):
+        found = self.fl_services.lookup(fl_service_id=fl_service_id)
+        if found and self.fl_services.update({'publised': published_status, 'timestamp': str(datetime.now().isoformat())}, doc_ids=[doc.doc_id for doc in found]):
             return self.get_fl_service(fl_service_id)
         else:
             logging.error(f"Failed to update the published status for FL service with ID {fl_service_id}.")
@@ -264,10 +269,12 @@ class FLService():
         :ml_flow_model_path description: MLFlow Model Path as recorded in Path variable of MLFlow
         """
 
-        Model = Query()
+        found = self.fl_services.lookup(fl_service_id=fl_service_id)
+        if not found:
+            return False
     
         if self.fl_services.update({'name': name, 'description': description, 
-                           'ml_flow_model_path': ml_flow_model_path, 'timestamp': str(datetime.now().isoformat())}, Model.fl_service_id ==fl_service_id):
+                           'ml_flow_model_path': ml_flow_model_path, 'timestamp': str(datetime.now().isoformat())}, doc_ids=[doc.doc_id for doc in found]):
             return self.get_model(fl_service_id)
         else:
             return False
@@ -278,8 +285,8 @@ class FLService():
         :param fl_service_id: The ID of the FL service to remove.
         :return: True if the service was removed, False otherwise.
         """
-        Model = Query()
-        result = self.fl_services.remove(Model.fl_service_id == fl_service_id)
+        found = self.fl_services.lookup(fl_service_id=fl_service_id)
+        result = self.fl_services.remove(doc_ids=[doc.doc_id for doc in found]) if found else []
         if result:
             logging.info(f"FL service with ID {fl_service_id} removed successfully.")
             return True
@@ -292,14 +299,26 @@ class FLService():
         Retrieve a model by its ID.
         :param model_id: The ID of the model to retrieve.
         """
-        Model = Query()
-        model = self.fl_services.search(Model.fl_service_id == fl_service_id)
+        model = self.fl_services.snapshot().lookup(fl_service_id=fl_service_id)
         if model:
             return model
         else:
             return False
         
 
+    def get_fl_services(self, fl_service_ids):
+        """
+        Retrieve many FL services by their IDs in one pass.
+        :param fl_service_ids: The IDs of the FL services to retrieve.
+        :return: Dictionary with the found services in the requested order and the IDs not found.
+        """
+        fl_service_ids = list(dict.fromkeys(fl_service_ids))
+        found = self.fl_services.lookup_many('fl_service_id', fl_service_ids)
+        return {
+            'found': [found[fl_service_id][0] for fl_service_id in fl_service_ids if fl_service_id in found],
+            'missing': [fl_service_id for fl_service_id in fl_service_ids if fl_service_id not in found],
+        }
+
     def get_all_services(self):
         """
         Retrieve all documents in the table 'fl_services'.
@@ -308,60 +327,102 @@ class FLService():
         services = self.fl_services.all()
         return services if services else []
 
-    def get_service_summary(self):
+    def iter_services(self):
         """
-        Retrieve all documents from fl_services, resources, and policies tables joined by asset_id and resource_id.
+        Iterate over all FL services without loading the whole table at once.
         """
-        logging.info("Retrieving service summary by joining fl_services, resources, and policies tables.")
-        Model = Query()
-        services = self.fl_services.all()
-        resources = self.db.table("resource").all()
-        policies = self.db.table("policies").all()
-
-        logging.debug(f"Retrieved {len(services)} services, {len(resources)} resources, and {len(policies)} policies from the database.")
-
-        # Create a dictionary of resources indexed by asset_id for quick lookup
-        resources_by_asset_id = {resource["asset_id"]: resource for resource in resources if "asset_id" in resource}
-        logging.debug(f"Created resources lookup dictionary with {len(resources_by_asset_id)} entries.")
-
-        # Create a dictionary of policies indexed by resource_id for quick lookup
-        policies_by_resource_id = {}
-        for policy in policies:
-            resource_id = policy.get("resource_id")
-            if resource_id:
-                if resource_id not in policies_by_resource_id:
-                    policies_by_resource_id[resource_id] = []
-                policies_by_resource_id[resource_id].append(policy)
-        logging.debug(f"Created policies lookup dictionary with {len(policies_by_resource_id)} entries.")
-
-        # Join services with resources and policies
-        joined_data = []
-        for service in services:
-            asset_id = service.get("fl_service_id")
-            if asset_id and asset_id in resources_by_asset_id:
-                resource = resources_by_asset_id[asset_id]
-                resource_id = resource.get("resource_id")
-                joined_entry = {**service, **resource}
-                joined_entry["policies"] = policies_by_resource_id.get(resource_id, [])
-                joined_data.append(joined_entry)
-                logging.debug(f"Joined service with asset_id {asset_id} to corresponding resource and policies.")
-            else:
-                if asset_id:
-                    logging.warning(f"No matching resource found for service with asset_id {asset_id}.")
-                else:
-                    logging.warning("Service does not have an asset_id.")
-
-        logging.info(f"Returning {len(joined_data)} joined entries.")
-        return joined_data if joined_data else []
+        return self.fl_services.scan()
+
+    def list_services(self, limit=None, after=None, fields=None):
+        """
+        List the FL services in a stable order, one page at a time.
+        :param limit: Maximum number of FL services to return.
+        :param after: The next_cursor of the previous page.
+        :param fields: Names of the fields to return, all fields if not given.
+        :return: Dictionary with the FL services of the page and the cursor of the next page.
+        """
+        page = self.fl_services.query(limit=limit, cursor=after, fields=fields)
+        return {'results': page.items, 'next_cursor': page.next_cursor}
+
+    def get_service_summary(self, limit=None, after=None):
+        """
+        Retrieve the FL services joined with their resource and the policies of that resource.
+
+        The join is kept up to date incrementally by the ServiceSummaryView,
+        so this only copies the requested rows.
+
+        :param limit: Maximum number of entries to return, all entries if neither limit nor after is given.
+        :param after: The next_cursor of the previous page.
+        :return: List of joined entries, or a dictionary with the entries of the page and the next cursor.
+        """
+        logging.info("Retrieving service summary from the materialized view.")
+        if limit is None and after is None:
+            rows, _ = self.summary_view.rows()
+            logging.info(f"Returning {len(rows)} joined entries.")
+            return rows
+
+        rows, next_cursor = self.summary_view.rows(limit=limit or DEFAULT_QUERY_LIMIT, after=after)
+        return {'results': rows, 'next_cursor': next_cursor}
+
+    def iter_service_summary(self):
+        """
+        Iterate over the joined entries of get_service_summary, a batch at a time.
+        """
+        return self.summary_view.iter_rows()
+
+    def iter_service_changes(self, after=None, duration=None, heartbeat=15):
+        """
+        Iterate over the changes of FL services, resources and policies as they are made.
+
+        The changes are read from the change feed of the storage engine, so
+        a client can continue after the last change it received.
+
+        :param after: seq of the last change already received, only changes made from now on if not given.
+        :param duration: Seconds after which the iteration ends, never if not given.
+        :param heartbeat: Seconds after which None is yielded if nothing changed in between.
+        :return: Generator of ChangeEvents, and of None while waiting.
+        """
+        feed = self.db.changes
+        tables = {SERVICES_TABLE, RESOURCES_TABLE, POLICIES_TABLE}
+        if after is None:
+            after = feed.last_seq()
+        deadline = None if duration is None else time.monotonic() + duration
+        while deadline is None or time.monotonic() < deadline:
+            timeout = heartbeat if deadline is None else max(min(heartbeat, deadline - time.monotonic()), 0)
+            if not feed.wait(after, timeout=timeout):
+                yield None
+                continue
+            # Read all tables, so the events of other tables are only skipped once
+            for event in feed.events(after, DEFAULT_QUERY_LIMIT):
+                after = event.seq
+                if event.table in tables:
+                    yield event
+
+    def tracks_service_changes(self):
+        """
+        Whether the change feed records the changes of FL services, resources and policies.
+        """
+        return {SERVICES_TABLE, RESOURCES_TABLE, POLICIES_TABLE} <= self.db.changes.tables
+
+    def missed_service_changes(self, after):
+        """
+        Whether changes following ``after`` were already dropped from the change feed.
+        :param after: seq of the last change the client received.
+        """
+        return self.db.changes.first_seq() > after + 1
         
 
-    def query_models(self, search_criteria):
+    def query_models(self, search_criteria, sort=None, limit=None, cursor=None):
         """
-        Query models based on a search criteria.
-        :param search_criteria: A dictionary with field values to search for.
+        Query FL services based on a search criteria, one page at a time.
+        :param search_criteria: A dictionary of field values, or of operator dicts with eq, gt, gte, lt, lte or prefix.
+        :param sort: Field names to order by, prefixed with - for descending order.
+        :param limit: Maximum number of FL services to return.
+        :param cursor: The next_cursor of the previous page.
+        :return: Dictionary with the matching FL services and the cursor of the next page.
         """
-        results = self.fl_services.search(self.Model.matches(search_criteria))
-        return results if results else "No models found matching the criteria."
+        page = self.fl_services.query(search_criteria, sort=sort, limit=limit, cursor=cursor)
+        return {'results': page.items, 'next_cursor': page.next_cursor}
     
     def get_mlflow_run_id(self, model_id):
         """
@@ -412,7 +473,7 @@ class FLService():
     def generate_semantics(self, fl_service_id):
         """Generate semantic description"""
 
-        fl_semantic_manager = FlSemanticManager('data/cords_federated_learning.rdf')
+        fl_semantic_manager = SharedFlSemanticManager()
 
         service = self.get_fl_service(fl_service_id)[0]
         client_id = service["fl_client"]
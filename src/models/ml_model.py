@@ -1,13 +1,15 @@
 
-from tinydb import TinyDB, Query,table
+from tinydb import Query,table
 from tinydb.table import Document
 from src import ma
+from src.storage import get_db
+from src.storage.ids import generate_id
 import re
 import hashlib
 import json
 from datetime import datetime
 from marshmallow import Schema, fields, validate
-from cords_semantics.semantics import MlSemanticManager
+from src.services.ontology import SharedMlSemanticManager
 from cords_semantics.mlflow import convert_tags_to_dictionary, extract_mlflow_semantics
 import mlflow
 import logging
@@ -15,6 +17,9 @@ from config import settings
 
 logging.basicConfig(level=logging.DEBUG)  
 
+# Artifact path of a model as recorded by MLflow
+MLFLOW_PATH_PATTERN = re.compile(r"^mlflow-artifacts:/\d+/[a-zA-Z0-9]+/artifacts/[a-zA-Z0-9_\-]+$")
+
 class MLSemanticSchema(ma.Schema):
     """Schema defining the semantics of a registeed ML Model."""
     model_id =  fields.String(
@@ -94,7 +99,8 @@ class MlModel():
         Initialize the connection to the database.
         :param db_path: Path to the TinyDB database file.
         """
-        self.db = TinyDB(db_path)
+        self.db = get_db(db_path)
+        self.models = self.db.table("ml_models")
         self.Model = Query()
 
     def add_model(self, name, version, description, ml_flow_model_path):
@@ -105,18 +111,18 @@ class MlModel():
         :param description: A short description of the model.
         :ml_flow_model_path description: MLFlow Model Path as recorded in Path variable of MLFlow
         """
-        unique_id = max(self.db.all(), key=lambda x: x.doc_id).doc_id + 1 if self.db.all() else 1
+        unique_id = self.models.allocate_id()
         document = {'name': name, 'version': version, 'description': description, 'ml_flow_model_path': ml_flow_model_path, 'doc_id': unique_id}
         document['timestamp'] = str(datetime.now().isoformat())
 
-        model_id = self._create_hashed_id(document)
+        model_id = generate_id(lambda: self._create_hashed_id(document))
         document['model_id'] = model_id
       
 
         if self._validate_mlflow_input(document['ml_flow_model_path']):
             logging.info("Adding the model : {0}".format(str(document)))
             logging.info("Unique ID : {0}".format(str(unique_id)))
-            if self.db.insert(table.Document(document, doc_id = unique_id)):
+            if self.models.insert(table.Document(document, doc_id = unique_id)):
                 return document
             else:
                 logging.info("Fail to insert the model")
@@ -124,6 +130,40 @@ class MlModel():
         else:
             raise ValueError("Invalid ml_flow_model_path")
     
+    def add_models(self, models):
+        """
+        Add many models to the database in one write.
+
+        The paths are validated first, then the document IDs of the valid
+        models are reserved at once and all of them are inserted in one
+        transaction, so either every valid model is stored or none is.
+
+        :param models: List of dictionaries with name, version, description and ml_flow_model_path.
+        :return: List with the stored document, or the error message, of every model in the given order.
+        """
+        valid = [bool(MLFLOW_PATH_PATTERN.fullmatch(model['ml_flow_model_path'])) for model in models]
+        unique_ids = iter(self.models.allocate_ids(sum(valid))) if any(valid) else iter(())
+        timestamp = str(datetime.now().isoformat())
+
+        results = []
+        documents = []
+        for model, is_valid in zip(models, valid):
+            if not is_valid:
+                results.append("Invalid ml_flow_model_path")
+                continue
+            unique_id = next(unique_ids)
+            document = {'name': model['name'], 'version': model['version'], 'description': model['description'],
+                        'ml_flow_model_path': model['ml_flow_model_path'], 'doc_id': unique_id, 'timestamp': timestamp}
+            document['model_id'] = generate_id(lambda: self._create_hashed_id(document))
+            documents.append(table.Document(document, doc_id=unique_id))
+            results.append(document)
+
+        if documents:
+            logging.info("Adding {0} models".format(len(documents)))
+            with self.db.transaction():
+                self.models.insert_multiple(documents)
+        return results
+
     def update_model(self, model_id, name, version, description, ml_flow_model_path):
         """
         Update a new model to the database.
@@ -134,10 +174,13 @@ class MlModel():
         :ml_flow_model_path description: MLFlow Model Path as recorded in Path variable of MLFlow
         """
 
-        Model = Query()
+        found = self.models.lookup(model_id=model_id)
+        if not found:
+            return False
     
-        if self.db.update({'name': name, 'version': version, 'description': description, 
-                           'ml_flow_model_path': ml_flow_model_path, 'timestamp': str(datetime.now().isoformat())}, Model.model_id ==model_id):
+        updates = {'name': name, 'version': version, 'description': description,
+                   'ml_flow_model_path': ml_flow_model_path, 'timestamp': str(datetime.now().isoformat())}
+        if self.models.modify(found[0].doc_id, lambda document: updates) is not None:
             return self.get_model(model_id)
         else:
             return False
@@ -147,20 +190,47 @@ class MlModel():
         Retrieve a model by its ID.
         :param model_id: The ID of the model to retrieve.
         """
-        Model = Query()
-        model = self.db.search(Model.model_id == model_id)
+        model = self.models.snapshot().lookup(model_id=model_id)
         if model:
             return model
         else:
             return False
 
-    def query_models(self, search_criteria):
+    def get_models(self, model_ids):
         """
-        Query models based on a search criteria.
-        :param search_criteria: A dictionary with field values to search for.
+        Retrieve many models by their IDs in one pass.
+        :param model_ids: The IDs of the models to retrieve.
+        :return: Dictionary with the found models in the requested order and the IDs not found.
         """
-        results = self.db.search(self.Model.matches(search_criteria))
-        return results if results else "No models found matching the criteria."
+        model_ids = list(dict.fromkeys(model_ids))
+        found = self.models.lookup_many('model_id', model_ids)
+        return {
+            'found': [found[model_id][0] for model_id in model_ids if model_id in found],
+            'missing': [model_id for model_id in model_ids if model_id not in found],
+        }
+
+    def list_models(self, limit=None, after=None, fields=None):
+        """
+        List the registered models in a stable order, one page at a time.
+        :param limit: Maximum number of registered models to return.
+        :param after: The next_cursor of the previous page.
+        :param fields: Names of the fields to return, all fields if not given.
+        :return: Dictionary with the registered models of the page and the cursor of the next page.
+        """
+        page = self.models.query(limit=limit, cursor=after, fields=fields)
+        return {'results': page.items, 'next_cursor': page.next_cursor}
+
+    def query_models(self, search_criteria, sort=None, limit=None, cursor=None):
+        """
+        Query models based on a search criteria, one page at a time.
+        :param search_criteria: A dictionary of field values, or of operator dicts with eq, gt, gte, lt, lte or prefix.
+        :param sort: Field names to order by, prefixed with - for descending order.
+        :param limit: Maximum number of models to return.
+        :param cursor: The next_cursor of the previous page.
+        :return: Dictionary with the matching models and the cursor of the next page.
+        """
+        page = self.models.query(search_criteria, sort=sort, limit=limit, cursor=cursor)
+        return {'results': page.items, 'next_cursor': page.next_cursor}
     
     def get_mlflow_run_id(self, model_id):
         """
@@ -196,14 +266,8 @@ class MlModel():
         return hash_obj.hexdigest()
     
     def _validate_mlflow_input(self, input_string):
-        # Define the regex pattern
-        pattern = r"^mlflow-artifacts:/\d+/[a-zA-Z0-9]+/artifacts/[a-zA-Z0-9_\-]+$"
-
-        # Compile the regex pattern for efficiency if used repeatedly
-        regex = re.compile(pattern)
-
         # Use the fullmatch method to check if the entire string conforms to the pattern
-        if regex.fullmatch(input_string):
+        if MLFLOW_PATH_PATTERN.fullmatch(input_string):
             return True
         else:
             return False
@@ -211,7 +275,7 @@ class MlModel():
     def generate_semantics(self, model_id):
         try:
             mlflow.set_tracking_uri(settings.MLFLOW_URI)
-            semantic_manager = MlSemanticManager('data/cordsml.rdf')
+            semantic_manager = SharedMlSemanticManager()
             
             ml_flow_run_id = self.get_mlflow_run_id(model_id)
             logging.info("run id retrieved :%s", ml_flow_run_id)
@@ -1,5 +1,6 @@
-from tinydb import TinyDB, Query, table
+from tinydb import Query, table
 from src import ma
+from src.storage import get_db
 import re
 import hashlib
 import json
@@ -45,7 +46,9 @@ class PIPModel():
         :param db_path: Path to the TinyDB database file.
         """
         
-        self.db = TinyDB(db_path)
+        self.db = get_db(db_path)
+        self.pip = self.db.table("pip")
+        self.policies = self.db.table("policies")
 
     # adding a access count
 
@@ -57,7 +60,7 @@ class PIPModel():
         logging.info("Access for the resource ID: {0}".format(resource_id))
 
         
-        policy_docs = self.db.search((PIP.resource_id == resource_id) & (PIP.doc_type == 'policy'))
+        policy_docs = self.policies.lookup(resource_id=resource_id)
 
         if len(policy_docs) == 0:
             raise ValueError("No policy available for given resource")
@@ -69,22 +72,29 @@ class PIPModel():
             else:
                 policy_count = 0
 
-        access_count_doc = self.db.search((PIP.resource_id == resource_id) & (PIP.doc_type == 'pip') & (PIP.consumer_uri == consumer_uri))
-        if len(access_count_doc) == 0:
-            unique_id = max(self.db.all(), key=lambda x: x.doc_id).doc_id + 1 if self.db.all() else 1
+        def new_access_record(unique_id):
             document = {'doc_type': 'pip', 'consumer_uri': consumer_uri, 'resource_id': resource_id, 'access_count': policy_count-1, 'doc_id': unique_id}
-            status = self.db.insert(table.Document(document, doc_id = unique_id))
-            logging.info("Updating the access record status {0}".format(str(status)))
             logging.info(str(document))
+            return table.Document(document, doc_id = unique_id)
+
+        access_count_doc, created = self.pip.insert_if_absent(new_access_record, resource_id=resource_id,
+                                                              consumer_uri=consumer_uri)
+        if created:
+            logging.info("Updating the access record status {0}".format(str([access_count_doc.doc_id])))
             return policy_count
-            
-        else:
-            access_count = int(access_count_doc[0]['access_count'])
-            document = {'doc_type': 'pip', 'consumer_uri': consumer_uri, 'resource_id': resource_id, 'access_count': access_count-1}
-            status = self.db.update(document, (PIP.resource_id == resource_id) & (PIP.doc_type == 'pip') & (PIP.consumer_uri == consumer_uri))
-            logging.info("Updating the access record status {0}".format(str(status)))
-            logging.info(str(document))
-            return access_count
+
+        # Decrement with compare-and-swap, so concurrent accesses are all counted
+        previous = {}
+        def decrement(doc):
+            previous['access_count'] = int(doc['access_count'])
+            return {'access_count': previous['access_count']-1}
+
+        status = self.pip.modify(access_count_doc.doc_id, decrement)
+        if status is None:
+            # The record was removed meanwhile, start counting anew
+            return self.get_access_count(consumer_uri, targetUri)
+        logging.info("Updating the access record status {0}".format(str(status)))
+        return previous['access_count']
 
 
 
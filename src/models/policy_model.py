@@ -1,7 +1,9 @@
 
-from tinydb import TinyDB, Query, table
+from tinydb import Query, table
 from tinydb.table import Document
 from src import ma
+from src.storage import get_db
+from src.storage.ids import generate_id
 import re
 import hashlib
 import json
@@ -37,6 +39,20 @@ class PolicyPayload(ma.Schema):
     )
 
 
+class ResourcePolicySchema(ma.Schema):
+    """Schema defining a policy created together with its resource."""
+    policy_type = fields.String(
+        required=True,
+        validate=validate.Length(min=1), 
+        description="Type of the policy either: EVALUATION_TIME, DURATION, N_TIME, PURPOSE, ROLE"
+    )
+
+    policy_metadata = fields.Dict(
+        required=True,
+        validate=validate.Length(min=1), 
+        description="Policy type specific constraints and metadata"
+    )
+
 
 policies ={
     "access": []
@@ -51,7 +67,7 @@ class PolicyModel():
         :param db_path: Path to the TinyDB database file.
         """
         
-        self.db = TinyDB(db_path)
+        self.db = get_db(db_path)
         self.policies = self.db.table("policies")
         self.Model = Query()
         
@@ -80,12 +96,7 @@ class PolicyModel():
         :param policy_type: Type of the policy either: DURATION, N-TIME, PURPOSE, ROLE.
         :param metadata: Policy type specific constraints and metadata.
         """
-        document = {'resource_id': resource_id, 'policy_type': policy_type, 'policy_metadata': metadata}
-        policy_id = self._create_hashed_id(document)
-        document['doc_type'] = 'policy'
-        document['policy_id'] = policy_id
-        document['timestamp'] = str(datetime.now().isoformat())
-
+        document = self._build_policy(resource_id, policy_type, metadata)
 
         result = self.policies.insert(document)
         if result:
@@ -95,13 +106,33 @@ class PolicyModel():
             logging.error("Failed to add policy")
             return False
         
+    def add_policies(self, policies):
+        """
+        Add many policies in one write.
+        :param policies: List of (resource_id, policy_type, metadata) tuples.
+        :return: List of the added policy documents.
+        """
+        documents = []
+        policy_ids = set()
+        for resource_id, policy_type, metadata in policies:
+            document = self._build_policy(resource_id, policy_type, metadata)
+            # Equal policies built within the same microsecond get the same hash
+            while document['policy_id'] in policy_ids:
+                document = self._build_policy(resource_id, policy_type, metadata)
+            policy_ids.add(document['policy_id'])
+            documents.append(document)
+
+        if documents:
+            self.policies.insert_multiple(documents)
+            logging.debug(f"{len(documents)} policies added successfully")
+        return documents
+
     def get_policy(self, resource_id):
         """
         Retrieve policies linked to a resource.
         :param resource_id: ID of the resource.
         """
-        Policy = Query()
-        policies = self.policies.search(Policy.resource_id == resource_id)
+        policies = self.policies.snapshot().lookup(resource_id=resource_id)
         logging.debug(f"Policies retrieved for resource_id {resource_id}: {policies}")
         if policies:
             return policies
@@ -109,14 +140,27 @@ class PolicyModel():
             logging.warning(f"No policies found for resource_id {resource_id}")
             return False
         
+    def list_policies(self, limit=None, after=None, fields=None):
+        """
+        List the policies in a stable order, one page at a time.
+        :param limit: Maximum number of policies to return.
+        :param after: The next_cursor of the previous page.
+        :param fields: Names of the fields to return, all fields if not given.
+        :return: Dictionary with the policies of the page and the cursor of the next page.
+        """
+        page = self.policies.query(limit=limit, cursor=after, fields=fields)
+        return {'results': page.items, 'next_cursor': page.next_cursor}
+
     def remove_policy(self, policy_id):
         """
         Remove a policy linked to a resource.
         :param policy_id: ID of the policy.
         :return: True if the policy was removed, False otherwise.
         """
-        Policy = Query()
-        result = self.policies.remove(Policy.policy_id == policy_id)
+        found = self.policies.lookup(policy_id=policy_id)
+        if not found:
+            return False
+        result = self.policies.remove(doc_ids=[doc.doc_id for doc in found])
         if result:
             return True
         else:
@@ -130,6 +174,14 @@ class PolicyModel():
             data = json.load(file)
         return data
         
+    def _build_policy(self, resource_id, policy_type, metadata):
+        document = {'resource_id': resource_id, 'policy_type': policy_type, 'policy_metadata': metadata}
+        policy_id = generate_id(lambda: self._create_hashed_id(document))
+        document['doc_type'] = 'policy'
+        document['policy_id'] = policy_id
+        document['timestamp'] = str(datetime.now().isoformat())
+        return document
+
     def _create_hashed_id(self, document):
         # Serialize the document data to JSON format
         # Ensure consistent ordering by sorting keys
@@ -150,8 +202,7 @@ class PolicyModel():
     
     def formalize_policies(self, resource_id):
         logging.debug("========== Formalizing the policies =============")
-        Policy = Query()
-        policies = self.policies.search(Policy.resource_id == resource_id)
+        policies = self.policies.lookup(resource_id=resource_id)
         permissions = []
         fL_permissions = []
         print(policies)
@@ -0,0 +1,67 @@
+from src import ma
+from marshmallow import Schema, fields, validate
+from webargs.fields import DelimitedList
+from src.storage import MAX_QUERY_LIMIT
+
+
+class QuerySchema(ma.Schema):
+    """Schema of a paginated query over registered assets."""
+    filters = fields.Dict(
+        load_default=dict,
+        description="Field values to match. A value may be an object of operators: eq, gt, gte, lt, lte, prefix"
+    )
+    sort = fields.List(
+        fields.String(validate=validate.Length(min=1)),
+        load_default=None,
+        description="Field names to order by, prefixed with - for descending order"
+    )
+    limit = fields.Integer(
+        load_default=None,
+        validate=validate.Range(min=1, max=MAX_QUERY_LIMIT),
+        description="Maximum number of results of a page"
+    )
+    cursor = fields.String(
+        load_default=None,
+        description="The next_cursor of the previous page"
+    )
+
+
+class PageArgsSchema(ma.Schema):
+    """Query string arguments selecting a page."""
+    limit = fields.Integer(
+        load_default=None,
+        validate=validate.Range(min=1, max=MAX_QUERY_LIMIT),
+        description="Maximum number of entries of a page"
+    )
+    after = fields.String(
+        load_default=None,
+        description="The next_cursor of the previous page"
+    )
+
+
+class ListArgsSchema(PageArgsSchema):
+    """Query string arguments of a paginated list endpoint."""
+    # No load_default, the API spec can not render None as a default of a delimited list
+    fields = DelimitedList(
+        fields.String(validate=validate.Length(min=1)),
+        description="Comma separated names of the fields to return, all fields if not given"
+    )
+
+
+class BatchGetSchema(ma.Schema):
+    """Schema of a request resolving many entries by their IDs."""
+    ids = fields.List(
+        fields.String(validate=validate.Length(min=1)),
+        required=True,
+        validate=validate.Length(min=1, max=MAX_QUERY_LIMIT),
+        description="IDs of the entries to return"
+    )
+
+
+class ChangeStreamArgsSchema(ma.Schema):
+    """Query string arguments of a stream of change events."""
+    last_event_id = fields.Integer(
+        load_default=None,
+        validate=validate.Range(min=0),
+        description="ID of the last event received, used when the Last-Event-ID header is not sent"
+    )
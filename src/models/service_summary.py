@@ -0,0 +1,233 @@
+import bisect
+import base64
+import json
+import threading
+import logging
+
+from src.storage import InvalidQuery
+
+logging.basicConfig(level=logging.DEBUG)
+
+SERVICES_TABLE = 'fl_services'
+RESOURCES_TABLE = 'resource'
+POLICIES_TABLE = 'policies'
+
+
+class _GroupedDocuments():
+    """Copies of the documents of a table, grouped by the values of some fields."""
+
+    def __init__(self, *fields):
+        self.fields = fields
+        self.documents = {}
+        self._groups = {field: {} for field in fields}
+
+    def put(self, doc_id, document):
+        """
+        Store a document, or drop it if ``document`` is None.
+        :return: Dictionary of field to the values of the previous and the new version.
+        """
+        previous = self.documents.pop(doc_id, None)
+        if document is not None:
+            self.documents[doc_id] = dict(document)
+        keys = {}
+        for field, groups in self._groups.items():
+            keys[field] = set()
+            if previous is not None and field in previous:
+                keys[field].add(previous[field])
+                groups[previous[field]].discard(doc_id)
+            if document is not None and field in document:
+                keys[field].add(document[field])
+                groups.setdefault(document[field], set()).add(doc_id)
+        return keys
+
+    def group(self, field, key):
+        """
+        Return the IDs of the documents whose field equals a value, in ascending order.
+        """
+        return sorted(self._groups[field].get(key, ()))
+
+
+class ServiceSummaryView():
+    """
+    Materialized join of the FL services with their resource and the
+    policies of that resource, as served by the service summary.
+
+    The view listens to the writes of the three tables and only recomputes
+    the rows of the services a write affects, so a read is a page of
+    ready-made rows instead of a join over all three tables. It keeps its
+    own copies of the documents it needs, because table listeners must not
+    read other tables. When a table is reloaded as a whole the view is
+    dropped and built again on the next read.
+
+    Writes update the affected rows in place holding the lock of the view,
+    so a write costs as much as the rows it changes. Readers hold the same
+    lock only while they copy one page of rows.
+    """
+
+    def __init__(self, db):
+        """
+        :param db: The StorageEngine holding the tables.
+        """
+        self.db = db
+        self._lock = threading.Lock()
+        self._ready = False
+        # Ordered document IDs of the services and their rows, valid while ready
+        self._order = []
+        self._rows = {}
+        for name in (SERVICES_TABLE, RESOURCES_TABLE, POLICIES_TABLE):
+            db.table(name).add_listener(self._on_change)
+
+    def rows(self, limit=None, after=None):
+        """
+        Return the summary rows in the order the services were added.
+        :param limit: Maximum number of rows, all rows if not given.
+        :param after: The next_cursor of the previous page.
+        :return: Tuple of the rows and the cursor of the next page.
+        """
+        start_after = self._decode_cursor(after) if after else None
+        while True:
+            # Another process may have changed the tables, which drops the view
+            self.db.lock.sync()
+            self._ensure_built()
+            with self._lock:
+                if not self._ready:
+                    continue
+                order = self._order
+                start = bisect.bisect_right(order, start_after) if start_after is not None else 0
+                end = len(order) if limit is None else min(start + limit, len(order))
+                # Rows are replaced, never changed in place, so a shallow copy is enough
+                rows = [dict(self._rows[doc_id]) for doc_id in order[start:end]]
+                next_cursor = self._encode_cursor(order[end - 1]) if end < len(order) and rows else None
+                return rows, next_cursor
+
+    def iter_rows(self, batch_size=100):
+        """
+        Iterate over the summary rows, copying one batch of rows at a time.
+        :param batch_size: Number of rows copied per batch.
+        """
+        after = None
+        while True:
+            rows, after = self.rows(limit=batch_size, after=after)
+            yield from rows
+            if after is None:
+                return
+
+    # ----------------
+    # Helper Functions
+    # ----------------
+
+    def _ensure_built(self):
+        with self._lock:
+            if self._ready:
+                return
+
+        # Scans inside the engine lock do not migrate the default table themselves
+        if not self.db.migrator.done:
+            self.db.migrator.migrate_all()
+        # Writers notify the view holding the engine lock shared, so no write can slip in
+        with self.db.lock.writing(None, exclusive=True):
+            with self._lock:
+                if self._ready:
+                    return
+                self._services = _GroupedDocuments('fl_service_id')
+                self._resources = _GroupedDocuments('asset_id', 'resource_id')
+                self._policies = _GroupedDocuments('resource_id')
+                for documents, name in ((self._services, SERVICES_TABLE), (self._resources, RESOURCES_TABLE),
+                                        (self._policies, POLICIES_TABLE)):
+                    for document in self.db.table(name).all():
+                        documents.put(document.doc_id, document)
+                self._rows = {}
+                self._order = []
+                for doc_id in self._services.documents:
+                    self._refresh_row(doc_id)
+                self._ready = True
+        logging.debug("Built the service summary view with %s rows", len(self._order))
+
+    def _on_change(self, table, changes):
+        with self._lock:
+            if not self._ready:
+                return
+            if changes is None:
+                self._ready = False
+                return
+            try:
+                self._apply(table.name, changes)
+            except Exception as e:
+                # Never fail the write, rebuild on the next read instead
+                logging.error("Service summary view update failed %s", str(e))
+                self._ready = False
+
+    def _apply(self, table_name, changes):
+        affected = set()
+        if table_name == SERVICES_TABLE:
+            for doc_id, document in changes.items():
+                self._services.put(doc_id, document)
+                affected.add(doc_id)
+        elif table_name == RESOURCES_TABLE:
+            for doc_id, document in changes.items():
+                for asset_id in self._resources.put(doc_id, document)['asset_id']:
+                    affected.update(self._services.group('fl_service_id', asset_id))
+        else:
+            for doc_id, document in changes.items():
+                for resource_id in self._policies.put(doc_id, document)['resource_id']:
+                    for resource in self._resources.group('resource_id', resource_id):
+                        asset_id = self._resources.documents[resource].get('asset_id')
+                        affected.update(self._services.group('fl_service_id', asset_id))
+
+        for doc_id in affected:
+            self._refresh_row(doc_id)
+
+    def _refresh_row(self, doc_id):
+        row = self._build_row(doc_id)
+        position = bisect.bisect_left(self._order, doc_id)
+        listed = position < len(self._order) and self._order[position] == doc_id
+        if row is None:
+            self._rows.pop(doc_id, None)
+            if listed:
+                del self._order[position]
+        else:
+            self._rows[doc_id] = row
+            if not listed:
+                self._order.insert(position, doc_id)
+
+    def _build_row(self, doc_id):
+        service = self._services.documents.get(doc_id)
+        asset_id = service.get('fl_service_id') if service is not None else None
+        if not asset_id:
+            return None
+        # Like the former join, the last resource added for the asset wins
+        resources = self._resources.group('asset_id', asset_id)
+        if not resources:
+            return None
+        resource = self._resources.documents[resources[-1]]
+        row = {**service, **resource}
+        row['policies'] = [self._policies.documents[policy_id]
+                           for policy_id in self._policies.group('resource_id', resource.get('resource_id'))]
+        return row
+
+    @staticmethod
+    def _encode_cursor(doc_id):
+        return base64.urlsafe_b64encode(json.dumps({'id': doc_id}).encode('utf-8')).decode('ascii').rstrip('=')
+
+    @staticmethod
+    def _decode_cursor(cursor):
+        try:
+            return int(json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))['id'])
+        except (ValueError, TypeError, KeyError):
+            raise InvalidQuery("Malformed cursor")
+
+
+_views = {}
+_views_lock = threading.Lock()
+
+
+def get_summary_view(db):
+    """
+    Return the service summary view of a storage engine, creating it on first use.
+    :param db: The StorageEngine holding the tables.
+    """
+    with _views_lock:
+        view = _views.get(id(db))
+        if view is None or view.db is not db:
+            view = _views[id(db)] = ServiceSummaryView(db)
+        return view
@@ -1,15 +1,29 @@
+import os
 import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from datetime import datetime, timedelta
+from functools import lru_cache
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
 from werkzeug.security import check_password_hash, generate_password_hash
 from src import ma
 from marshmallow import Schema, fields, validate
-from tinydb import TinyDB, Query
+from tinydb import Query
+from src.storage import get_db
+from src.storage.ids import generate_id
+from config import settings
 import hashlib
 import json
 import logging
 
 logging.basicConfig(level=logging.DEBUG)  
 
+# Token modes: "opaque" tokens are stored with the user, "signed" tokens are verified without the database
+AUTH_TOKEN_MODE_OPAQUE = 'opaque'
+AUTH_TOKEN_MODE_SIGNED = 'signed'
+
 class NewUserSchema(ma.Schema):
     """Schema defining the attributes when creating a new user."""
     email = fields.Email(
@@ -54,10 +68,269 @@ class TokenSchema(ma.Schema):
     token = ma.String()
 
 
+class TokenDenyList():
+    """
+    In-memory list of revoked signed tokens.
+
+    A token only needs to be remembered until it expires by itself, so the
+    list stays small. Every process keeps its own list.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._revoked = {}
+
+    def add(self, token_id, expires_at):
+        """
+        Revoke a token.
+        :param token_id: The unique ID (jti) of the token.
+        :param expires_at: Unix time at which the token expires anyway.
+        """
+        with self._lock:
+            self._purge(time.time())
+            self._revoked[token_id] = expires_at
+
+    def __contains__(self, token_id):
+        with self._lock:
+            expires_at = self._revoked.get(token_id)
+            return expires_at is not None and expires_at > time.time()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._revoked)
+
+    def purge(self):
+        """
+        Forget the revoked tokens that expired meanwhile.
+        :return: Number of forgotten tokens.
+        """
+        with self._lock:
+            return self._purge(time.time())
+
+    def _purge(self, now):
+        expired = [token_id for token_id, expires_at in self._revoked.items() if expires_at <= now]
+        for token_id in expired:
+            del self._revoked[token_id]
+        return len(expired)
+
+
+token_deny_list = TokenDenyList()
+
+
+class TokenCache():
+    """
+    LRU cache of verified opaque tokens, mapping a token to its user and
+    expiry so repeated requests with the same token skip the user lookup.
+
+    Entries are dropped once the token expires, after ``ttl`` seconds at
+    the latest (so a token revoked by another process is honoured), and
+    the least recently used entry is evicted when the cache is full.
+    """
+
+    def __init__(self, capacity=1024, ttl=60):
+        """
+        :param capacity: Maximum number of cached tokens.
+        :param ttl: Seconds a verified token is trusted without a lookup.
+        """
+        self.capacity = capacity
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._tokens_by_user = {}
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, token):
+        """
+        Return the cached ``(email, expiry)`` of a token, or None.
+        :param token: The auth token.
+        """
+        now = datetime.utcnow()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None and (entry[1] <= now or entry[2] <= time.monotonic()):
+                self._remove(token)
+                entry = None
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(token)
+            self._stats['hits'] += 1
+            return entry[0], entry[1]
+
+    def put(self, token, email, expiry):
+        """
+        Cache a verified token.
+        :param token: The auth token.
+        :param email: Email address of the user owning the token.
+        :param expiry: Expiry of the token as naive UTC datetime.
+        """
+        with self._lock:
+            self._remove(token)
+            self._entries[token] = (email, expiry, time.monotonic() + self.ttl)
+            self._tokens_by_user.setdefault(email, set()).add(token)
+            while len(self._entries) > self.capacity:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._stats['evictions'] += 1
+
+    def invalidate(self, token):
+        """
+        Drop a revoked token.
+        """
+        with self._lock:
+            if self._remove(token):
+                self._stats['invalidations'] += 1
+
+    def invalidate_user(self, email):
+        """
+        Drop every token of a user, e.g. when a new token is issued.
+        """
+        with self._lock:
+            for token in list(self._tokens_by_user.get(email, ())):
+                self._remove(token)
+                self._stats['invalidations'] += 1
+
+    def purge(self):
+        """
+        Drop the entries of expired tokens.
+        :return: Number of dropped entries.
+        """
+        now = datetime.utcnow()
+        with self._lock:
+            expired = [token for token, entry in self._entries.items() if entry[1] <= now]
+            for token in expired:
+                self._remove(token)
+        return len(expired)
+
+    def stats(self):
+        """
+        Return the hit, miss and eviction counters.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def _remove(self, token):
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return False
+        tokens = self._tokens_by_user.get(entry[0])
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[entry[0]]
+        return True
+
+
+token_cache = TokenCache(
+    capacity=settings.get('AUTH_TOKEN_CACHE_SIZE', 1024),
+    ttl=settings.get('AUTH_TOKEN_CACHE_TTL', 60),
+)
+
+
+class KeyDerivationBusy(Exception):
+    """Raised when a password can not be hashed or checked within the queue timeout."""
+
+
+class KeyDerivationPool():
+    """
+    Bounded pool of threads hashing and checking passwords.
+
+    Password hashing is deliberately expensive, running it on a few worker
+    threads caps the CPU a burst of logins can take from other requests.
+    At most ``workers`` hashes run at once and ``queue_size`` more may
+    wait; a call that does not get its result within ``timeout`` seconds
+    raises KeyDerivationBusy instead of queueing indefinitely. A hash that
+    is already running when its call times out keeps its slot until it is
+    done, so the bound also holds for abandoned hashes.
+    """
+
+    def __init__(self, workers=2, queue_size=32, timeout=5):
+        """
+        :param workers: Number of passwords hashed concurrently.
+        :param queue_size: Number of calls waiting for a worker.
+        :param timeout: Seconds a call waits for its result.
+        """
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._stats = {'completed': 0, 'rejected': 0, 'timed_out': 0}
+
+    def generate_password_hash(self, password_plaintext):
+        return self._run(generate_password_hash, password_plaintext)
+
+    def check_password_hash(self, password_hash, password_plaintext):
+        return self._run(check_password_hash, password_hash, password_plaintext)
+
+    def stats(self):
+        """
+        Return the completed, rejected and timed out call counters.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats['workers'] = self.workers
+        stats['queue_size'] = self.queue_size
+        return stats
+
+    def _run(self, function, *args):
+        deadline = time.monotonic() + self.timeout
+        if not self._slots.acquire(timeout=self.timeout):
+            self._count('rejected')
+            raise KeyDerivationBusy("Too many concurrent password checks")
+        try:
+            future = self._get_executor().submit(function, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # The slot is held until the hash is done, also if the caller stops waiting for it
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            result = future.result(timeout=max(deadline - time.monotonic(), 0))
+        except FutureTimeoutError:
+            # A queued call is dropped, a running one finishes in the background
+            future.cancel()
+            self._count('timed_out')
+            raise KeyDerivationBusy("Password check timed out")
+        self._count('completed')
+        return result
+
+    def _get_executor(self):
+        with self._lock:
+            # Worker threads do not survive a fork, a child process needs its own pool
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='kdf')
+                self._pid = os.getpid()
+            return self._executor
+
+    def _count(self, counter):
+        with self._lock:
+            self._stats[counter] += 1
+
+
+kdf_pool = KeyDerivationPool(
+    workers=settings.get('KDF_POOL_WORKERS', 2),
+    queue_size=settings.get('KDF_POOL_QUEUE_SIZE', 32),
+    timeout=settings.get('KDF_POOL_TIMEOUT', 5),
+)
+
+
+@lru_cache(maxsize=4)
+def _token_serializer(secret_key):
+    return URLSafeTimedSerializer(secret_key, salt='auth-token')
+
+
 class User():
     def __init__(self, db_path='src/db/db.json'):
         """Create a new User object."""
-        self.db = TinyDB(db_path)
+        self.db = get_db(db_path)
+        self.users = self.db.table("users")
         self.User = Query()
         self.email = None
         self.password = None
@@ -69,9 +342,14 @@ class User():
         self.password_hashed = None
 
     def is_password_correct(self, email: str, password_plaintext: str):
-
-        user = self.get_user(email)
-        return check_password_hash(user['password'], password_plaintext)
+        """
+        Check the password of a user, reusing the user loaded by get_user.
+        :param email: Email address of the user.
+        :param password_plaintext: The password to check.
+        """
+        if self.email != email and not self.get_user(email):
+            return False
+        return kdf_pool.check_password_hash(self.password, password_plaintext)
 
     def set_password(self, password_plaintext: str):
         self.password_hashed = self._generate_password_hash(password_plaintext)
@@ -86,7 +364,7 @@ class User():
 
         password = self._generate_password_hash(password)
         document = {'email': email, 'password': password, 'first_name': first_name, 'last_name': last_name, 'role': role }
-        user_id = self._create_hashed_id(document)
+        user_id = generate_id(lambda: self._create_hashed_id(document))
         document['user_id'] = user_id
         document['timestamp'] = str(datetime.now().isoformat())
 
@@ -94,7 +372,7 @@ class User():
         document['auth_token'] = ""
         document['auth_token_expiration'] = ""
 
-        if self.db.insert(document):
+        if self.users.insert(document):
                 return response_document
         else:
             return False
@@ -105,7 +383,7 @@ class User():
         :param user_id: The ID of the model to retrieve.
         """
     
-        user = self.db.search(self.User.email == email)
+        user = self.users.lookup(email=email)
         if user:
             self.email = user[0]['email']
             self.password = user[0]['password']
@@ -125,22 +403,37 @@ class User():
 
     @staticmethod
     def _generate_password_hash(password_plaintext):
-        return generate_password_hash(password_plaintext)
+        return kdf_pool.generate_password_hash(password_plaintext)
 
     def generate_auth_token(self):
+        if self._token_mode() == AUTH_TOKEN_MODE_SIGNED:
+            return self._generate_signed_token()
+
         self.auth_token = secrets.token_urlsafe()
         self.auth_token_expiration = datetime.utcnow() + timedelta(minutes=60)
 
         try:
-            self.db.update({'auth_token' : self.auth_token, 'auth_token_expiration': self.auth_token_expiration.isoformat()}, 
-                           self.User.email == self.email )
+            found = self.users.lookup(email=self.email)
+            self.users.update({'auth_token' : self.auth_token, 'auth_token_expiration': self.auth_token_expiration.isoformat()}, 
+                           doc_ids=[doc.doc_id for doc in found])
+            # The previous token of the user is no longer valid
+            token_cache.invalidate_user(self.email)
+            token_cache.put(self.auth_token, self.email, self.auth_token_expiration)
             return self.auth_token
         except Exception as e:
             logging.error(e.__repr__())
             return False
 
     def verify_auth_token(self, auth_token):
-        user = self.db.search(self.User.auth_token == auth_token)
+        if self._token_mode() == AUTH_TOKEN_MODE_SIGNED:
+            return self._verify_signed_token(auth_token)
+
+        cached = token_cache.get(auth_token)
+        if cached is not None:
+            self.email = cached[0]
+            return True
+
+        user = self.users.lookup(auth_token=auth_token)
         if len(user) == 0:
             return False
         user = user[0]
@@ -148,6 +441,8 @@ class User():
         if user['auth_token_expiration'] != "":
             auth_token_expiry = datetime.fromisoformat(user['auth_token_expiration'])
             if user and auth_token_expiry > datetime.utcnow():
+                token_cache.put(auth_token, user['email'], auth_token_expiry)
+                self.email = user['email']
                 return True
         else:
             return False
@@ -155,6 +450,60 @@ class User():
 
     def revoke_auth_token(self):
         self.auth_token_expiration = datetime.utcnow()
+        if not self.auth_token:
+            return
+
+        if self._token_mode() == AUTH_TOKEN_MODE_SIGNED:
+            payload = self._load_signed_token(self.auth_token)
+            if payload is not None:
+                token_deny_list.add(payload['jti'], payload['exp'])
+        else:
+            token_cache.invalidate(self.auth_token)
+            found = self.users.lookup(auth_token=self.auth_token)
+            if found:
+                self.users.update({'auth_token_expiration': self.auth_token_expiration.isoformat()},
+                                  doc_ids=[doc.doc_id for doc in found])
+
+    @staticmethod
+    def _token_mode():
+        return settings.get('AUTH_TOKEN_MODE', AUTH_TOKEN_MODE_OPAQUE)
+
+    @staticmethod
+    def _token_ttl():
+        return int(settings.get('AUTH_TOKEN_TTL_MINUTES', 60)) * 60
+
+    def _generate_signed_token(self):
+        """
+        Issue an expiring token signed with SECRET_KEY. Nothing is stored,
+        the token itself carries the user and its unique ID.
+        """
+        issued_at = int(time.time())
+        self.auth_token = _token_serializer(settings.SECRET_KEY).dumps({
+            'email': self.email,
+            'jti': secrets.token_urlsafe(12),
+            'exp': issued_at + self._token_ttl(),
+        })
+        self.auth_token_expiration = datetime.utcfromtimestamp(issued_at + self._token_ttl())
+        return self.auth_token
+
+    def _load_signed_token(self, auth_token):
+        try:
+            return _token_serializer(settings.SECRET_KEY).loads(auth_token, max_age=self._token_ttl())
+        except (SignatureExpired, BadSignature):
+            return None
+
+    def _verify_signed_token(self, auth_token):
+        """
+        Check the signature, expiry and revocation of a signed token without
+        touching the database.
+        """
+        payload = self._load_signed_token(auth_token)
+        if payload is None or payload['jti'] in token_deny_list:
+            return False
+        self.email = payload['email']
+        self.auth_token = auth_token
+        self.auth_token_expiration = datetime.utcfromtimestamp(payload['exp'])
+        return True
 
     # def __repr__(self):
     #     return f'<User: {self.email}>'
@@ -0,0 +1,186 @@
+"""
+Idempotency keys for the create endpoints: a request repeated with the
+same ``Idempotency-Key`` header gets the response of the first one instead
+of creating another document.
+"""
+import time
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from functools import wraps
+
+from flask import request, make_response, Response
+from config import settings
+
+logging.basicConfig(level=logging.DEBUG)
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+
+# Outcomes of IdempotencyStore.begin
+NEW = 'new'
+REPLAY = 'replay'
+IN_PROGRESS = 'in_progress'
+MISMATCH = 'mismatch'
+
+
+class IdempotencyStore():
+    """
+    LRU store of the responses of requests sent with an idempotency key.
+
+    A key is reserved while its first request is processed and then maps
+    to the response, as long as that succeeded. Entries expire after
+    ``ttl`` seconds and the least recently used one is evicted when the
+    store is full. Every process keeps its own store.
+    """
+
+    def __init__(self, capacity=10000, ttl=86400):
+        """
+        :param capacity: Maximum number of stored keys.
+        :param ttl: Seconds a response is replayed for.
+        """
+        self.capacity = capacity
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # Key to (request fingerprint, response or None while in progress, expiry)
+        self._entries = OrderedDict()
+        self._stats = {'stored': 0, 'replayed': 0, 'conflicts': 0, 'evictions': 0}
+
+    def begin(self, key, fingerprint):
+        """
+        Look up a key, reserving it if it is new.
+        :param key: The scoped idempotency key.
+        :param fingerprint: Hash of the request, which a repeated request has to match.
+        :return: Tuple of the outcome (NEW, REPLAY, IN_PROGRESS or MISMATCH) and the stored response if REPLAY.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] <= now:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self._entries[key] = (fingerprint, None, now + self.ttl)
+                self._evict()
+                return NEW, None
+            self._entries.move_to_end(key)
+            if entry[0] != fingerprint:
+                self._stats['conflicts'] += 1
+                return MISMATCH, None
+            if entry[1] is None:
+                self._stats['conflicts'] += 1
+                return IN_PROGRESS, None
+            self._stats['replayed'] += 1
+            return REPLAY, entry[1]
+
+    def complete(self, key, fingerprint, response):
+        """
+        Store the response of a reserved key.
+        :param response: Tuple of the status code, the body and the mimetype.
+        """
+        with self._lock:
+            self._entries[key] = (fingerprint, response, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            self._stats['stored'] += 1
+            self._evict()
+
+    def release(self, key):
+        """
+        Drop a reserved key, e.g. because its request failed and may be retried.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] is None:
+                del self._entries[key]
+
+    def purge(self):
+        """
+        Drop the expired entries.
+        :return: Number of dropped entries.
+        """
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, entry in self._entries.items() if entry[2] <= now]
+            for key in expired:
+                del self._entries[key]
+        return len(expired)
+
+    def stats(self):
+        """
+        Return the store, replay and eviction counters.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        return stats
+
+    def _evict(self):
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+            self._stats['evictions'] += 1
+
+
+idempotency_store = IdempotencyStore(
+    capacity=settings.get('IDEMPOTENCY_CACHE_SIZE', 10000),
+    ttl=settings.get('IDEMPOTENCY_TTL_SECONDS', 86400),
+)
+
+
+def idempotent(view):
+    """
+    Make a create endpoint replay its response for a repeated Idempotency-Key.
+
+    Keys are scoped to the endpoint and the Authorization header of the
+    request. A key sent again with a different body is rejected with 422,
+    and while the first request is still processed with 409. Only
+    successful responses are stored, so failed requests can be retried.
+    Requests without the header are passed through unchanged.
+
+    Apply it below the authentication decorator, so requests are
+    authenticated before a stored response is replayed, and above the
+    response decorator, whose serialized response is the one stored.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if key is None:
+            return view(*args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            error = {"status": "failed", "message": "Error Occured",
+                     "error": "{0} must have 1 to {1} characters".format(IDEMPOTENCY_HEADER, MAX_KEY_LENGTH)}
+            return error, 400
+
+        scoped_key = (request.endpoint, _digest(request.headers.get('Authorization', '').encode('utf-8')), key)
+        fingerprint = _digest(request.get_data())
+        outcome, stored = idempotency_store.begin(scoped_key, fingerprint)
+        if outcome == REPLAY:
+            status, body, mimetype = stored
+            return Response(body, status=status, mimetype=mimetype, headers={REPLAYED_HEADER: 'true'})
+        if outcome == MISMATCH:
+            error = {"status": "failed", "message": "Error Occured",
+                     "error": "{0} was already used for a different request".format(IDEMPOTENCY_HEADER)}
+            return error, 422
+        if outcome == IN_PROGRESS:
+            error = {"status": "failed", "message": "Error Occured",
+                     "error": "A request with this {0} is still being processed".format(IDEMPOTENCY_HEADER)}
+            return error, 409
+
+        try:
+            response = make_response(view(*args, **kwargs))
+        except BaseException:
+            idempotency_store.release(scoped_key)
+            raise
+        if 200 <= response.status_code < 300 and not response.is_streamed:
+            idempotency_store.complete(scoped_key, fingerprint,
+                                       (response.status_code, response.get_data(), response.mimetype))
+        else:
+            idempotency_store.release(scoped_key)
+        return response
+
+    return wrapper
+
+
+def _digest(data):
+    return hashlib.sha256(data).hexdigest()
@@ -0,0 +1,218 @@
+"""
+Periodic clean-up of the model database: expired auth tokens, PIP access
+records of deleted resources or policies and change feed events beyond the
+retention, followed by a compaction of the storage. Resources whose asset
+is gone are reported, and only dropped together with their policies when
+enabled.
+"""
+import os
+import time
+import threading
+import logging
+from datetime import datetime
+
+from config import settings
+from src.storage import get_db
+from src.models.user_model import token_cache, token_deny_list
+from src.services.idempotency import idempotency_store
+
+logging.basicConfig(level=logging.DEBUG)
+
+# Table keeping the PIP access records of deleted resources and policies
+PIP_ARCHIVE_TABLE = 'pip_archive'
+# Table keeping the policies of the orphaned resources dropped by the job
+POLICY_ARCHIVE_TABLE = 'policy_archive'
+
+# Resource type and the table and field identifying its asset
+ASSET_TABLES = {
+    'model': ('ml_models', 'model_id'),
+    'fl_service': ('fl_services', 'fl_service_id'),
+}
+
+
+class MaintenanceJob():
+    """
+    Clean up the database every ``interval`` seconds on a background thread.
+
+    Every step runs in one engine transaction, so requests never see a half
+    cleaned database. The job can also be run on demand with ``run``.
+    """
+
+    def __init__(self, db_path='src/db/db.json', interval=3600, drop_orphaned_resources=False):
+        """
+        :param db_path: Path to the TinyDB database file.
+        :param interval: Seconds between two runs, 0 to only run on demand.
+        :param drop_orphaned_resources: Whether to drop the resources whose asset is gone, archiving their
+                                        policies, instead of only reporting them.
+        """
+        self.db_path = db_path
+        self.interval = interval
+        self.drop_orphaned_resources = drop_orphaned_resources
+        self._run_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._fork_hook = False
+        self._runs = 0
+        self._last_run = None
+        self._last_report = None
+        self._last_error = None
+
+    def start(self):
+        """
+        Start the periodic runs, unless they are disabled or already running.
+        """
+        if not self.interval or (self._thread is not None and self._thread.is_alive()):
+            return
+        if not self._fork_hook:
+            # The thread does not survive the fork of a worker process
+            os.register_at_fork(after_in_child=self._restart_after_fork)
+            self._fork_hook = True
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name='db-maintenance', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def run(self):
+        """
+        Run every clean-up step once.
+        :return: Report with the number of documents each step found or removed.
+        """
+        with self._run_lock:
+            started = time.monotonic()
+            engine = get_db(self.db_path)
+            # Scans inside a transaction do not migrate the default table themselves
+            if not engine.migrator.done:
+                engine.migrator.migrate_all()
+
+            report = {}
+            report['expired_tokens'] = self._purge_expired_tokens(engine)
+            report.update(self._handle_orphaned_resources(engine))
+            report['archived_pip_records'] = self._archive_stale_pip_records(engine)
+            report['trimmed_change_events'] = engine.changes.trim()
+            report['compacted'] = engine.compact()
+            report['duration_ms'] = (time.monotonic() - started) * 1000.0
+            report['finished_at'] = datetime.now().isoformat()
+
+            with self._stats_lock:
+                self._runs += 1
+                self._last_run = report['finished_at']
+                self._last_report = report
+            logging.info("Database maintenance finished: %s", report)
+            return report
+
+    def stats(self):
+        """
+        Return the number of runs and the report of the last one.
+        """
+        with self._stats_lock:
+            return {
+                'runs': self._runs,
+                'interval': self.interval,
+                'last_run': self._last_run,
+                'last_report': self._last_report,
+                'last_error': self._last_error,
+            }
+
+    # ----------------
+    # Helper Functions
+    # ----------------
+
+    def _loop(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.run()
+            except Exception as e:
+                logging.error("Database maintenance failed %s", str(e))
+                with self._stats_lock:
+                    self._last_error = str(e)
+
+    def _restart_after_fork(self):
+        self._run_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        if self._thread is not None:
+            self._thread = None
+            self.start()
+
+    def _purge_expired_tokens(self, engine):
+        users = engine.table('users')
+        now = datetime.utcnow()
+        with engine.transaction():
+            expired = [
+                user.doc_id for user in users.all()
+                if user.get('auth_token_expiration') and datetime.fromisoformat(user['auth_token_expiration']) <= now
+            ]
+            if expired:
+                users.update({'auth_token': '', 'auth_token_expiration': ''}, doc_ids=expired)
+
+        token_deny_list.purge()
+        token_cache.purge()
+        idempotency_store.purge()
+        return len(expired)
+
+    def _handle_orphaned_resources(self, engine):
+        resources = engine.table('resource')
+        policies = engine.table('policies')
+        archive = engine.table(POLICY_ARCHIVE_TABLE)
+        archived_at = datetime.now().isoformat()
+        dropped_policies = []
+        with engine.transaction():
+            assets = {
+                resource_type: {document.get(field) for document in engine.table(table_name).all()}
+                for resource_type, (table_name, field) in ASSET_TABLES.items()
+            }
+            # Resources without a type or of another kind of asset are never considered orphaned
+            orphaned = [
+                resource for resource in resources.all()
+                if resource.get('type') in assets and resource.get('asset_id') not in assets[resource['type']]
+            ]
+            if orphaned and self.drop_orphaned_resources:
+                orphaned_ids = {resource.get('resource_id') for resource in orphaned}
+                dropped_policies = [policy for policy in policies.all() if policy.get('resource_id') in orphaned_ids]
+                if dropped_policies:
+                    archive.insert_multiple(
+                        dict(policy, archived_at=archived_at, archive_reason='resource asset deleted')
+                        for policy in dropped_policies
+                    )
+                    policies.remove(doc_ids=[policy.doc_id for policy in dropped_policies])
+                resources.remove(doc_ids=[resource.doc_id for resource in orphaned])
+
+        if orphaned and not self.drop_orphaned_resources:
+            logging.warning("Resources whose asset is gone: %s", [resource.get('resource_id') for resource in orphaned])
+        return {
+            'orphaned_resources': len(orphaned),
+            'dropped_resources': len(orphaned) if self.drop_orphaned_resources else 0,
+            'archived_policies': len(dropped_policies),
+        }
+
+    def _archive_stale_pip_records(self, engine):
+        pip = engine.table('pip')
+        archive = engine.table(PIP_ARCHIVE_TABLE)
+        archived_at = datetime.now().isoformat()
+        with engine.transaction():
+            resource_ids = {resource.get('resource_id') for resource in engine.table('resource').all()}
+            policy_resource_ids = {policy.get('resource_id') for policy in engine.table('policies').all()}
+            stale = []
+            for record in pip.all():
+                if record.get('resource_id') not in resource_ids:
+                    stale.append((record, 'resource deleted'))
+                elif record.get('resource_id') not in policy_resource_ids:
+                    stale.append((record, 'policy deleted'))
+
+            if stale:
+                archive.insert_multiple(
+                    dict(record, archived_at=archived_at, archive_reason=reason) for record, reason in stale
+                )
+                pip.remove(doc_ids=[record.doc_id for record, _ in stale])
+        return len(stale)
+
+
+maintenance_job = MaintenanceJob(
+    interval=settings.get('MAINTENANCE_INTERVAL_MINUTES', 60) * 60,
+    drop_orphaned_resources=settings.get('MAINTENANCE_DROP_ORPHANED_RESOURCES', False),
+)
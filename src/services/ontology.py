@@ -0,0 +1,203 @@
+"""
+Ontologies of the semantic descriptions, parsed once per process.
+
+The semantic managers of cords_semantics parse their ontology file again
+for every term they look up. The managers below look the terms up in a
+shared, read-only graph instead, parsed on first use or by ``preload``,
+and remember the result of every lookup. Each manager still builds its
+own semantic graph, so generating a description only costs the lookups.
+"""
+import os
+import threading
+import logging
+from urllib.parse import urlparse
+
+from rdflib import Graph, URIRef
+from rdflib.graph import ReadOnlyGraphAggregate
+from rdflib.namespace import RDF, RDFS
+from cords_semantics.semantics import MlSemanticManager, FlSemanticManager
+
+logging.basicConfig(level=logging.DEBUG)
+
+ML_ONTOLOGY_PATH = 'data/cordsml.rdf'
+FL_ONTOLOGY_PATH = 'data/cords_federated_learning.rdf'
+
+_DATATYPE_PROPERTY = URIRef("http://www.w3.org/2002/07/owl#DatatypeProperty")
+
+# Terms come from user supplied tags, so only this many lookups are remembered per ontology
+MAX_REMEMBERED_TERMS = 4096
+
+_MISSING = object()
+
+
+class Ontology():
+    """
+    Parsed ontology file shared by all semantic managers of the process.
+
+    Like in cords_semantics, a term is looked up by scanning the triples for
+    the first subject or object containing it. The order of the triples
+    changes with every parse though, so a term naming a subject exactly,
+    e.g. ``Model`` for ``mls#Model`` rather than ``mls#ModelEvaluation``,
+    is resolved to that subject first, which keeps the result the same in
+    every process.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Path to the RDF/XML ontology file.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._graph = None
+        self._triples = None
+        self._local_names = None
+        self._term_uris = {}
+        self._data_types = {}
+
+    @property
+    def graph(self):
+        """
+        The ontology as read-only graph, parsed on first access.
+        """
+        self._ensure_parsed()
+        return self._graph
+
+    def find_term_uri(self, term, namespace_uri):
+        """
+        Return the URI of a term, like the ``_find_term_uri`` of the semantic managers.
+        :param term: Name of the class or property.
+        :param namespace_uri: Namespace of the term if the ontology names it without a URL.
+        :return: The URI, or None if the ontology does not mention the term.
+        """
+        key = (term, namespace_uri)
+        uri = self._term_uris.get(key, _MISSING)
+        if uri is _MISSING:
+            uri = self._scan_term_uri(term, namespace_uri)
+            if len(self._term_uris) < MAX_REMEMBERED_TERMS:
+                self._term_uris[key] = uri
+        return uri
+
+    def find_term_data_type(self, term):
+        """
+        Return the range of a datatype property, like the ``_find_term_data_type`` of FlSemanticManager.
+        :param term: Name of the property.
+        :return: The data type URI as string, or None if the property has no range.
+        """
+        data_type = self._data_types.get(term, _MISSING)
+        if data_type is _MISSING:
+            data_type = self._scan_data_type(term)
+            if len(self._data_types) < MAX_REMEMBERED_TERMS:
+                self._data_types[term] = data_type
+        return data_type
+
+    # ----------------
+    # Helper Functions
+    # ----------------
+
+    def _ensure_parsed(self):
+        if self._graph is not None:
+            return
+        with self._lock:
+            if self._graph is not None:
+                return
+            graph = Graph()
+            graph.parse(self.path, format='application/rdf+xml')
+            self._triples = list(graph)
+            self._local_names = _local_names(self._triples)
+            self._graph = ReadOnlyGraphAggregate([graph])
+            logging.info("Parsed ontology %s with %s triples", self.path, len(self._triples))
+
+    def _scan_term_uri(self, term, namespace_uri):
+        self._ensure_parsed()
+        exact = self._local_names.get(term)
+        if exact:
+            return exact
+        for s, p, o in self._triples:
+            if term in s:
+                if _is_url(s):
+                    return s
+                return namespace_uri + term
+            elif term in o:
+                return o
+        return None
+
+    def _scan_data_type(self, term):
+        graph = self.graph
+        for prop in graph.subjects(RDF.type, _DATATYPE_PROPERTY):
+            if prop.endswith("#" + term):
+                range_value = list(graph.objects(prop, RDFS.range))
+                if range_value:
+                    return str(range_value[0])
+        return None
+
+
+_ontologies = {}
+_ontologies_lock = threading.Lock()
+
+
+def get_ontology(path):
+    """
+    Return the shared Ontology of a file, creating it on first use.
+    :param path: Path to the RDF/XML ontology file.
+    """
+    path = os.path.abspath(path)
+    with _ontologies_lock:
+        ontology = _ontologies.get(path)
+        if ontology is None:
+            ontology = _ontologies[path] = Ontology(path)
+        return ontology
+
+
+def preload():
+    """
+    Parse the ML and FL ontologies, so the first description does not wait for it.
+    """
+    for path in (ML_ONTOLOGY_PATH, FL_ONTOLOGY_PATH):
+        try:
+            get_ontology(path).graph
+        except Exception as e:
+            logging.error("Parsing ontology %s failed %s", path, str(e))
+
+
+class SharedMlSemanticManager(MlSemanticManager):
+    """MlSemanticManager looking terms up in the shared ontology."""
+
+    def __init__(self, ontology_path=ML_ONTOLOGY_PATH):
+        super().__init__(ontology_path)
+        self.ontology = get_ontology(ontology_path)
+
+    def _find_term_uri(self, term):
+        return self.ontology.find_term_uri(term, self.cords_namespace_uri)
+
+
+class SharedFlSemanticManager(FlSemanticManager):
+    """FlSemanticManager looking terms up in the shared ontology."""
+
+    def __init__(self, ontology_path=FL_ONTOLOGY_PATH):
+        super().__init__(ontology_path)
+        self.ontology = get_ontology(ontology_path)
+
+    def _find_term_uri(self, term):
+        return self.ontology.find_term_uri(term, self.cords_namespace_uri)
+
+    def _find_term_data_type(self, term):
+        return self.ontology.find_term_data_type(term)
+
+
+def _local_names(triples):
+    # URL subjects by the part after their # or last /, the lowest URL wins for names used twice
+    names = {}
+    for s, _, _ in triples:
+        if isinstance(s, URIRef) and _is_url(s):
+            name = s.rsplit('#', 1)[-1] if '#' in s else s.rstrip('/').rsplit('/', 1)[-1]
+            if name and (name not in names or s < names[name]):
+                names[name] = s
+    return names
+
+
+def _is_url(string):
+    try:
+        result = urlparse(string)
+        return all([result.scheme, result.netloc])
+    except Exception:
+        return False
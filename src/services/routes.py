@@ -7,6 +7,7 @@ from src.controllers.user_controller import users_blueprint
 from src.controllers.policy_controller import policy_blueprint
 from src.controllers.pip_controller import pip_blueprint
 from src.controllers.front_end_controller import front_end
+from src.controllers.admin_controller import admin_blueprint
 from flask_cors import CORS
 
 # main blueprint to be registered with application
@@ -21,6 +22,7 @@ api.register_blueprint(users_blueprint, url_prefix="/users")
 api.register_blueprint(policy_blueprint, url_prefix="/policy")
 api.register_blueprint(pip_blueprint, url_prefix="/pip")
 api.register_blueprint(front_end, url_prefix="/front_end")
+api.register_blueprint(admin_blueprint, url_prefix="/admin")
 
 
 
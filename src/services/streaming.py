@@ -0,0 +1,111 @@
+"""
+Streamed responses for endpoints returning whole collections or a stream
+of server-sent events, and bulk request bodies sent as a JSON array or as
+newline delimited JSON.
+"""
+import json
+
+from flask import Response, current_app, request, stream_with_context
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+JSON_MIMETYPE = 'application/json'
+EVENT_STREAM_MIMETYPE = 'text/event-stream'
+
+
+def wants_ndjson():
+    """
+    Whether the client prefers newline delimited JSON over a JSON array.
+    """
+    return request.accept_mimetypes.best_match([JSON_MIMETYPE, NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+def stream_records(records, ndjson=None):
+    """
+    Return a response streaming records as they are produced.
+
+    With ``application/x-ndjson`` every record is written as one line,
+    otherwise the records are written as a JSON array in chunks. Either way
+    only the record being serialized is held in memory.
+
+    :param records: Iterable of JSON serializable records.
+    :param ndjson: Write newline delimited JSON, by default chosen by the Accept header.
+    :return: The streaming Response.
+    """
+    if ndjson is None:
+        ndjson = wants_ndjson()
+    dumps = current_app.json.dumps
+
+    def generate_ndjson():
+        for record in records:
+            yield dumps(record) + '\n'
+
+    def generate_array():
+        separator = '['
+        for record in records:
+            yield separator + dumps(record)
+            separator = ','
+        yield ']' if separator == ',' else '[]'
+
+    if ndjson:
+        return Response(stream_with_context(generate_ndjson()), mimetype=NDJSON_MIMETYPE)
+    return Response(stream_with_context(generate_array()), mimetype=JSON_MIMETYPE)
+
+
+def stream_events(events, retry_ms=None):
+    """
+    Return a response streaming server-sent events as they are produced.
+
+    Every event is a tuple of its ID, its type and its JSON serializable
+    data. None writes a comment instead, which keeps idle connections open
+    through proxies.
+
+    :param events: Iterable of (id, type, data) tuples and Nones.
+    :param retry_ms: Milliseconds the client waits before reconnecting, the client default if not given.
+    :return: The streaming Response.
+    """
+    dumps = current_app.json.dumps
+
+    def generate():
+        if retry_ms is not None:
+            yield 'retry: {0}\n\n'.format(retry_ms)
+        for event in events:
+            if event is None:
+                yield ': keep-alive\n\n'
+                continue
+            event_id, event_type, data = event
+            yield 'id: {0}\nevent: {1}\ndata: {2}\n\n'.format(event_id, event_type, dumps(data))
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(generate()), mimetype=EVENT_STREAM_MIMETYPE, headers=headers)
+
+
+def read_records(max_records):
+    """
+    Read the records of a bulk request body.
+
+    A body of type ``application/x-ndjson`` is read line by line, any other
+    body has to be a JSON array.
+
+    :param max_records: Largest number of records accepted.
+    :return: List of the records.
+    :raises ValueError: If the body is malformed or holds too many records.
+    """
+    if request.mimetype == NDJSON_MIMETYPE:
+        records = []
+        for number, line in enumerate(request.stream, start=1):
+            if not line.strip():
+                continue
+            if len(records) == max_records:
+                raise ValueError("At most {0} records can be sent at once".format(max_records))
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                raise ValueError("Line {0} is not valid JSON".format(number))
+        return records
+
+    records = request.get_json(silent=True)
+    if not isinstance(records, list):
+        raise ValueError("Expected a JSON array or newline delimited JSON")
+    if len(records) > max_records:
+        raise ValueError("At most {0} records can be sent at once".format(max_records))
+    return records
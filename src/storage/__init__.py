@@ -0,0 +1,7 @@
+from src.storage.engine import get_db, get_stats, close_all, StorageEngine, INDEXED_FIELDS, ORDERED_FIELDS
+from src.storage.table import IndexedTable, VersionedDocument, VersionConflict
+from src.storage.snapshot import TableSnapshot
+from src.storage.persistent import PersistentMap
+from src.storage.changes import ChangeFeed, ChangeEvent
+from src.storage.locks import ReadWriteLock, EngineLock
+from src.storage.query import Page, InvalidQuery, DEFAULT_QUERY_LIMIT, MAX_QUERY_LIMIT
@@ -0,0 +1,427 @@
+import io
+import os
+import json
+import sqlite3
+import threading
+import logging
+from collections import namedtuple
+
+from tinydb.storages import Storage, JSONStorage
+from config import settings
+
+logging.basicConfig(level=logging.DEBUG)
+
+# A single document change of a commit. ``document`` is None for removals.
+Change = namedtuple('Change', ['table', 'doc_id', 'document'])
+
+
+class JSONBackend(JSONStorage):
+    """
+    The default TinyDB JSON file storage.
+
+    The JSON format can only be written as a whole, so every commit
+    serializes the complete database.
+    """
+
+    #: Whether commits only need the changed documents
+    incremental = False
+
+    @staticmethod
+    def resolve_path(db_path):
+        return db_path
+
+    def commit(self, data, changes):
+        """
+        Persist a set of changed documents.
+        :param data: The complete database contents after the changes.
+        :param changes: List of Change records.
+        """
+        self.write(data)
+
+    def write(self, data):
+        # Same as JSONStorage.write, but fsync is left to sync()
+        self._handle.seek(0)
+        serialized = json.dumps(data, **self.kwargs)
+        try:
+            self._handle.write(serialized)
+        except io.UnsupportedOperation:
+            raise IOError('Cannot write to the database. Access mode is "{0}"'.format(self._mode))
+        self._handle.flush()
+        self._handle.truncate()
+
+    def sync(self):
+        """
+        Force the written data to disk.
+        """
+        os.fsync(self._handle.fileno())
+
+    def reopen(self):
+        """
+        Open the file anew in a forked child process, which must not share
+        the file offset with its parent.
+        """
+        self._handle = open(self._handle.name, mode=self._mode, encoding=self._handle.encoding)
+
+
+class SQLiteBackend(Storage):
+    """
+    Store the documents of all tables as rows of a SQLite database.
+
+    The database runs in WAL mode and commits only write the changed rows,
+    so the cost of a write no longer depends on the size of the database.
+    """
+
+    incremental = True
+
+    def __init__(self, path, create_dirs=False, **kwargs):
+        super().__init__()
+
+        if create_dirs:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self.path = path
+        self._lock = threading.Lock()
+        # With the 'commit' durability policy SQLite syncs every transaction itself
+        self._sync_on_commit = settings.get('STORAGE_DURABILITY', 'commit') == 'commit'
+        self._connect()
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS documents ('
+            ' tbl TEXT NOT NULL,'
+            ' doc_id INTEGER NOT NULL,'
+            ' body TEXT NOT NULL,'
+            ' PRIMARY KEY (tbl, doc_id)'
+            ') WITHOUT ROWID'
+        )
+
+    @staticmethod
+    def resolve_path(db_path):
+        """
+        Map the JSON database path used by the models to the SQLite file.
+        :param db_path: Path to the TinyDB database file.
+        """
+        root, ext = os.path.splitext(db_path)
+        return root + '.sqlite3' if ext == '.json' else db_path
+
+    def read(self):
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT tbl, doc_id, body FROM documents ORDER BY tbl, doc_id'
+            ).fetchall()
+
+        if not rows:
+            return None
+
+        data = {}
+        for table, doc_id, body in rows:
+            data.setdefault(table, {})[str(doc_id)] = json.loads(body)
+        return data
+
+    def write(self, data):
+        """
+        Replace the complete database contents.
+        :param data: Dictionary of tables as used by TinyDB.
+        """
+        rows = [
+            (table, int(doc_id), json.dumps(document))
+            for table, documents in data.items()
+            for doc_id, document in documents.items()
+        ]
+        with self._lock, self._transaction() as cursor:
+            cursor.execute('DELETE FROM documents')
+            cursor.executemany('INSERT INTO documents (tbl, doc_id, body) VALUES (?, ?, ?)', rows)
+
+    def commit(self, data, changes):
+        """
+        Persist only the changed documents in one transaction.
+        :param data: The complete database contents after the changes.
+        :param changes: List of Change records.
+        """
+        upserts = [
+            (change.table, int(change.doc_id), json.dumps(change.document))
+            for change in changes if change.document is not None
+        ]
+        removals = [
+            (change.table, int(change.doc_id))
+            for change in changes if change.document is None
+        ]
+        with self._lock, self._transaction() as cursor:
+            if removals:
+                cursor.executemany('DELETE FROM documents WHERE tbl = ? AND doc_id = ?', removals)
+            if upserts:
+                cursor.executemany(
+                    'INSERT INTO documents (tbl, doc_id, body) VALUES (?, ?, ?) '
+                    'ON CONFLICT (tbl, doc_id) DO UPDATE SET body = excluded.body',
+                    upserts
+                )
+
+    def sync(self):
+        """
+        Checkpoint the write-ahead log, which syncs it to disk.
+        """
+        if self._sync_on_commit:
+            return
+        with self._lock:
+            self._connection.execute('PRAGMA wal_checkpoint(PASSIVE)')
+
+    def compact(self):
+        """
+        Rebuild the database file without the pages freed by removed documents.
+        """
+        with self._lock:
+            self._connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            self._connection.execute('VACUUM')
+        return True
+
+    def reopen(self):
+        """
+        Connect anew in a forked child process. A SQLite connection must not
+        be used across a fork, so the inherited one is abandoned.
+        """
+        self._lock = threading.Lock()
+        self._connect()
+
+    def close(self):
+        self._connection.close()
+
+    def _connect(self):
+        self._connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous={0}'.format('FULL' if self._sync_on_commit else 'NORMAL'))
+
+    def _transaction(self):
+        return _Transaction(self._connection)
+
+
+class _Transaction():
+    """Context manager running the enclosed statements in one transaction."""
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def __enter__(self):
+        self._connection.execute('BEGIN IMMEDIATE')
+        return self._connection.cursor()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self._connection.execute('COMMIT')
+        else:
+            logging.error("Rolling back storage transaction: %s", str(exc_value))
+            self._connection.execute('ROLLBACK')
+        return False
+
+
+class JournalBackend(Storage):
+    """
+    Log structured storage made of a TinyDB JSON snapshot and an append-only
+    journal next to it.
+
+    Every commit appends one line with the changed documents to the journal
+    instead of rewriting the snapshot. A background compactor folds the
+    journal into a new snapshot once it has grown past ``compact_bytes``.
+    Reading replays the snapshot followed by the journal.
+    """
+
+    incremental = True
+
+    #: InterProcessLock of a database shared by several processes
+    interprocess_lock = None
+
+    def __init__(self, path, create_dirs=False, compact_bytes=None, compact_interval=None, **kwargs):
+        super().__init__()
+
+        if create_dirs:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self.path = path
+        self.journal_path = path + '.journal'
+        self.compacting_path = path + '.journal.compacting'
+        self.compact_bytes = compact_bytes if compact_bytes is not None else settings.get('JOURNAL_COMPACT_BYTES', 1048576)
+        self.compact_interval = compact_interval if compact_interval is not None else settings.get('JOURNAL_COMPACT_INTERVAL', 30)
+
+        # Guards the journal file handle
+        self._lock = threading.Lock()
+        # Serializes compactions and full snapshot writes
+        self._compact_lock = threading.Lock()
+        self._journal = open(self.journal_path, 'a', encoding='utf-8')
+        self._start_compactor()
+
+    @staticmethod
+    def resolve_path(db_path):
+        return db_path
+
+    def read(self):
+        with self._compact_lock:
+            data = self._read_snapshot()
+            for path in (self.compacting_path, self.journal_path):
+                self._replay(data, path)
+        return data or None
+
+    def write(self, data):
+        """
+        Replace the complete database contents with a new snapshot.
+        :param data: Dictionary of tables as used by TinyDB.
+        """
+        with self._compact_lock:
+            self._write_snapshot(data)
+            with self._lock:
+                self._journal.truncate(0)
+                self._journal.seek(0)
+            if os.path.exists(self.compacting_path):
+                os.remove(self.compacting_path)
+
+    def commit(self, data, changes):
+        """
+        Append the changed documents to the journal as one line.
+        :param data: The complete database contents after the changes.
+        :param changes: List of Change records.
+        """
+        line = json.dumps([[change.table, change.doc_id, change.document] for change in changes])
+        with self._lock:
+            if self.interprocess_lock is not None:
+                self._reopen_if_rotated()
+            self._journal.write(line + '\n')
+            self._journal.flush()
+
+    def sync(self):
+        """
+        Force the journal to disk.
+        """
+        with self._lock:
+            os.fsync(self._journal.fileno())
+
+    def journal_size(self):
+        with self._lock:
+            return self._journal.tell()
+
+    def compact(self):
+        """
+        Fold the journal into a new snapshot.
+
+        The active journal is rotated first, so commits can continue while the
+        snapshot is written. Replaying a journal twice is harmless, so a crash
+        at any point of the compaction never loses data.
+        """
+        with self._compact_lock:
+            with self._lock:
+                if self.interprocess_lock is not None:
+                    self._reopen_if_rotated()
+                if self._journal.tell() == 0 and not os.path.exists(self.compacting_path):
+                    return False
+                self._journal.close()
+                if os.path.exists(self.compacting_path):
+                    # A previous compaction was interrupted, keep its journal in front
+                    with open(self.compacting_path, 'a', encoding='utf-8') as compacting, \
+                            open(self.journal_path, 'r', encoding='utf-8') as journal:
+                        compacting.write(journal.read())
+                    os.remove(self.journal_path)
+                else:
+                    os.replace(self.journal_path, self.compacting_path)
+                self._journal = open(self.journal_path, 'a', encoding='utf-8')
+
+            data = self._read_snapshot()
+            self._replay(data, self.compacting_path)
+            self._write_snapshot(data)
+            os.remove(self.compacting_path)
+
+        logging.info("Compacted storage journal into %s", self.path)
+        return True
+
+    def reopen(self):
+        """
+        Reopen the journal and restart the compactor in a forked child process.
+        """
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._journal = open(self.journal_path, 'a', encoding='utf-8')
+        self._start_compactor()
+
+    def close(self):
+        self._stopped.set()
+        with self._lock:
+            self._journal.close()
+
+    # ----------------
+    # Helper Functions
+    # ----------------
+
+    def _start_compactor(self):
+        self._stopped = threading.Event()
+        self._compactor = threading.Thread(target=self._run_compactor, name='journal-compactor', daemon=True)
+        self._compactor.start()
+
+    def _run_compactor(self):
+        while not self._stopped.wait(self.compact_interval):
+            try:
+                if self.interprocess_lock is not None:
+                    # The journal is shared, rotate it only while no other process writes
+                    with self.interprocess_lock:
+                        if os.path.getsize(self.journal_path) >= self.compact_bytes:
+                            self.compact()
+                elif self.journal_size() >= self.compact_bytes:
+                    self.compact()
+            except Exception as e:
+                logging.error("Journal compaction failed %s", str(e))
+
+    def _reopen_if_rotated(self):
+        # Another process compacted the journal, our handle points at the rotated file
+        try:
+            rotated = os.fstat(self._journal.fileno()).st_ino != os.stat(self.journal_path).st_ino
+        except FileNotFoundError:
+            rotated = True
+        if rotated:
+            self._journal.close()
+            self._journal = open(self.journal_path, 'a', encoding='utf-8')
+
+    def _read_snapshot(self):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return {}
+        with open(self.path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+
+    def _write_snapshot(self, data):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(data, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.path)
+
+    def _replay(self, data, path):
+        if not os.path.exists(path):
+            return
+
+        with open(path, 'r+', encoding='utf-8') as file:
+            offset = 0
+            for line in iter(file.readline, ''):
+                try:
+                    operations = json.loads(line)
+                except ValueError:
+                    # A torn write at the end of the journal, drop it
+                    logging.warning("Discarding incomplete journal entry in %s", path)
+                    file.truncate(offset)
+                    break
+                for table, doc_id, document in operations:
+                    if document is None:
+                        data.get(table, {}).pop(doc_id, None)
+                    else:
+                        data.setdefault(table, {})[doc_id] = document
+                offset = file.tell()
+
+
+BACKENDS = {
+    'json': JSONBackend,
+    'sqlite': SQLiteBackend,
+    'journal': JournalBackend,
+}
+
+
+def get_backend_class(name):
+    """
+    Return the storage backend class registered under a name.
+    :param name: Name of the backend, e.g. 'json' or 'sqlite'.
+    """
+    try:
+        return BACKENDS[name]
+    except KeyError:
+        raise ValueError("Unknown storage backend: {0}".format(name))
@@ -0,0 +1,353 @@
+"""
+Change data capture: a feed of the writes to selected tables, kept in a
+log table of the database so subscribers can resume where they stopped.
+"""
+import copy
+import time
+import atexit
+import threading
+import logging
+from collections import namedtuple
+from datetime import datetime
+
+from tinydb import Query
+
+logging.basicConfig(level=logging.DEBUG)
+
+# Tables holding the change log and the cursors of the named subscribers
+CHANGE_LOG_TABLE = '_changes'
+CHANGE_CURSOR_TABLE = '_change_cursors'
+
+INSERT = 'insert'
+UPDATE = 'update'
+REMOVE = 'remove'
+
+# Seconds between two checks for events written by other processes
+_POLL_INTERVAL = 1.0
+
+# One write of one document. seq orders the events of the whole database,
+# key is the document ID, before and after the document before and after
+# the write (None for inserts and removals) and version the in-memory
+# version of the document after the write.
+ChangeEvent = namedtuple('ChangeEvent', ['seq', 'table', 'op', 'key', 'before', 'after', 'version', 'timestamp'])
+
+
+class ChangeFeed():
+    """
+    Feed of the inserts, updates and removals of a set of tables.
+
+    A write to a tracked table only queues one event per changed document
+    in memory while the written table is locked. A background thread
+    appends the queued events to the change log in batches once the lock
+    is released, and then wakes the readers, which read the log from the
+    cache of the engine. Events are numbered by the persistent document ID
+    sequence of the log, so their order survives restarts and holds across
+    processes sharing the database. Events still queued when the process
+    dies are lost, ``close`` writes them out. The writes of a rolled back
+    transaction were visible until then, so they are kept, followed by the
+    events of the restored documents.
+
+    Events can be read page by page with ``events``, waited for with
+    ``wait``, or pushed to a callback by a Subscription from ``subscribe``.
+    A named subscription stores how far it got and continues from there
+    when it is created again, after a restart too. The log is a ring of the
+    last ``retention`` events, the oldest ones are dropped in batches of
+    a tenth of the retention. No table is tracked unless it is listed in
+    ``tables``.
+    """
+
+    def __init__(self, engine, tables=(), retention=10000):
+        """
+        :param engine: The StorageEngine whose writes to track.
+        :param tables: Names of the tables to track.
+        :param retention: Number of events kept in the log.
+        """
+        self.engine = engine
+        self.tables = frozenset(tables)
+        self.retention = retention
+        self._condition = threading.Condition()
+        # Bumped whenever events were appended
+        self._generation = 0
+        # Events waiting for the writer thread, and the number of events queued and written so far
+        self._queue = []
+        self._queued = 0
+        self._written = 0
+        self._writer = None
+        self._closed = False
+        # The writer is a daemon thread, write out what it has not written yet when the process exits
+        atexit.register(self.flush)
+
+    def attach(self, table):
+        """
+        Start tracking the writes of a table, if it is one of the tracked tables.
+        :param table: The IndexedTable, as created by the engine.
+        """
+        if table.name in self.tables:
+            table.add_listener(self._on_change, before=True)
+
+    def events(self, after=0, limit=100, tables=None):
+        """
+        Return the events following an event.
+        :param after: seq of the last event already seen, 0 to start at the oldest event kept.
+        :param limit: Maximum number of events to return.
+        :param tables: Names of the tables to return events of, all tracked tables if not given.
+        :return: List of ChangeEvents ordered by seq.
+        """
+        events = []
+        while len(events) < limit:
+            documents = self._log().documents_after(after, limit)
+            if not documents:
+                break
+            for document in documents:
+                if tables is None or document['table'] in tables:
+                    events.append(_to_event(document))
+            after = documents[-1].doc_id
+        return events[:limit]
+
+    def last_seq(self):
+        """
+        Return the seq of the newest event, 0 if the log is empty.
+        """
+        self.engine.lock.sync()
+        return self._log().last_id()
+
+    def first_seq(self):
+        """
+        Return the seq of the oldest event kept, 0 if the log is empty.
+        """
+        documents = self._log().documents_after(0, 1)
+        return documents[0].doc_id if documents else 0
+
+    def wait(self, after, timeout=None):
+        """
+        Wait until there is an event following ``after``.
+        :param after: seq of the last event already seen.
+        :param timeout: Seconds to wait at most, forever if None.
+        :return: Whether there is such an event.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            # Never hold the condition while reading, writers notify it holding their table lock
+            with self._condition:
+                generation = self._generation
+            if self.last_seq() > after:
+                return True
+            remaining = _POLL_INTERVAL if deadline is None else min(deadline - time.monotonic(), _POLL_INTERVAL)
+            if remaining <= 0:
+                return False
+            with self._condition:
+                if self._generation == generation:
+                    # Writes of other processes only show up when polling
+                    self._condition.wait(remaining)
+
+    def subscribe(self, callback, name=None, tables=None, batch_size=100):
+        """
+        Deliver every following event to a callback on a background thread.
+
+        A named subscription resumes after the last event it acknowledged,
+        its position is stored after every delivered batch. Events are
+        delivered at least once: after a crash the events of the last batch
+        may be delivered again. Errors raised by the callback are logged and
+        the event is skipped.
+
+        :param callback: Callable taking a ChangeEvent.
+        :param name: Name under which the position is stored, None to only receive new events.
+        :param tables: Names of the tables to receive events of, all tracked tables if not given.
+        :param batch_size: Number of events read at once.
+        :return: The running Subscription.
+        """
+        after = self.cursor(name) if name is not None else None
+        if after is None:
+            after = self.last_seq()
+            if name is not None:
+                # From now on the subscription resumes instead of skipping what it missed
+                self.save_cursor(name, after)
+        subscription = Subscription(self, callback, name, tables, after, batch_size)
+        subscription.start()
+        return subscription
+
+    def cursor(self, name):
+        """
+        Return the seq of the last event a named subscription acknowledged, None if unknown.
+        """
+        cursor = self.engine.table(CHANGE_CURSOR_TABLE).get(Query().name == name)
+        return cursor['seq'] if cursor is not None else None
+
+    def save_cursor(self, name, seq):
+        """
+        Store the seq of the last event a named subscription handled.
+        """
+        self.engine.table(CHANGE_CURSOR_TABLE).upsert(
+            {'name': name, 'seq': seq, 'timestamp': datetime.now().isoformat()}, Query().name == name
+        )
+
+    def flush(self):
+        """
+        Wait until every event queued so far is in the log.
+        """
+        with self._condition:
+            target = self._queued
+            while self._written < target:
+                if self._writer is None or not self._writer.is_alive():
+                    # Nobody left to write them, e.g. in a forked process
+                    break
+                self._condition.wait(_POLL_INTERVAL)
+
+    def close(self):
+        """
+        Write out the queued events and stop the writer thread.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+            writer = self._writer
+        if writer is not None:
+            writer.join()
+            self._writer = None
+
+    def after_fork(self):
+        """
+        Forget the writer thread and the events of the parent process in a forked child.
+        """
+        self._condition = threading.Condition()
+        self._queue = []
+        self._queued = self._written = 0
+        self._writer = None
+
+    def trim(self):
+        """
+        Drop the events beyond the retention from the log.
+        :return: Number of events dropped.
+        """
+        log = self._log()
+        excess = len(log) - self.retention
+        if excess <= 0:
+            return 0
+        expired = [document.doc_id for document in log.documents_after(0, excess)]
+        log.remove(doc_ids=expired)
+        return len(expired)
+
+    def stats(self):
+        """
+        Return the tracked tables, the newest seq and the stored cursors.
+        """
+        return {
+            'tables': sorted(self.tables),
+            'last_seq': self.last_seq(),
+            'retention': self.retention,
+            'queued': self._queued - self._written,
+            'cursors': {cursor['name']: cursor['seq'] for cursor in self.engine.table(CHANGE_CURSOR_TABLE).all()},
+        }
+
+    # ----------------
+    # Helper Functions
+    # ----------------
+
+    def _log(self):
+        return self.engine.table(CHANGE_LOG_TABLE)
+
+    def _on_change(self, table, changes, before):
+        if changes is None:
+            # Reloaded after a write of another process, which logged its events itself
+            return
+        timestamp = datetime.now().isoformat()
+        documents = []
+        for doc_id, after in changes.items():
+            previous = before.get(doc_id)
+            if previous == after:
+                continue
+            op = INSERT if previous is None else REMOVE if after is None else UPDATE
+            documents.append({
+                'table': table.name, 'op': op, 'key': int(doc_id),
+                'before': previous, 'after': copy.deepcopy(after),
+                'version': table.version_of(doc_id), 'timestamp': timestamp,
+            })
+        if not documents:
+            return
+        # Never write the log here, the written table is still locked
+        with self._condition:
+            self._queue.extend(documents)
+            self._queued += len(documents)
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._write_loop, name='change-feed-writer', daemon=True)
+                self._writer.start()
+            self._condition.notify_all()
+
+    def _write_loop(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._closed:
+                    self._condition.wait()
+                if not self._queue:
+                    return
+                batch = self._queue
+                self._queue = []
+            try:
+                log = self._log()
+                log.insert_multiple(batch)
+                if len(log) > self.retention + max(self.retention // 10, 1):
+                    self.trim()
+            except Exception as e:
+                logging.error("Writing %s change events failed %s", len(batch), str(e))
+            with self._condition:
+                self._written += len(batch)
+                self._generation += 1
+                self._condition.notify_all()
+
+    def _wake(self):
+        with self._condition:
+            self._generation += 1
+            self._condition.notify_all()
+
+
+class Subscription():
+    """
+    Background thread delivering the events of a ChangeFeed to a callback.
+    """
+
+    def __init__(self, feed, callback, name, tables, after, batch_size):
+        self.feed = feed
+        self.callback = callback
+        self.name = name
+        self.tables = tables
+        self.position = after
+        self.batch_size = batch_size
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='change-feed-{0}'.format(self.name or 'anonymous'), daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """
+        Stop delivering events, after the event being delivered.
+        """
+        self._stopped.set()
+        self.feed._wake()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            if not self.feed.wait(self.position, timeout=_POLL_INTERVAL):
+                continue
+            # Read every table, so the position also moves past the events of other tables
+            for event in self.feed.events(self.position, self.batch_size):
+                if self._stopped.is_set():
+                    return
+                if self.tables is None or event.table in self.tables:
+                    try:
+                        self.callback(event)
+                    except Exception as e:
+                        logging.error("Change feed subscriber %s failed on event %s: %s", self.name, event.seq, str(e))
+                self.position = event.seq
+            if self.name is not None:
+                self.feed.save_cursor(self.name, self.position)
+
+
+def _to_event(document):
+    return ChangeEvent(
+        document.doc_id, document['table'], document['op'], document['key'],
+        document.get('before'), document['after'], document['version'], document['timestamp'],
+    )
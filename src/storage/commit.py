@@ -0,0 +1,286 @@
+import copy
+import threading
+import time
+import logging
+
+from src.storage.backends import Change
+
+logging.basicConfig(level=logging.DEBUG)
+
+# Durability policies of the group committer
+DURABILITY_COMMIT = 'commit'      # fsync after every storage commit
+DURABILITY_INTERVAL = 'interval'  # fsync at most every sync_interval_ms
+DURABILITY_OS = 'os'              # leave flushing to the operating system
+DURABILITY_POLICIES = (DURABILITY_COMMIT, DURABILITY_INTERVAL, DURABILITY_OS)
+
+# Seconds before committing the changes of a failed commit again, doubled after every failure up to the maximum
+_RETRY_DELAY = 0.05
+_MAX_RETRY_DELAY = 5.0
+
+
+class CommitTicket():
+    """Handed to a writer to wait until its changes have been committed."""
+
+    def __init__(self, changes, seq=0):
+        self.changes = changes
+        self.seq = seq
+        self.error = None
+        self._done = threading.Event()
+
+    def resolve(self, error=None):
+        self.error = error
+        self._done.set()
+
+    def wait(self):
+        """
+        Block until the changes are committed to the storage.
+        :raises: The error raised by the storage, if the commit failed.
+        """
+        self._done.wait()
+        if self.error is not None:
+            raise self.error
+
+
+class GroupCommitter():
+    """
+    Coalesce concurrent writes into a single storage commit.
+
+    Writers submit their changes and wait on the returned ticket. A
+    background thread collects every change submitted while the previous
+    commit was running (and optionally for ``window_ms`` more), merges them
+    and commits them to the storage in one go.
+
+    The cache already holds the changes of a failed commit, so they are
+    kept and committed again together with the next batch, or on their own
+    after a growing delay, until the storage takes them. The writers of the
+    failed batch still get the error, although their changes stay visible
+    and reach the storage with a later commit.
+    """
+
+    def __init__(self, middleware, lock, window_ms=0, max_batch=256,
+                 durability=DURABILITY_COMMIT, sync_interval_ms=100):
+        """
+        :param middleware: The caching middleware owning the storage.
+        :param lock: The engine lock guarding the cached database contents.
+        :param window_ms: Time to wait for further writes before committing.
+        :param max_batch: Maximum number of writes in one commit.
+        :param durability: One of DURABILITY_POLICIES.
+        :param sync_interval_ms: fsync interval of the 'interval' policy.
+        """
+        if durability not in DURABILITY_POLICIES:
+            raise ValueError("Unknown durability policy: {0}".format(durability))
+
+        self._middleware = middleware
+        self._lock = lock
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.durability = durability
+        self.sync_interval = sync_interval_ms / 1000.0
+
+        self._pending = []
+        # Sequence number of the last submitted write and of the last write whose commit finished
+        self._submitted = 0
+        self._committed = 0
+        self._condition = threading.Condition()
+        self._stopped = False
+        # Latest change of every document whose commit failed, by (table, doc_id)
+        self._failed = {}
+        self._retry_delay = 0.0
+        self._retry_at = 0.0
+        self._dirty = False
+        self._last_sync = time.monotonic()
+
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'writes': 0,
+            'commits': 0,
+            'syncs': 0,
+            'failed_commits': 0,
+            'last_batch_size': 0,
+            'max_batch_size': 0,
+            'total_flush_latency_ms': 0.0,
+            'last_flush_latency_ms': 0.0,
+            'max_flush_latency_ms': 0.0,
+        }
+
+        self._thread = threading.Thread(target=self._run, name='group-committer', daemon=True)
+        self._thread.start()
+
+    def submit(self, changes):
+        """
+        Queue changes for the next commit.
+        :param changes: List of Change records.
+        :return: CommitTicket to wait on.
+        """
+        storage = self._middleware.storage
+        if getattr(storage, 'incremental', False):
+            # The documents keep changing in the cache, so commit a copy
+            changes = [
+                Change(change.table, change.doc_id, copy.deepcopy(change.document))
+                for change in changes
+            ]
+
+        with self._condition:
+            if self._stopped:
+                raise RuntimeError("Group committer is stopped")
+            self._submitted += 1
+            ticket = CommitTicket(changes, self._submitted)
+            self._pending.append(ticket)
+            # Flushing writers wait on the condition as well
+            self._condition.notify_all()
+        return ticket
+
+    def flush(self):
+        """
+        Wait until every write submitted so far is committed, including
+        the writes of the batch being committed right now.
+        """
+        with self._condition:
+            target = self._submitted
+            while self._committed < target and self._thread.is_alive():
+                self._condition.wait(1.0)
+
+    def stop(self):
+        """
+        Commit the outstanding writes and stop the background thread.
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def stats(self):
+        """
+        Return the batch size and flush latency counters.
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        commits = stats['commits']
+        stats['avg_batch_size'] = stats['writes'] / commits if commits else 0.0
+        stats['avg_flush_latency_ms'] = stats['total_flush_latency_ms'] / commits if commits else 0.0
+        stats['pending'] = self._submitted - self._committed
+        stats['retrying'] = len(self._failed)
+        stats['durability'] = self.durability
+        return stats
+
+    # ----------------
+    # Helper Functions
+    # ----------------
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopped and not self._retry_due():
+                    self._condition.wait(self._idle_timeout())
+                    self._sync_if_due()
+                stopping = not self._pending and self._stopped
+
+            if stopping:
+                if self._failed:
+                    # Last attempt, the changes are lost when it fails too
+                    self._commit([])
+                    if self._failed:
+                        logging.error("Dropping %s changes the storage did not take", len(self._failed))
+                self._sync(force=self._dirty and self.durability != DURABILITY_OS)
+                return
+
+            if self.window:
+                self._wait_for_window()
+
+            with self._condition:
+                batch = self._pending[:self.max_batch]
+                del self._pending[:len(batch)]
+
+            self._commit(batch)
+
+    def _wait_for_window(self):
+        deadline = time.monotonic() + self.window
+        with self._condition:
+            while len(self._pending) < self.max_batch and not self._stopped:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+    def _commit(self, batch):
+        # Changes of earlier failed commits go first, later writes of the same documents replace them
+        merged = dict(self._failed)
+        for ticket in batch:
+            for change in ticket.changes:
+                key = (change.table, change.doc_id)
+                # Keep the latest version of each document, in write order
+                merged.pop(key, None)
+                merged[key] = change
+        changes = list(merged.values())
+
+        started = time.monotonic()
+        error = None
+        try:
+            storage = self._middleware.storage
+            if getattr(storage, 'incremental', False):
+                storage.commit(None, changes)
+            else:
+                # Whole-file storages serialize the cache, which must not change meanwhile
+                with self._lock.exclusive():
+                    storage.commit(self._middleware.cache, changes)
+            self._dirty = True
+            self._failed = {}
+            self._retry_delay = 0.0
+            if self.durability == DURABILITY_COMMIT:
+                self._sync(force=True)
+            else:
+                self._sync_if_due()
+        except Exception as e:
+            logging.error("Storage commit failed %s", str(e))
+            error = e
+            self._failed = merged
+            self._retry_delay = min(max(self._retry_delay * 2, _RETRY_DELAY), _MAX_RETRY_DELAY)
+            self._retry_at = time.monotonic() + self._retry_delay
+
+        latency = (time.monotonic() - started) * 1000.0
+        with self._stats_lock:
+            self._stats['writes'] += len(batch)
+            self._stats['commits'] += 1
+            self._stats['last_batch_size'] = len(batch)
+            self._stats['max_batch_size'] = max(self._stats['max_batch_size'], len(batch))
+            self._stats['total_flush_latency_ms'] += latency
+            self._stats['last_flush_latency_ms'] = latency
+            self._stats['max_flush_latency_ms'] = max(self._stats['max_flush_latency_ms'], latency)
+            if error is not None:
+                self._stats['failed_commits'] += 1
+
+        for ticket in batch:
+            ticket.resolve(error)
+        if batch:
+            with self._condition:
+                # Batches are committed in submission order
+                self._committed = batch[-1].seq
+                self._condition.notify_all()
+
+    def _idle_timeout(self):
+        timeouts = []
+        if self.durability == DURABILITY_INTERVAL and self._dirty:
+            timeouts.append(self.sync_interval)
+        if self._failed:
+            timeouts.append(max(self._retry_at - time.monotonic(), 0.0))
+        return min(timeouts) if timeouts else None
+
+    def _retry_due(self):
+        return bool(self._failed) and time.monotonic() >= self._retry_at
+
+    def _sync_if_due(self):
+        if self.durability != DURABILITY_INTERVAL or not self._dirty:
+            return
+        if time.monotonic() - self._last_sync >= self.sync_interval:
+            self._sync(force=True)
+
+    def _sync(self, force):
+        if not force:
+            return
+        sync = getattr(self._middleware.storage, 'sync', None)
+        if sync is not None:
+            sync()
+        self._dirty = False
+        self._last_sync = time.monotonic()
+        with self._stats_lock:
+            self._stats['syncs'] += 1
@@ -0,0 +1,347 @@
+import os
+import threading
+import logging
+from contextlib import ExitStack, contextmanager
+
+from tinydb import TinyDB
+from config import settings
+
+from src.storage.backends import get_backend_class
+from src.storage.changes import ChangeFeed
+from src.storage.locks import EngineLock, InterProcessLock
+from src.storage.middleware import WriteThroughCachingMiddleware
+from src.storage.table import IndexedTable
+from src.storage.transaction import Transaction
+from src.storage.typed import TYPED_TABLES, DefaultTableMigrator
+
+logging.basicConfig(level=logging.DEBUG)
+
+DEFAULT_DB_PATH = 'src/db/db.json'
+
+# Fields and field combinations kept in the in-memory hash indexes
+INDEXED_FIELDS = (
+    ('model_id',),
+    ('resource_id',),
+    ('email',),
+    ('auth_token',),
+    ('fl_service_id',),
+    ('policy_id',),
+    ('id',),
+    ('resource_id', 'doc_type'),
+)
+
+# ID fields kept in sorted order, see src.storage.ids
+ORDERED_FIELDS = ('model_id', 'resource_id', 'fl_service_id', 'policy_id', 'user_id')
+
+
+class EngineTable(IndexedTable):
+    indexed_fields = INDEXED_FIELDS
+    ordered_fields = ORDERED_FIELDS
+
+
+class TypedTable(EngineTable):
+    """
+    Table of one entity type.
+
+    While documents of the type are still waiting in the default table to
+    be migrated, lookups move the documents they need first, and scans
+    finish the migration.
+    """
+
+    #: The DefaultTableMigrator of the engine, set by the engine
+    migrator = None
+
+    def lookup(self, **fields):
+        if self._migrating():
+            self.migrator.migrate_matching(self.name, fields)
+        return super().lookup(**fields)
+
+    def lookup_many(self, field, values):
+        values = list(values)
+        if self._migrating():
+            for value in values:
+                self.migrator.migrate_matching(self.name, {field: value})
+        return super().lookup_many(field, values)
+
+    def insert_if_absent(self, document, **fields):
+        if self._migrating():
+            self.migrator.migrate_matching(self.name, fields)
+        return super().insert_if_absent(document, **fields)
+
+    def search(self, cond):
+        self._finish_migration()
+        return super().search(cond)
+
+    def snapshot(self):
+        self._finish_migration()
+        return super().snapshot()
+
+    def query(self, filters=None, sort=None, limit=None, cursor=None, fields=None):
+        self._finish_migration()
+        return super().query(filters, sort, limit, cursor, fields)
+
+    def count(self, cond):
+        self._finish_migration()
+        return super().count(cond)
+
+    def __len__(self):
+        self._finish_migration()
+        return super().__len__()
+
+    def __iter__(self):
+        self._finish_migration()
+        return super().__iter__()
+
+    def _migrating(self):
+        # Nested operations already hold table locks, the outermost one migrated
+        return self.migrator is not None and not self.migrator.done and not self._engine_lock.depth()
+
+    def _finish_migration(self):
+        if self._migrating():
+            self.migrator.migrate_all()
+
+
+class StorageEngine(TinyDB):
+    """
+    TinyDB database shared by all the models of the process.
+
+    The database contents are cached in memory and every table keeps hash
+    indexes over ``INDEXED_FIELDS``. Every table has its own reader/writer
+    lock, so reads run in parallel and writes to different tables do not
+    block each other. Whole-database operations hold the engine lock
+    exclusively.
+
+    With an InterProcessLock the database can be shared by several
+    processes. Writes then hold the lock across processes and the cache is
+    reloaded whenever another process wrote to the database.
+
+    Every entity type has its own table (``TYPED_TABLES``). Documents still
+    kept in the default table by older versions are moved there in the
+    background by a DefaultTableMigrator.
+
+    The writes to the tables listed in CHANGE_FEED_TABLES are recorded in
+    the ChangeFeed ``changes``.
+    """
+
+    table_class = EngineTable
+
+    def __init__(self, *args, interprocess=None, **kwargs):
+        self.lock = EngineLock(interprocess)
+        self.lock.refresh = self._reload
+        self._tables_lock = threading.Lock()
+        # Created first, so it is attached to every table
+        self.changes = ChangeFeed(
+            self,
+            tables=settings.get('CHANGE_FEED_TABLES', ()),
+            retention=settings.get('CHANGE_FEED_RETENTION', 10000),
+        )
+        super().__init__(*args, **kwargs)
+        self.migrator = DefaultTableMigrator(
+            self,
+            batch_size=settings.get('TYPED_TABLE_MIGRATION_BATCH', 100),
+            interval=settings.get('TYPED_TABLE_MIGRATION_INTERVAL', 0.05),
+        )
+
+        if interprocess is not None:
+            # Other processes must see a write as soon as the lock is released
+            logging.info("Group commit is disabled for multi-process storage")
+            self.storage.storage.interprocess_lock = interprocess
+        elif settings.get('GROUP_COMMIT', True):
+            self.storage.enable_group_commit(
+                self.lock,
+                window_ms=settings.get('GROUP_COMMIT_WINDOW_MS', 0),
+                max_batch=settings.get('GROUP_COMMIT_MAX_BATCH', 256),
+                durability=settings.get('STORAGE_DURABILITY', 'commit'),
+                sync_interval_ms=settings.get('STORAGE_SYNC_INTERVAL_MS', 100),
+            )
+
+        self.migrator.start()
+
+    def stats(self):
+        """
+        Return the group commit counters of the engine, the progress of the
+        typed table migration and the position of the change feed.
+        """
+        committer = self.storage.committer
+        stats = committer.stats() if committer is not None else {}
+        stats['typed_table_migration'] = self.migrator.stats()
+        stats['change_feed'] = self.changes.stats()
+        return stats
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run the writes of the enclosed block as one atomic storage commit.
+
+        The writes are visible to other threads as soon as they are made. If
+        the block raises, every document it touched is restored and nothing
+        is committed. Nested transactions join the outermost one.
+        """
+        if self.lock.transaction() is not None:
+            yield self.lock.transaction()
+            return
+
+        with self.lock.writing(None, exclusive=self.storage.serialized_writes):
+            transaction = Transaction()
+            self.lock.set_transaction(transaction)
+            try:
+                yield transaction
+            except BaseException:
+                self.lock.set_transaction(None)
+                transaction.rollback()
+                raise
+            self.lock.set_transaction(None)
+
+            if transaction.changes:
+                try:
+                    ticket = self.storage.commit(self.storage.read(), transaction.merged_changes())
+                except BaseException:
+                    transaction.rollback()
+                    raise
+                if ticket is not None:
+                    self.lock.defer(ticket)
+
+    def compact(self):
+        """
+        Let the storage backend reclaim the space of removed documents.
+        :return: Whether the backend compacted anything.
+        """
+        compact = getattr(self.storage.storage, 'compact', None)
+        if compact is None:
+            # The JSON file is rewritten as a whole on every commit anyway
+            return False
+        if self.storage.committer is not None:
+            self.storage.committer.flush()
+        with self.lock.writing(None, exclusive=True):
+            return bool(compact())
+
+    def before_fork(self):
+        """
+        Quiesce the engine before the process forks, so the child never
+        inherits a lock held by a thread that does not exist in it.
+        """
+        if not self._opened:
+            return
+        self.migrator.pause()
+        self.lock.acquire_write()
+        with self._tables_lock:
+            self._fork_tables = [self._tables[name] for name in sorted(self._tables)]
+        for table in self._fork_tables:
+            table.lock.acquire_write()
+
+    def after_fork_in_parent(self):
+        if not self._opened:
+            return
+        self._release_fork_locks()
+
+    def after_fork(self):
+        """
+        Prepare the engine of a multi-process database for use in a forked
+        worker process: reopen the lock file and the storage and reload the
+        cache on the next access.
+        """
+        if not self._opened:
+            return
+        self._release_fork_locks()
+        self.changes.after_fork()
+        self.lock.interprocess.reopen()
+        self.storage.storage.reopen()
+        self.lock.generation = None
+        self.migrator.start()
+
+    def close(self):
+        self.migrator.stop()
+        self.changes.close()
+        super().close()
+        if self.lock.interprocess is not None:
+            self.lock.interprocess.close()
+
+    def table(self, name, **kwargs):
+        with self._tables_lock:
+            if name in self._tables:
+                return self._tables[name]
+
+            if name in TYPED_TABLES:
+                table = TypedTable(self.storage, name, engine_lock=self.lock, **kwargs)
+                table.migrator = self.migrator
+            else:
+                table = self.table_class(self.storage, name, engine_lock=self.lock, **kwargs)
+            self.changes.attach(table)
+            self._tables[name] = table
+            return table
+
+    def _release_fork_locks(self):
+        for table in reversed(self._fork_tables):
+            table.lock.release_write()
+        self.lock.release_write()
+        self.migrator.resume()
+
+    def _reload(self):
+        """
+        Reload the cache after another process changed the database.
+        Called by the engine lock, holding it exclusively.
+        """
+        with self._tables_lock:
+            tables = [self._tables[name] for name in sorted(self._tables)]
+
+        with ExitStack() as stack:
+            for table in tables:
+                stack.enter_context(table.lock.exclusive())
+            previous = self.storage.cache or {}
+            current = self.storage.reload() or {}
+            for table in tables:
+                table.reset(previous.get(table.name, {}), current.get(table.name, {}))
+        logging.debug("Reloaded storage changed by another process")
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_db(db_path=DEFAULT_DB_PATH):
+    """
+    Return the storage engine of a database file, opening it on first use.
+
+    The persistence backend is selected with the STORAGE_BACKEND setting.
+    With STORAGE_MULTIPROCESS the database can be shared by several worker
+    processes, coordinated through a lock file next to it.
+
+    :param db_path: Path to the TinyDB database file.
+    :return: The process wide StorageEngine instance for the file.
+    """
+    path = os.path.abspath(db_path)
+    with _engines_lock:
+        engine = _engines.get(path)
+        if engine is None:
+            backend_cls = get_backend_class(settings.get('STORAGE_BACKEND', 'json'))
+            backend_path = backend_cls.resolve_path(path)
+            logging.info("Opening %s storage engine for %s", backend_cls.__name__, backend_path)
+            interprocess = None
+            if settings.get('STORAGE_MULTIPROCESS', False):
+                interprocess = InterProcessLock(backend_path + '.lock')
+            engine = StorageEngine(backend_path, storage=WriteThroughCachingMiddleware(backend_cls),
+                                   interprocess=interprocess)
+            if interprocess is not None:
+                # Workers forked by the WSGI server keep using the engines opened before the fork
+                os.register_at_fork(before=engine.before_fork, after_in_parent=engine.after_fork_in_parent,
+                                    after_in_child=engine.after_fork)
+            _engines[path] = engine
+        return engine
+
+
+def get_stats():
+    """
+    Return the counters of every open storage engine keyed by database path.
+    """
+    with _engines_lock:
+        return {path: engine.stats() for path, engine in _engines.items()}
+
+
+def close_all():
+    """
+    Close every open storage engine.
+    """
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.close()
+        _engines.clear()
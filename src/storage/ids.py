@@ -0,0 +1,120 @@
+"""
+IDs of new documents.
+
+By default the models derive the ID of a new document by hashing it. With
+``ID_SCHEME = "ulid"`` they use ULIDs instead: 26 character strings whose
+first 10 characters encode the creation time in milliseconds, so sorting
+the IDs sorts the documents by creation time. The storage keeps the ID
+fields in ordered indexes, which turns sorting by ID and ID range filters
+into range scans. IDs created under either scheme keep resolving.
+"""
+import os
+import time
+import threading
+
+from config import settings
+
+ID_SCHEMES = ('hash', 'ulid')
+
+# Crockford's base 32, which sorts in the same order as the encoded numbers
+ULID_ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+ULID_LENGTH = 26
+
+_RANDOM_BITS = 80
+_TIME_BITS = 48
+
+
+class ULIDGenerator():
+    """
+    Monotonic ULID generator.
+
+    IDs created within the same millisecond increment the random part of
+    the previous one, so IDs of one process are strictly increasing. The
+    state is reset in forked processes, which therefore never continue the
+    sequence of their parent.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_time = -1
+        self._last_random = 0
+        os.register_at_fork(after_in_child=self._reset)
+
+    def new(self, timestamp_ms=None):
+        """
+        Return a new ULID.
+        :param timestamp_ms: Creation time in milliseconds since the epoch, now if not given.
+        """
+        with self._lock:
+            now = int(time.time() * 1000) if timestamp_ms is None else timestamp_ms
+            if now <= self._last_time:
+                # Same millisecond, or the clock went back: continue the previous ID
+                now = self._last_time
+                random = self._last_random + 1
+                if random >> _RANDOM_BITS:
+                    now += 1
+                    random = int.from_bytes(os.urandom(10), 'big')
+            else:
+                random = int.from_bytes(os.urandom(10), 'big')
+            self._last_time, self._last_random = now, random
+        return encode_ulid(now, random)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._last_time = -1
+        self._last_random = 0
+
+
+def encode_ulid(timestamp_ms, random):
+    """
+    Encode a ULID from its timestamp and its random part.
+    :param timestamp_ms: Milliseconds since the epoch, 48 bits.
+    :param random: Random part, 80 bits.
+    """
+    if timestamp_ms >> _TIME_BITS:
+        raise ValueError("The timestamp does not fit into a ULID")
+    value = (timestamp_ms << _RANDOM_BITS) | random
+    characters = []
+    for _ in range(ULID_LENGTH):
+        characters.append(ULID_ALPHABET[value & 31])
+        value >>= 5
+    return ''.join(reversed(characters))
+
+
+def ulid_timestamp(ulid):
+    """
+    Return the creation time of a ULID in milliseconds since the epoch.
+    :raises ValueError: If the value is not a ULID.
+    """
+    if not isinstance(ulid, str) or len(ulid) != ULID_LENGTH:
+        raise ValueError("Not a ULID: {0}".format(ulid))
+    value = 0
+    for character in ulid[:10].upper():
+        position = ULID_ALPHABET.find(character)
+        if position < 0:
+            raise ValueError("Not a ULID: {0}".format(ulid))
+        value = (value << 5) | position
+    return value
+
+
+def id_scheme():
+    """
+    Return the configured ID scheme, "hash" unless ID_SCHEME is set.
+    """
+    scheme = settings.get('ID_SCHEME', 'hash')
+    if scheme not in ID_SCHEMES:
+        raise ValueError("Unknown ID_SCHEME '{0}', use one of {1}".format(scheme, ', '.join(ID_SCHEMES)))
+    return scheme
+
+
+def generate_id(hashed):
+    """
+    Return the ID of a new document under the configured scheme.
+    :param hashed: Callable returning the hash ID of the document, used by the "hash" scheme.
+    """
+    if id_scheme() == 'ulid':
+        return ulid_generator.new()
+    return hashed()
+
+
+ulid_generator = ULIDGenerator()
@@ -0,0 +1,332 @@
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+
+class ReadWriteLock():
+    """
+    Reentrant reader/writer lock preferring writers.
+
+    Any number of threads may hold the lock shared, one thread may hold it
+    exclusively. A thread holding the lock exclusively may also take it
+    shared, but a shared holder can not upgrade to exclusive.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = {}
+        self._writer = None
+        self._writer_depth = 0
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer == me or me in self._readers:
+                self._readers[me] = self._readers.get(me, 0) + 1
+                return
+            while self._writer is not None or self._waiting_writers:
+                self._condition.wait()
+            self._readers[me] = 1
+
+    def release_read(self):
+        me = threading.get_ident()
+        with self._condition:
+            count = self._readers[me] - 1
+            if count:
+                self._readers[me] = count
+            else:
+                del self._readers[me]
+                self._condition.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer == me:
+                self._writer_depth += 1
+                return
+            if me in self._readers:
+                raise RuntimeError("A shared lock can not be upgraded to an exclusive lock")
+            self._waiting_writers += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._condition.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = me
+            self._writer_depth = 1
+
+    def release_write(self):
+        with self._condition:
+            self._writer_depth -= 1
+            if not self._writer_depth:
+                self._writer = None
+                self._condition.notify_all()
+
+    @contextmanager
+    def shared(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def exclusive(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+class InterProcessLock():
+    """
+    Reentrant lock shared by every process opening the same database.
+
+    The lock is an ``flock`` on a file next to the database. The file also
+    holds a generation counter that every write bumps, which lets a process
+    notice that its cached view of the database is outdated.
+    """
+
+    _WIDTH = 20
+
+    def __init__(self, path):
+        if fcntl is None:
+            raise RuntimeError("Multi-process storage requires fcntl file locking")
+        self.path = path
+        self._mutex = threading.RLock()
+        self._owner = None
+        self._depth = 0
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    def acquire(self):
+        self._mutex.acquire()
+        if not self._depth:
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            except BaseException:
+                self._mutex.release()
+                raise
+            self._owner = threading.get_ident()
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if not self._depth:
+            self._owner = None
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._mutex.release()
+
+    def held(self):
+        """
+        Whether the current thread holds the lock.
+        """
+        return self._owner == threading.get_ident()
+
+    def generation(self):
+        """
+        Return the generation counter of the database.
+        """
+        value = os.pread(self._fd, self._WIDTH, 0)
+        return int(value) if value.strip() else 0
+
+    def bump(self):
+        """
+        Increment the generation counter, the caller must hold the lock.
+        :return: The new generation.
+        """
+        generation = self.generation() + 1
+        os.pwrite(self._fd, str(generation).zfill(self._WIDTH).encode('ascii'), 0)
+        return generation
+
+    def reopen(self):
+        """
+        Open the lock file anew, a forked child process must not share the
+        open file description of its parent as flock is bound to it.
+        """
+        self._mutex = threading.RLock()
+        self._owner = None
+        self._depth = 0
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    def close(self):
+        os.close(self._fd)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+        return False
+
+
+class EngineLock(ReadWriteLock):
+    """
+    Lock of a whole storage engine.
+
+    Table writers hold it shared next to the exclusive lock of their table,
+    so writes to different tables run concurrently. Operations needing a
+    consistent view of every table, like serializing the complete database,
+    hold it exclusively.
+
+    Commit tickets of a thread are only waited for once the thread leaves
+    its outermost write, so no thread ever waits for a commit while holding
+    a lock the committer may need.
+
+    When several processes share the database an InterProcessLock is taken
+    around every outermost write, before any other lock. ``refresh`` is then
+    called whenever another process wrote since the last refresh.
+    """
+
+    def __init__(self, interprocess=None):
+        super().__init__()
+        self._local = threading.local()
+        self.interprocess = interprocess
+        #: Callable reloading the engine, called holding the InterProcessLock
+        self.refresh = None
+        #: Generation of the database the cached view corresponds to
+        self.generation = None
+
+    def depth(self):
+        """
+        Return the number of table operations the current thread is inside of.
+        """
+        return getattr(self._local, 'depth', 0)
+
+    def sync(self):
+        """
+        Reload the engine if another process wrote since the last refresh.
+        """
+        if self.interprocess is not None and not self.depth() \
+                and self.interprocess.generation() != self.generation:
+            with self.interprocess:
+                self._refresh_if_changed()
+
+    @contextmanager
+    def reading(self, table_lock):
+        """
+        Hold a table lock shared.
+        :param table_lock: ReadWriteLock of the table being read.
+        """
+        self.sync()
+
+        table_lock.acquire_read()
+        self._local.depth = self.depth() + 1
+        try:
+            yield
+        finally:
+            self._local.depth -= 1
+            table_lock.release_read()
+
+    @contextmanager
+    def writing(self, table_lock, exclusive=False):
+        """
+        Hold the engine lock shared and a table lock exclusively.
+        :param table_lock: ReadWriteLock of the table being written, None to only take the engine lock.
+        :param exclusive: Hold the engine lock exclusively instead.
+        """
+        interprocess = self._enter_interprocess()
+        try:
+            if exclusive:
+                self.acquire_write()
+            else:
+                self.acquire_read()
+            if table_lock is not None:
+                try:
+                    table_lock.acquire_write()
+                except BaseException:
+                    self.release_write() if exclusive else self.release_read()
+                    raise
+        except BaseException:
+            self._leave_interprocess(interprocess, wrote=False)
+            raise
+
+        self._local.depth = self.depth() + 1
+        try:
+            yield
+        finally:
+            self._local.depth -= 1
+            if table_lock is not None:
+                table_lock.release_write()
+            if exclusive:
+                self.release_write()
+            else:
+                self.release_read()
+            if interprocess:
+                self._leave_interprocess(interprocess, wrote=getattr(self._local, 'wrote', False))
+            if not self._local.depth:
+                self._wait_for_tickets()
+
+    def transaction(self):
+        """
+        Return the Transaction the current thread is running, if any.
+        """
+        return getattr(self._local, 'transaction', None)
+
+    def set_transaction(self, transaction):
+        self._local.transaction = transaction
+
+    def mark_written(self):
+        """
+        Record that the current thread changed the database.
+        """
+        self._local.wrote = True
+
+    def defer(self, ticket):
+        """
+        Wait for a commit ticket once the current thread leaves its outermost write.
+        :param ticket: The CommitTicket to wait for.
+        """
+        tickets = getattr(self._local, 'tickets', None)
+        if tickets is None:
+            tickets = self._local.tickets = []
+        tickets.append(ticket)
+
+    def _enter_interprocess(self):
+        if self.interprocess is None or self.interprocess.held():
+            return False
+        if self.depth():
+            raise RuntimeError("Writing while reading another table is not supported with multi-process storage")
+        self.interprocess.acquire()
+        try:
+            self._refresh_if_changed()
+        except BaseException:
+            self.interprocess.release()
+            raise
+        self._local.wrote = False
+        return True
+
+    def _leave_interprocess(self, interprocess, wrote):
+        if not interprocess:
+            return
+        try:
+            if wrote:
+                # Our own writes must not trigger a refresh
+                self.generation = self.interprocess.bump()
+        finally:
+            self._local.wrote = False
+            self.interprocess.release()
+
+    def _refresh_if_changed(self):
+        generation = self.interprocess.generation()
+        if generation == self.generation:
+            return
+        if self.refresh is not None:
+            with self.exclusive():
+                self.refresh()
+        self.generation = generation
+
+    def _wait_for_tickets(self):
+        tickets = getattr(self._local, 'tickets', None)
+        if not tickets:
+            return
+        self._local.tickets = []
+        for ticket in tickets:
+            ticket.wait()
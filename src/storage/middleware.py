@@ -0,0 +1,87 @@
+from tinydb.middlewares import Middleware
+
+from src.storage.commit import GroupCommitter
+
+
+class WriteThroughCachingMiddleware(Middleware):
+    """
+    Keep the database contents in memory and pass every write straight
+    through to the wrapped storage.
+
+    TinyDB's ``CachingMiddleware`` delays writes until a number of changes
+    has been collected, which may lose data when the service stops. This
+    middleware only removes the cost of re-reading and re-parsing the storage
+    on every read, every write still reaches the storage immediately.
+    """
+
+    def __init__(self, storage_cls):
+        # Initialize the parent constructor
+        super().__init__(storage_cls)
+
+        # Prepare the cache
+        self.cache = None
+        self.committer = None
+
+    def enable_group_commit(self, lock, **options):
+        """
+        Route commits through a GroupCommitter.
+        :param lock: The engine lock guarding the cached database contents.
+        :param options: Options passed on to the GroupCommitter.
+        """
+        self.committer = GroupCommitter(self, lock, **options)
+
+    @property
+    def serialized_writes(self):
+        """
+        Whether writers must hold the engine lock exclusively, because the
+        storage serializes the whole cache on every commit.
+        """
+        return self.committer is None and not getattr(self.storage, 'incremental', False)
+
+    def reload(self):
+        """
+        Replace the cache with the current contents of the storage.
+        """
+        self.cache = self.storage.read() or {}
+        return self.cache
+
+    def read(self):
+        if self.cache is None:
+            # Empty cache: read from the storage, tables are added to the cached dict in place
+            self.cache = self.storage.read() or {}
+
+        # Return the cached data
+        return self.cache
+
+    def write(self, data):
+        if self.committer is not None:
+            # Keep the order of writes still waiting for their commit
+            self.committer.flush()
+        self.cache = data
+        self.storage.write(data)
+        sync = getattr(self.storage, 'sync', None)
+        if sync is not None:
+            sync()
+
+    def commit(self, data, changes):
+        """
+        Update the cache and let the storage persist the changed documents.
+        :param data: The complete database contents after the changes.
+        :param changes: List of Change records.
+        :return: A CommitTicket to wait on when group commit is enabled, otherwise None.
+        """
+        self.cache = data
+        if self.committer is not None:
+            return self.committer.submit(changes)
+
+        self.storage.commit(data, changes)
+        sync = getattr(self.storage, 'sync', None)
+        if sync is not None:
+            sync()
+        return None
+
+    def close(self):
+        if self.committer is not None:
+            self.committer.stop()
+        self.cache = None
+        self.storage.close()
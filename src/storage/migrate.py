@@ -0,0 +1,74 @@
+"""
+One-shot migration of an existing TinyDB JSON database into another
+storage backend.
+
+Usage:
+    python -m src.storage.migrate --source src/db/db.json --backend sqlite
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+
+from src.storage.backends import get_backend_class
+
+logging.basicConfig(level=logging.INFO)
+
+
+def migrate(source, backend_name, target=None, force=False):
+    """
+    Copy every table of a TinyDB JSON file into a storage backend.
+
+    :param source: Path to the TinyDB JSON database file.
+    :param backend_name: Name of the target backend, e.g. 'sqlite'.
+    :param target: Path of the target database. Derived from the source path by default.
+    :param force: Overwrite a target database that already contains data.
+    :return: Dictionary with the number of migrated documents per table.
+    """
+    backend_cls = get_backend_class(backend_name)
+    target = target or backend_cls.resolve_path(source)
+
+    if os.path.abspath(target) == os.path.abspath(source):
+        raise ValueError("Source and target database are the same file")
+
+    with open(source, 'r') as file:
+        data = json.load(file)
+
+    backend = backend_cls(target, create_dirs=True)
+    try:
+        if backend.read() and not force:
+            raise ValueError("Target database {0} is not empty, use --force to overwrite it".format(target))
+
+        backend.write(data)
+        migrated = backend.read() or {}
+    finally:
+        backend.close()
+
+    counts = {table: len(documents) for table, documents in migrated.items()}
+    for table, documents in data.items():
+        if counts.get(table, 0) != len(documents):
+            raise RuntimeError("Table {0} was not migrated completely".format(table))
+
+    logging.info("Migrated %s to %s: %s", source, target, counts)
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Migrate the TinyDB JSON database to another storage backend.")
+    parser.add_argument('--source', default='src/db/db.json', help="Path to the TinyDB JSON database file.")
+    parser.add_argument('--backend', default='sqlite', help="Name of the target storage backend.")
+    parser.add_argument('--target', default=None, help="Path of the target database.")
+    parser.add_argument('--force', action='store_true', help="Overwrite a non-empty target database.")
+    args = parser.parse_args(argv)
+
+    try:
+        migrate(args.source, args.backend, args.target, args.force)
+    except Exception as e:
+        logging.error("Migration failed: %s", str(e))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,170 @@
+"""
+Immutable map sharing its structure between versions, used by the table
+snapshots so publishing a write does not copy the whole table.
+"""
+from typing import Iterator, Tuple
+
+# Bits of the hash consumed per level of the trie, 32 slots per node
+_BITS = 5
+_MASK = (1 << _BITS) - 1
+_HASH_BITS = 64
+_HASH_MASK = (1 << _HASH_BITS) - 1
+
+_MISSING = object()
+
+
+def _hash(key):
+    return hash(key) & _HASH_MASK
+
+
+class PersistentMap():
+    """
+    Immutable hash map (a hash array mapped trie).
+
+    ``set`` and ``remove`` return a new map and leave the map they were
+    called on unchanged. The new map shares every branch of the trie the
+    change did not touch with the old one, so a change copies at most one
+    node of 32 slots per level, about four levels for 100k keys, no matter
+    how many keys the map holds.
+
+    Nodes are dictionaries of slot to child. A child is either another node
+    or a tuple of (key, value) pairs, which only holds more than one pair
+    for keys whose hashes are equal.
+    """
+
+    __slots__ = ('_root', '_size')
+
+    def __init__(self, root=None, size=0):
+        self._root = root if root is not None else {}
+        self._size = size
+
+    @classmethod
+    def from_items(cls, items) -> 'PersistentMap':
+        """
+        Build a map from (key, value) pairs, changing the new nodes in place.
+        """
+        root = {}
+        size = 0
+        for key, value in items:
+            added = _assoc(root, key, value, _hash(key), 0, in_place=True)[1]
+            size += added
+        return cls(root, size)
+
+    def get(self, key, default=None):
+        hashed = _hash(key)
+        node = self._root
+        shift = 0
+        while True:
+            child = node.get((hashed >> shift) & _MASK)
+            if child is None:
+                return default
+            if isinstance(child, tuple):
+                for entry_key, value in child:
+                    if entry_key == key:
+                        return value
+                return default
+            node = child
+            shift += _BITS
+
+    def set(self, key, value) -> 'PersistentMap':
+        """
+        Return a new map with a key set to a value.
+        """
+        root, added = _assoc(self._root, key, value, _hash(key), 0, in_place=False)
+        return PersistentMap(root, self._size + added)
+
+    def remove(self, key) -> 'PersistentMap':
+        """
+        Return a new map without a key, the map itself if it does not hold the key.
+        """
+        root, removed = _dissoc(self._root, key, _hash(key), 0)
+        if not removed:
+            return self
+        return PersistentMap(root, self._size - 1)
+
+    def items(self) -> Iterator[Tuple[object, object]]:
+        """
+        Iterate over the (key, value) pairs in no particular order.
+        """
+        stack = [self._root]
+        while stack:
+            for child in stack.pop().values():
+                if isinstance(child, tuple):
+                    yield from child
+                else:
+                    stack.append(child)
+
+    def keys(self) -> Iterator[object]:
+        return (key for key, _ in self.items())
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __iter__(self):
+        return self.keys()
+
+    def __len__(self):
+        return self._size
+
+
+def _assoc(node, key, value, hashed, shift, in_place):
+    # Node with the key set and whether the key is new
+    slot = (hashed >> shift) & _MASK
+    child = node.get(slot)
+    new_node = node if in_place else dict(node)
+    if child is None:
+        new_node[slot] = ((key, value),)
+        return new_node, True
+    if isinstance(child, dict):
+        new_node[slot], added = _assoc(child, key, value, hashed, shift + _BITS, in_place)
+        return new_node, added
+    for position, (entry_key, _) in enumerate(child):
+        if entry_key == key:
+            new_node[slot] = child[:position] + ((key, value),) + child[position + 1:]
+            return new_node, False
+    if shift + _BITS >= _HASH_BITS or all(_hash(entry_key) == hashed for entry_key, _ in child):
+        # Equal hashes can not be told apart by going deeper
+        new_node[slot] = child + ((key, value),)
+        return new_node, True
+    # Push the pairs sharing this slot down into a node of their own
+    branch = {}
+    for entry_key, entry_value in child:
+        _assoc(branch, entry_key, entry_value, _hash(entry_key), shift + _BITS, in_place=True)
+    new_node[slot] = _assoc(branch, key, value, hashed, shift + _BITS, in_place=True)[0]
+    return new_node, True
+
+
+def _dissoc(node, key, hashed, shift):
+    # Node without the key and whether the key was there
+    slot = (hashed >> shift) & _MASK
+    child = node.get(slot)
+    if child is None:
+        return node, False
+    if isinstance(child, dict):
+        branch, removed = _dissoc(child, key, hashed, shift + _BITS)
+        if not removed:
+            return node, False
+        new_node = dict(node)
+        if not branch:
+            del new_node[slot]
+        elif len(branch) == 1 and isinstance(next(iter(branch.values())), tuple):
+            # A branch left with a single leaf collapses into that leaf
+            new_node[slot] = next(iter(branch.values()))
+        else:
+            new_node[slot] = branch
+        return new_node, True
+    remaining = tuple(entry for entry in child if entry[0] != key)
+    if len(remaining) == len(child):
+        return node, False
+    new_node = dict(node)
+    if remaining:
+        new_node[slot] = remaining
+    else:
+        del new_node[slot]
+    return new_node, True
@@ -0,0 +1,280 @@
+"""
+Filtering, sorting and cursor pagination over the documents of an
+IndexedTable.
+"""
+import json
+import base64
+import hashlib
+import heapq
+from collections import namedtuple
+
+# Page size used when a query does not ask for one, and the largest one allowed
+DEFAULT_QUERY_LIMIT = 50
+MAX_QUERY_LIMIT = 500
+
+# Filter operators besides plain equality
+RANGE_OPERATORS = ('gt', 'gte', 'lt', 'lte')
+OPERATORS = ('eq', 'prefix') + RANGE_OPERATORS
+
+_MISSING = object()
+
+# One page of query results and the cursor of the next page, None on the last page
+Page = namedtuple('Page', ['items', 'next_cursor'])
+
+
+class InvalidQuery(ValueError):
+    """Raised for malformed filters, sort keys or cursors."""
+
+
+class _Descending():
+    """Sort key component ordering its value in reverse."""
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+class TableQuery():
+    """
+    A parsed query: filters, sort order and page size.
+
+    Filters map a field name, dotted for nested fields, to a value it has
+    to equal or to a dict of operators::
+
+        {"name": "Test Model 1", "version": {"gte": "1.0", "lt": "2.0"},
+         "description": {"prefix": "This model"}}
+
+    Results are ordered by the sort fields, a leading ``-`` sorting the field
+    in descending order, and then by document ID. The cursor of a page holds
+    the sort key of its last document, the next page continues right after
+    it. Values of different types never raise, they are ordered by type.
+    """
+
+    def __init__(self, filters=None, sort=None, limit=None):
+        """
+        :param filters: Dictionary of field names and values or operator dicts.
+        :param sort: Field name or list of field names to sort by.
+        :param limit: Maximum number of documents of a page.
+        """
+        self.filters = filters or {}
+        self.conditions = self._parse_filters(self.filters)
+        self.sort = self._parse_sort(sort)
+        self.limit = self._parse_limit(limit)
+
+    def equalities(self):
+        """
+        Return the top-level fields filtered by equality, usable for index lookups.
+        """
+        return {
+            field: value for field, operator, value in self.conditions
+            if operator == 'eq' and '.' not in field
+        }
+
+    def after_id(self, cursor):
+        """
+        Return the document ID a cursor of a query sorted by document ID points at.
+        """
+        return self._decode_cursor(cursor)[-1]
+
+    def after_values(self, cursor):
+        """
+        Return the sort values, as returned by sort_value, and the document ID a cursor points at.
+        """
+        return tuple(
+            component.value if isinstance(component, _Descending) else component
+            for component in self._decode_cursor(cursor)
+        )
+
+    def bounds(self, field):
+        """
+        Return the lowest and the highest sort value of a field the filters
+        allow, None where the filters do not bound the field. Every matching
+        document lies within the bounds, not every document within them matches.
+        """
+        low = high = None
+        for name, operator, value in self.conditions:
+            if name != field:
+                continue
+            value = _normalize(value)
+            if operator in ('eq', 'gt', 'gte', 'prefix') and (low is None or low < value):
+                low = value
+            if operator in ('eq', 'lt', 'lte') and (high is None or value < high):
+                high = value
+        return low, high
+
+    def matches(self, document):
+        for field, operator, expected in self.conditions:
+            value = _field_value(document, field)
+            if value is _MISSING:
+                return False
+            if operator == 'eq':
+                if value != expected:
+                    return False
+            elif operator == 'prefix':
+                if not isinstance(value, str) or not value.startswith(expected):
+                    return False
+            else:
+                actual, bound = _normalize(value), _normalize(expected)
+                if operator == 'gt' and not actual > bound:
+                    return False
+                if operator == 'gte' and not actual >= bound:
+                    return False
+                if operator == 'lt' and not actual < bound:
+                    return False
+                if operator == 'lte' and not actual <= bound:
+                    return False
+        return True
+
+    def page(self, candidates, cursor=None, ordered=False):
+        """
+        Select one page out of the candidate documents.
+
+        Only ``limit + 1`` documents are ever kept. If the candidates come
+        in the order of the sort key, which without sort fields is document
+        ID order, the scan stops as soon as the page is full.
+
+        :param candidates: Iterable of (doc_id, document) pairs.
+        :param cursor: Cursor returned with the previous page.
+        :param ordered: Whether the candidates are in ascending sort key order.
+        :return: Tuple of the document IDs of the page and the next cursor.
+        """
+        after = self._decode_cursor(cursor) if cursor else None
+        matching = self._matching(candidates, after)
+
+        if ordered:
+            selected = []
+            for entry in matching:
+                selected.append(entry)
+                if len(selected) > self.limit:
+                    break
+        else:
+            selected = heapq.nsmallest(self.limit + 1, matching, key=lambda entry: entry[0])
+
+        next_cursor = None
+        if len(selected) > self.limit:
+            selected = selected[:self.limit]
+            next_cursor = self._encode_cursor(selected[-1][0])
+        return [doc_id for _, doc_id in selected], next_cursor
+
+    # ----------------
+    # Helper Functions
+    # ----------------
+
+    def _matching(self, candidates, after):
+        for doc_id, document in candidates:
+            if not self.matches(document):
+                continue
+            key = self._key(doc_id, document)
+            if after is None or after < key:
+                yield key, doc_id
+
+    def _key(self, doc_id, document):
+        key = []
+        for field, descending in self.sort:
+            value = sort_value(document, field)
+            key.append(_Descending(value) if descending else value)
+        key.append(doc_id)
+        return tuple(key)
+
+    def _fingerprint(self):
+        # Ties a cursor to the query it was issued for
+        spec = json.dumps([self.filters, self.sort], sort_keys=True, default=str)
+        return hashlib.sha256(spec.encode('utf-8')).hexdigest()[:16]
+
+    def _encode_cursor(self, key):
+        values = [component.value if isinstance(component, _Descending) else component for component in key[:-1]]
+        payload = json.dumps({'q': self._fingerprint(), 'k': values, 'id': key[-1]})
+        return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+    def _decode_cursor(self, cursor):
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            fingerprint, values, doc_id = payload['q'], [tuple(value) for value in payload['k']], int(payload['id'])
+        except (ValueError, TypeError, KeyError):
+            raise InvalidQuery("Malformed cursor")
+        if fingerprint != self._fingerprint() or len(values) != len(self.sort):
+            raise InvalidQuery("The cursor belongs to a different query")
+        key = []
+        for (_, descending), value in zip(self.sort, values):
+            key.append(_Descending(value) if descending else value)
+        key.append(doc_id)
+        return tuple(key)
+
+    @staticmethod
+    def _parse_filters(filters):
+        if not isinstance(filters, dict):
+            raise InvalidQuery("Filters must be an object of field names and values")
+        conditions = []
+        for field, condition in filters.items():
+            if not isinstance(condition, dict):
+                conditions.append((field, 'eq', condition))
+                continue
+            for operator, value in condition.items():
+                if operator not in OPERATORS:
+                    raise InvalidQuery("Unknown filter operator '{0}', use one of {1}".format(operator, ', '.join(OPERATORS)))
+                if operator == 'prefix' and not isinstance(value, str):
+                    raise InvalidQuery("A prefix filter needs a string")
+                conditions.append((field, operator, value))
+        return conditions
+
+    @staticmethod
+    def _parse_sort(sort):
+        if not sort:
+            return []
+        if isinstance(sort, str):
+            sort = sort.split(',')
+        parsed = []
+        for field in sort:
+            field = field.strip()
+            if not field or field == '-':
+                raise InvalidQuery("Empty sort field")
+            parsed.append((field[1:], True) if field.startswith('-') else (field, False))
+        return parsed
+
+    @staticmethod
+    def _parse_limit(limit):
+        if limit is None:
+            return DEFAULT_QUERY_LIMIT
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            raise InvalidQuery("The limit must be a number")
+        if limit < 1:
+            raise InvalidQuery("The limit must be at least 1")
+        return min(limit, MAX_QUERY_LIMIT)
+
+
+def sort_value(document, field):
+    """
+    Return the value of a field in the form documents are sorted and compared by.
+    """
+    return _normalize(_field_value(document, field))
+
+
+def _field_value(document, field):
+    value = document
+    for part in field.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _normalize(value):
+    # Orders missing values first, then by type, so mixed types compare
+    if value is _MISSING or value is None:
+        return (0,)
+    if isinstance(value, bool):
+        return (1, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, str):
+        return (3, value)
+    return (4, json.dumps(value, sort_keys=True))
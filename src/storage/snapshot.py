@@ -0,0 +1,162 @@
+"""
+Immutable point-in-time views of a table, read without taking any lock.
+"""
+import copy
+from typing import List, Optional, Tuple
+
+from tinydb import Query
+
+from src.storage.persistent import PersistentMap
+
+_MISSING = object()
+
+
+class TableSnapshot():
+    """
+    Immutable copy of the documents of a table and of its hash indexes.
+
+    A table publishes a new snapshot after every write. Documents and index
+    buckets are kept in PersistentMaps, so the new snapshot shares every
+    untouched document and bucket with the previous one and publishing
+    costs a deep copy of the written documents plus a few trie nodes per
+    document and changed index key, however large the table is. Readers
+    keep using the snapshot they took while newer ones are published, so
+    they never wait for a writer. Every document is handed out as a deep
+    copy, which the reader is free to modify.
+    """
+
+    __slots__ = ('version', '_documents', '_indexes', '_document_class')
+
+    def __init__(self, version, documents, indexes, document_class):
+        """
+        :param version: Number of writes to the table the snapshot includes.
+        :param documents: PersistentMap of document ID to (document, document version).
+        :param indexes: Dictionary of index fields to PersistentMaps of key to sorted document IDs.
+        :param document_class: Class of the documents handed out, called with (document, doc_id, version).
+        """
+        self.version = version
+        self._documents = documents
+        self._indexes = indexes
+        self._document_class = document_class
+
+    @classmethod
+    def build(cls, raw_table, versions, indexed_fields, document_id_class, document_class, version=0):
+        """
+        Copy a whole table into a new snapshot.
+        :param raw_table: The stored documents keyed by document ID strings.
+        :param versions: Dictionary of document ID to the version of the document.
+        :param indexed_fields: Field combinations to index.
+        :param document_id_class: Class of the document IDs.
+        :param document_class: Class of the documents handed out.
+        :param version: Number of writes to the table so far.
+        """
+        documents = []
+        indexes = {index_fields: {} for index_fields in indexed_fields}
+        for key, document in raw_table.items():
+            doc_id = document_id_class(key)
+            document = copy.deepcopy(document)
+            documents.append((doc_id, (document, versions.get(doc_id, 0))))
+            for index_fields, index in indexes.items():
+                index_key = _index_key(document, index_fields)
+                if index_key is not None:
+                    index.setdefault(index_key, []).append(doc_id)
+        indexes = {
+            index_fields: PersistentMap.from_items((index_key, tuple(sorted(doc_ids))) for index_key, doc_ids in index.items())
+            for index_fields, index in indexes.items()
+        }
+        return cls(version, PersistentMap.from_items(documents), indexes, document_class)
+
+    def apply(self, changes, version):
+        """
+        Return a new snapshot with some documents replaced.
+        :param changes: Dictionary of document ID to (document, document version), document None if removed.
+        :param version: Number of writes to the table the new snapshot includes.
+        """
+        documents = self._documents
+        indexes = dict(self._indexes)
+        for doc_id, (document, document_version) in changes.items():
+            previous = documents.get(doc_id)
+            if document is None:
+                documents = documents.remove(doc_id)
+            else:
+                document = copy.deepcopy(document)
+                documents = documents.set(doc_id, (document, document_version))
+            for index_fields, index in indexes.items():
+                old_key = _index_key(previous[0], index_fields) if previous is not None else None
+                new_key = _index_key(document, index_fields) if document is not None else None
+                if old_key == new_key:
+                    continue
+                if old_key is not None:
+                    remaining = tuple(entry for entry in index.get(old_key, ()) if entry != doc_id)
+                    index = index.set(old_key, remaining) if remaining else index.remove(old_key)
+                if new_key is not None:
+                    index = index.set(new_key, tuple(sorted(index.get(new_key, ()) + (doc_id,))))
+                indexes[index_fields] = index
+        return TableSnapshot(version, documents, indexes, self._document_class)
+
+    def get(self, doc_id) -> Optional[dict]:
+        """
+        Return the document with a document ID, None if there is none.
+        """
+        entry = self._documents.get(doc_id)
+        return self._hand_out(doc_id, entry) if entry is not None else None
+
+    def lookup(self, **fields) -> List[dict]:
+        """
+        Return all documents whose fields equal the given values, ordered by document ID.
+        """
+        index_fields = self._find_index(fields)
+        if index_fields is None:
+            condition = Query().fragment(fields)
+            doc_ids = sorted(doc_id for doc_id, (document, _) in self._documents.items() if condition(document))
+        else:
+            doc_ids = self._indexes[index_fields].get(_index_key(fields, index_fields), ())
+            doc_ids = [
+                doc_id for doc_id in doc_ids
+                if all(self._documents[doc_id][0].get(field, _MISSING) == value for field, value in fields.items())
+            ]
+        return [self._hand_out(doc_id, self._documents[doc_id]) for doc_id in doc_ids]
+
+    def lookup_one(self, **fields) -> Optional[dict]:
+        """
+        Return the first document whose fields equal the given values, None if there is none.
+        """
+        documents = self.lookup(**fields)
+        return documents[0] if documents else None
+
+    def all(self) -> List[dict]:
+        """
+        Return every document ordered by document ID.
+        """
+        return [self._hand_out(doc_id, self._documents[doc_id]) for doc_id in sorted(self._documents.keys())]
+
+    def __len__(self):
+        return len(self._documents)
+
+    # ----------------
+    # Helper Functions
+    # ----------------
+
+    def _hand_out(self, doc_id, entry):
+        # A deep copy, as nested values would otherwise be shared with every reader of the snapshot
+        document, version = entry
+        return self._document_class(copy.deepcopy(document), doc_id, version)
+
+    def _find_index(self, fields):
+        best = None
+        for index_fields in self._indexes:
+            if set(index_fields) <= set(fields) and (best is None or len(index_fields) > len(best)):
+                best = index_fields
+        return best
+
+
+def _index_key(document, index_fields) -> Optional[Tuple]:
+    # Index key of a document, None if it lacks a field or a value is unhashable
+    if not all(field in document for field in index_fields):
+        return None
+    key = tuple(document[field] for field in index_fields)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
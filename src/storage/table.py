@@ -0,0 +1,898 @@
+import copy
+import math
+import bisect
+import threading
+from collections.abc import MutableMapping
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from tinydb import Query
+from tinydb.table import Table, Document
+from tinydb.utils import LRUCache
+
+from src.storage.backends import Change
+from src.storage.locks import ReadWriteLock, EngineLock
+from src.storage.query import Page, TableQuery, MAX_QUERY_LIMIT, sort_value
+from src.storage.snapshot import TableSnapshot
+
+# Table holding the persistent document ID sequence of every other table
+SEQUENCE_TABLE = '_sequences'
+SEQUENCE_DOC_ID = '1'
+
+# Default number of attempts of a compare-and-swap update
+MAX_CAS_RETRIES = 10
+
+# Serializes updates of the sequence document shared by all tables
+_sequence_lock = threading.Lock()
+
+_MISSING = object()
+
+
+def _hashable(value):
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+class VersionConflict(Exception):
+    """Raised when a document changed since the version a write was based on."""
+
+
+class VersionedDocument(Document):
+    """A document together with the version it was read at."""
+
+    def __init__(self, value, doc_id, version=0):
+        super().__init__(value, doc_id)
+        self.version = version
+
+
+class _SynchronizedLRUCache(LRUCache):
+    """TinyDB query cache that can be used by concurrent readers."""
+
+    def __init__(self, capacity=None):
+        super().__init__(capacity=capacity)
+        self._mutex = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._mutex:
+            return super().get(key, default)
+
+    def set(self, key, value):
+        with self._mutex:
+            super().set(key, value)
+
+    def clear(self):
+        with self._mutex:
+            super().clear()
+
+
+class _TrackedTable(MutableMapping):
+    """
+    Integer keyed view over the raw (string keyed) table data that records
+    every document ID touched by a TinyDB updater function.
+
+    TinyDB updaters expect a ``{doc_id: document}`` dict. Rebuilding that dict
+    on every write costs O(table size), so instead the updater works on this
+    view directly and the touched IDs are used to keep the indexes current.
+    """
+
+    def __init__(self, raw_table: dict, document_id_class, capture=False):
+        self._raw = raw_table
+        self._document_id_class = document_id_class
+        self.touched = set()
+        # Documents before their first change, kept to roll back transactions and for listeners
+        self.before = {} if capture else None
+
+    def __getitem__(self, doc_id):
+        self._remember(doc_id)
+        document = self._raw[str(doc_id)]
+        # Updaters modify the returned document in place
+        self.touched.add(doc_id)
+        return document
+
+    def __setitem__(self, doc_id, document):
+        self._remember(doc_id)
+        self.touched.add(doc_id)
+        self._raw[str(doc_id)] = document
+
+    def __delitem__(self, doc_id):
+        self._remember(doc_id)
+        del self._raw[str(doc_id)]
+        self.touched.add(doc_id)
+
+    def __contains__(self, doc_id):
+        return str(doc_id) in self._raw
+
+    def __iter__(self):
+        return (self._document_id_class(doc_id) for doc_id in self._raw)
+
+    def __len__(self):
+        return len(self._raw)
+
+    def clear(self):
+        for doc_id in self:
+            self._remember(doc_id)
+        self.touched.update(self)
+        self._raw.clear()
+
+    def _remember(self, doc_id):
+        if self.before is not None and doc_id not in self.before:
+            self.before[doc_id] = copy.deepcopy(self._raw.get(str(doc_id)))
+
+
+class IndexedTable(Table):
+    """
+    TinyDB table keeping in-memory hash indexes over the fields listed in
+    ``indexed_fields``. Every index is keyed by a tuple of field values so
+    composite indexes such as ``('resource_id', 'doc_type')`` are supported.
+
+    Indexes are built lazily on the first lookup and are updated on every
+    write that goes through the table, so point lookups cost O(1) instead of
+    a full table scan. The fields listed in ``ordered_fields`` are also kept
+    in sorted order, so queries sorting by one of them or filtering it by a
+    range read a slice of that order instead of sorting the whole table.
+
+    Reads hold the reader/writer lock of the table shared and run in
+    parallel, writes hold it exclusively. Every write bumps the in-memory
+    version of the documents it touched, which ``compare_and_update`` and
+    ``modify`` use to detect conflicting writes.
+    """
+
+    #: Field combinations to index, set by the storage engine
+    indexed_fields: Tuple[Tuple[str, ...], ...] = ()
+
+    #: Fields kept in sorted order, set by the storage engine
+    ordered_fields: Tuple[str, ...] = ()
+
+    query_cache_class = _SynchronizedLRUCache
+
+    def __init__(self, storage, name, cache_size=Table.default_query_cache_capacity, engine_lock=None):
+        super().__init__(storage, name, cache_size=cache_size)
+        self._engine_lock = engine_lock if engine_lock is not None else EngineLock()
+        self._lock = ReadWriteLock()
+        # Serializes the lazy index build of concurrent readers
+        self._index_build_lock = threading.Lock()
+        self._versions: Dict[int, int] = {}
+        self._indexes: Optional[Dict[Tuple[str, ...], Dict[tuple, set]]] = None
+        self._doc_keys: Dict[int, Dict[Tuple[str, ...], tuple]] = {}
+        # Sorted document IDs, maintained together with the indexes
+        self._id_order: List[int] = []
+        # Sorted (sort value, doc_id) pairs and the sort values of every document per ordered field
+        self._ordered: Dict[str, List[tuple]] = {}
+        self._order_keys: Dict[int, Dict[str, tuple]] = {}
+        # Pairs of listener and whether it is passed the documents before the write
+        self._listeners = []
+        # Published by every write once a reader asked for a snapshot
+        self._snapshot: Optional[TableSnapshot] = None
+        self._sequence: Optional[int] = None
+        self._sequence_dirty = False
+
+    # ---------------
+    # Indexed lookups
+    # ---------------
+
+    def lookup(self, **fields) -> List[VersionedDocument]:
+        """
+        Return all documents whose fields equal the given values.
+
+        Uses the index covering most of the fields and filters the candidates
+        on the remaining ones. Without a matching index the table is scanned.
+
+        :param fields: field names and the values they have to match.
+        :return: list of matching documents ordered by document ID.
+        """
+        index_fields = self._find_index(fields)
+
+        with self._engine_lock.reading(self._lock):
+            if index_fields is None:
+                doc_ids = [
+                    document.doc_id for document in self.search(Query().fragment(fields))
+                ]
+            else:
+                doc_ids = self._indexed_ids(index_fields, fields)
+                remaining = {field: value for field, value in fields.items() if field not in index_fields}
+                if remaining:
+                    raw_table = self._read_table()
+                    doc_ids = [
+                        doc_id for doc_id in doc_ids
+                        if all(raw_table[str(doc_id)].get(field, _MISSING) == value
+                               for field, value in remaining.items())
+                    ]
+            return [self._versioned_document(doc_id) for doc_id in doc_ids]
+
+    def lookup_many(self, field: str, values) -> Dict[object, List[VersionedDocument]]:
+        """
+        Return the documents whose field equals any of the given values.
+
+        All values are resolved under one lock, through the index of the
+        field if there is one and otherwise with a single scan.
+
+        :param field: name of the field to match.
+        :param values: values the field may have.
+        :return: dictionary of every value found to its documents ordered by document ID.
+        """
+        wanted = set(value for value in values if _hashable(value))
+        index_fields = self._find_index({field: None})
+
+        with self._engine_lock.reading(self._lock):
+            if index_fields is None:
+                doc_ids = {}
+                for doc_id, document in self._read_table().items():
+                    value = document.get(field, _MISSING)
+                    if _hashable(value) and value in wanted:
+                        doc_ids.setdefault(value, []).append(self.document_id_class(doc_id))
+                doc_ids = {value: sorted(ids) for value, ids in doc_ids.items()}
+            else:
+                doc_ids = {value: self._indexed_ids(index_fields, {field: value}) for value in wanted}
+            return {
+                value: [self._versioned_document(doc_id) for doc_id in ids]
+                for value, ids in doc_ids.items() if ids
+            }
+
+    def query(self, filters=None, sort=None, limit=None, cursor=None, fields=None) -> Page:
+        """
+        Return one page of the documents matching a set of filters.
+
+        Equality filters on indexed fields narrow the candidates down with
+        the index, the other filters are checked document by document. At
+        most one page of documents is held in memory, see TableQuery.
+        Without sort fields the documents are returned in document ID order,
+        and a page starts right at the cursor in the sorted ID list.
+
+        :param filters: field names and the values or operator dicts they have to match.
+        :param sort: field name or list of field names to sort by, ``-`` prefixed for descending order.
+        :param limit: maximum number of documents of the page.
+        :param cursor: ``next_cursor`` of the previous page.
+        :param fields: names of the fields to return, all fields if not given.
+        :return: Page of documents and the cursor of the next page.
+        """
+        table_query = TableQuery(filters, sort, limit)
+        equalities = table_query.equalities()
+        index_fields = self._find_index(equalities)
+        ordered_scan = self._find_ordered_scan(table_query) if index_fields is None else None
+
+        with self._engine_lock.reading(self._lock):
+            raw_table = self._read_table()
+            ordered = not table_query.sort
+            if index_fields is not None:
+                candidates = ((doc_id, raw_table[str(doc_id)]) for doc_id in self._indexed_ids(index_fields, equalities))
+            elif ordered_scan is not None:
+                field, descending, ordered = ordered_scan
+                doc_ids = self._ordered_ids(field, descending, table_query, cursor if ordered else None)
+                candidates = ((doc_id, raw_table[str(doc_id)]) for doc_id in doc_ids)
+            elif not table_query.sort:
+                self._ensure_indexes()
+                order = self._id_order
+                start = bisect.bisect_right(order, table_query.after_id(cursor)) if cursor else 0
+                candidates = ((order[position], raw_table[str(order[position])]) for position in range(start, len(order)))
+            else:
+                candidates = ((self.document_id_class(doc_id), document) for doc_id, document in raw_table.items())
+            doc_ids, next_cursor = table_query.page(candidates, cursor, ordered=ordered)
+            return Page([self._versioned_document(doc_id, fields) for doc_id in doc_ids], next_cursor)
+
+    def scan(self, filters=None, batch_size=MAX_QUERY_LIMIT, fields=None) -> Iterator[VersionedDocument]:
+        """
+        Iterate over the matching documents in document ID order, one page
+        at a time.
+
+        Only one page is held in memory and the table is only locked while
+        a page is read, so writes made during a long iteration show up in
+        the pages not read yet.
+
+        :param filters: field names and the values or operator dicts they have to match.
+        :param batch_size: number of documents read per page.
+        :param fields: names of the fields to return, all fields if not given.
+        """
+        cursor = None
+        while True:
+            page = self.query(filters, limit=batch_size, cursor=cursor, fields=fields)
+            yield from page.items
+            cursor = page.next_cursor
+            if cursor is None:
+                return
+
+    def documents_after(self, doc_id: int, limit: int) -> List[VersionedDocument]:
+        """
+        Return the documents with the next higher document IDs.
+
+        :param doc_id: document ID to start after, 0 to start at the first document.
+        :param limit: maximum number of documents to return.
+        :return: list of documents ordered by document ID.
+        """
+        with self._engine_lock.reading(self._lock):
+            self._ensure_indexes()
+            start = bisect.bisect_right(self._id_order, doc_id)
+            return [self._versioned_document(entry) for entry in self._id_order[start:start + limit]]
+
+    def document_ids(self) -> List[int]:
+        """
+        Return the IDs of all documents in ascending order.
+        """
+        with self._engine_lock.reading(self._lock):
+            self._ensure_indexes()
+            return list(self._id_order)
+
+    def last_id(self) -> int:
+        """
+        Return the highest document ID, 0 if the table is empty.
+        """
+        with self._engine_lock.reading(self._lock):
+            self._ensure_indexes()
+            return self._id_order[-1] if self._id_order else 0
+
+    def lookup_one(self, **fields) -> Optional[Document]:
+        """
+        Return the first document whose fields equal the given values.
+
+        :param fields: field names and the values they have to match.
+        :return: the matching document or None.
+        """
+        documents = self.lookup(**fields)
+        return documents[0] if documents else None
+
+    def snapshot(self) -> TableSnapshot:
+        """
+        Return an immutable snapshot of the table without waiting for writers.
+
+        The first call copies the table. From then on every write publishes
+        a new snapshot, copying only the documents it changed, so readers
+        pick up the current one without taking the table lock.
+        """
+        self._engine_lock.sync()
+        snapshot = self._snapshot
+        if snapshot is not None:
+            return snapshot
+
+        with self._engine_lock.reading(self._lock):
+            with self._index_build_lock:
+                if self._snapshot is None:
+                    self._snapshot = TableSnapshot.build(
+                        self._read_table(), self._versions, self.indexed_fields,
+                        self.document_id_class, VersionedDocument
+                    )
+                return self._snapshot
+
+    # ----------------------------
+    # Optimistic concurrency control
+    # ----------------------------
+
+    def version_of(self, doc_id: int) -> int:
+        """
+        Return the current version of a document.
+
+        Versions start at 0 when the storage is opened and are bumped by
+        every write touching the document.
+
+        :param doc_id: ID of the document.
+        """
+        with self._engine_lock.reading(self._lock):
+            return self._versions.get(doc_id, 0)
+
+    def compare_and_update(self, fields, doc_id: int, version: int) -> int:
+        """
+        Update a document only if nobody else wrote it since it was read.
+
+        :param fields: Fields to update, or a callable changing the document in place.
+        :param doc_id: ID of the document to update.
+        :param version: The version the update is based on.
+        :raises VersionConflict: The document was changed or removed meanwhile.
+        :return: The new version of the document.
+        """
+        with self._writing():
+            if str(doc_id) not in self._read_table():
+                raise VersionConflict("Document {0} of table {1} was removed".format(doc_id, self.name))
+            current = self._versions.get(doc_id, 0)
+            if current != version:
+                raise VersionConflict("Document {0} of table {1} is at version {2}, expected {3}".format(
+                    doc_id, self.name, current, version))
+            self.update(fields, doc_ids=[doc_id])
+            return self._versions.get(doc_id, 0)
+
+    def modify(self, doc_id: int, mutator, retries: int = MAX_CAS_RETRIES) -> Optional[VersionedDocument]:
+        """
+        Read-modify-write a document with optimistic concurrency control.
+
+        ``mutator`` is called without holding any lock with a copy of the
+        document and returns the fields to update. When another writer
+        changed the document in the meantime the read and ``mutator`` are
+        retried, so concurrent modifications are never lost.
+
+        :param doc_id: ID of the document to modify.
+        :param mutator: Callable taking the document and returning a dict of updated fields.
+        :param retries: Maximum number of attempts.
+        :raises VersionConflict: The document kept changing for all attempts.
+        :return: The modified document, or None if the document does not exist.
+        """
+        for _ in range(retries):
+            with self._engine_lock.reading(self._lock):
+                if str(doc_id) not in self._read_table():
+                    return None
+                document = self._versioned_document(doc_id)
+
+            fields = mutator(document)
+            try:
+                self.compare_and_update(fields, doc_id, document.version)
+            except VersionConflict:
+                continue
+            return self.get_versioned(doc_id)
+
+        raise VersionConflict("Giving up on document {0} of table {1} after {2} conflicting writes".format(
+            doc_id, self.name, retries))
+
+    def insert_if_absent(self, document, **fields) -> Tuple[VersionedDocument, bool]:
+        """
+        Insert a document unless a document with the given field values exists.
+
+        The lookup and the insert happen under one lock, so concurrent calls
+        never insert the document twice.
+
+        :param document: The document to insert, or a callable building it from a newly allocated document ID.
+        :param fields: field names and the values identifying the document.
+        :return: Tuple of the stored document and whether it was inserted.
+        """
+        with self._writing():
+            existing = self.lookup_one(**fields)
+            if existing is not None:
+                return existing, False
+            if callable(document):
+                document = document(self.allocate_id())
+            doc_id = self.insert(document)
+            return self._versioned_document(doc_id), True
+
+    def get_versioned(self, doc_id: int) -> Optional[VersionedDocument]:
+        """
+        Return a copy of a document along with its version.
+        :param doc_id: ID of the document.
+        """
+        with self._engine_lock.reading(self._lock):
+            if str(doc_id) not in self._read_table():
+                return None
+            return self._versioned_document(doc_id)
+
+    # ---------------------
+    # Document ID sequences
+    # ---------------------
+
+    def allocate_ids(self, count: int) -> List[int]:
+        """
+        Reserve document IDs from the persistent sequence of the table.
+
+        IDs are never handed out twice, not even after the documents using
+        them were removed. The new sequence value is persisted together with
+        the next write of the table.
+
+        :param count: Number of IDs to reserve.
+        :return: List of consecutive document IDs.
+        """
+        with self._writing():
+            first = self._current_sequence() + 1
+            self._sequence = first + count - 1
+            self._sequence_dirty = True
+            if self._engine_lock.interprocess is not None and self._engine_lock.depth() == 1:
+                # Other processes allocate from the same sequence, persist it right away
+                self._update_table(lambda table: None)
+            return list(range(first, first + count))
+
+    def allocate_id(self) -> int:
+        """
+        Reserve a single document ID from the persistent sequence of the table.
+        """
+        return self.allocate_ids(1)[0]
+
+    def add_listener(self, listener, before=False):
+        """
+        Call ``listener(table, changes)`` after every write of the table.
+
+        ``changes`` maps the IDs of the written documents to their new
+        contents, None for removed documents, or is None itself when the
+        whole table was reloaded. Listeners run holding the table lock, so
+        they must not access other tables. The only exception is appending
+        to a table that has no listeners and is never written while another
+        table lock is held, like the change log of the ChangeFeed.
+
+        :param listener: The callable to notify.
+        :param before: Call ``listener(table, changes, before)`` instead, ``before`` mapping the
+                       IDs to the documents before the write, None for inserted documents.
+        """
+        self._listeners.append((listener, before))
+
+    @property
+    def lock(self) -> ReadWriteLock:
+        """
+        The reader/writer lock of the table.
+        """
+        return self._lock
+
+    def reset(self, previous: dict, current: dict):
+        """
+        Adopt table contents that were reloaded from the storage.
+
+        Bumps the version of every document that changed, so compare-and-swap
+        updates based on the previous contents fail, and drops the indexes,
+        the ID sequence and the query cache. The caller holds the table lock.
+
+        :param previous: The raw table contents before the reload.
+        :param current: The raw table contents after the reload.
+        """
+        for key in set(previous) | set(current):
+            doc_id = self.document_id_class(key)
+            if key not in current:
+                self._versions.pop(doc_id, None)
+            elif previous.get(key) != current[key]:
+                self._versions[doc_id] = self._versions.get(doc_id, 0) + 1
+        self._indexes = None
+        self._doc_keys = {}
+        self._order_keys = {}
+        self._snapshot = None
+        self._sequence = None
+        self._sequence_dirty = False
+        self.clear_cache()
+        for listener, before in self._listeners:
+            if before:
+                listener(self, None, None)
+            else:
+                listener(self, None)
+
+    def restore(self, documents: dict, versions: Optional[dict] = None):
+        """
+        Put documents back into the state they had before a rolled back
+        transaction changed them.
+
+        A document another thread wrote after the transaction is no longer
+        at the version the transaction left it at and keeps that write.
+
+        :param documents: Dictionary of document ID to the previous document, None if it did not exist.
+        :param versions: Dictionary of document ID to the version the transaction left the document at.
+        :return: IDs of the documents restored.
+        """
+        with self._writing():
+            tables = self._storage.read() or {}
+            raw_table = tables.setdefault(self.name, {})
+            if versions is not None:
+                documents = {doc_id: document for doc_id, document in documents.items()
+                             if self._versions.get(doc_id, 0) == versions.get(doc_id)}
+            # Documents are replaced, not changed in place, so the current ones need no copy
+            replaced = {doc_id: raw_table.get(str(doc_id)) for doc_id in documents}
+            for doc_id, document in documents.items():
+                if document is None:
+                    raw_table.pop(str(doc_id), None)
+                else:
+                    raw_table[str(doc_id)] = document
+            if not documents:
+                return []
+            self._reindex(documents, raw_table)
+            self._bump_versions(documents, raw_table)
+            self._publish(documents, raw_table)
+            self.clear_cache()
+            self._notify(documents, raw_table, replaced)
+            return sorted(documents)
+
+    def rebuild_indexes(self):
+        """
+        Drop the in-memory indexes so they are rebuilt on the next lookup.
+        """
+        with self._lock.exclusive():
+            self._indexes = None
+            self._doc_keys = {}
+            self._order_keys = {}
+            self._snapshot = None
+
+    # -----------------------------------------
+    # Read operations holding the lock shared
+    # -----------------------------------------
+
+    def search(self, cond):
+        with self._engine_lock.reading(self._lock):
+            return super().search(cond)
+
+    def get(self, *args, **kwargs):
+        with self._engine_lock.reading(self._lock):
+            return super().get(*args, **kwargs)
+
+    def contains(self, *args, **kwargs):
+        with self._engine_lock.reading(self._lock):
+            return super().contains(*args, **kwargs)
+
+    def count(self, cond):
+        with self._engine_lock.reading(self._lock):
+            return super().count(cond)
+
+    def __len__(self):
+        with self._engine_lock.reading(self._lock):
+            return super().__len__()
+
+    def __iter__(self):
+        # Materialize the documents so iteration never races with a write
+        with self._engine_lock.reading(self._lock):
+            return iter(list(super().__iter__()))
+
+    # ----------------
+    # Helper Functions
+    # ----------------
+
+    def _writing(self):
+        # Storages serializing the whole database on every commit need the engine lock exclusively
+        return self._engine_lock.writing(self._lock, exclusive=getattr(self._storage, 'serialized_writes', True))
+
+    def _versioned_document(self, doc_id, fields=None):
+        # Like TinyDB, hand out a shallow copy as updates change the stored document in place
+        document = self._read_table()[str(doc_id)]
+        if fields is not None:
+            document = {field: document[field] for field in fields if field in document}
+        return VersionedDocument(document, self.document_id_class(doc_id), self._versions.get(doc_id, 0))
+
+    def _get_next_id(self):
+        # Used by TinyDB for inserts without an explicit document ID
+        return self.allocate_id()
+
+    def _current_sequence(self):
+        if self._sequence is None:
+            tables = self._storage.read() or {}
+            sequences = tables.get(SEQUENCE_TABLE, {}).get(SEQUENCE_DOC_ID, {})
+            max_id = max((int(doc_id) for doc_id in tables.get(self.name, {})), default=0)
+            self._sequence = max(sequences.get(self.name, 0), max_id)
+        return self._sequence
+
+    def _sequence_change(self, tables, doc_ids):
+        """
+        Fold the IDs written by an update into the sequence and return the
+        Change persisting it, if the sequence moved.
+        """
+        if self.name == SEQUENCE_TABLE:
+            return None
+
+        highest = max(doc_ids, default=0)
+        if highest > self._current_sequence():
+            # Documents inserted with an explicit ID
+            self._sequence = highest
+            self._sequence_dirty = True
+
+        if not self._sequence_dirty:
+            return None
+
+        with _sequence_lock:
+            # Tables are written concurrently, so never change the shared document in place
+            sequence_table = tables.setdefault(SEQUENCE_TABLE, {})
+            sequences = dict(sequence_table.get(SEQUENCE_DOC_ID, {}))
+            sequences[self.name] = self._sequence
+            sequence_table[SEQUENCE_DOC_ID] = sequences
+        self._sequence_dirty = False
+        return Change(SEQUENCE_TABLE, SEQUENCE_DOC_ID, sequences)
+
+    def _bump_versions(self, doc_ids, raw_table):
+        for doc_id in doc_ids:
+            if str(doc_id) in raw_table:
+                self._versions[doc_id] = self._versions.get(doc_id, 0) + 1
+            else:
+                self._versions.pop(doc_id, None)
+
+    def _publish(self, doc_ids, raw_table):
+        if self._snapshot is None or not doc_ids:
+            return
+        changes = {doc_id: (raw_table.get(str(doc_id)), self._versions.get(doc_id, 0)) for doc_id in doc_ids}
+        self._snapshot = self._snapshot.apply(changes, self._snapshot.version + 1)
+
+    def _notify(self, doc_ids, raw_table, previous=None):
+        if not self._listeners or not doc_ids:
+            return
+        changes = {doc_id: raw_table.get(str(doc_id)) for doc_id in doc_ids}
+        for listener, before in self._listeners:
+            if before:
+                listener(self, changes, previous or {})
+            else:
+                listener(self, changes)
+
+    def _captures_before(self):
+        return any(before for _, before in self._listeners)
+
+    def _find_index(self, fields):
+        # Prefer the index covering the most fields
+        names = set(fields)
+        best = None
+        for index_fields in self.indexed_fields:
+            if set(index_fields) <= names and (best is None or len(index_fields) > len(best)):
+                best = index_fields
+        return best
+
+    def _indexed_ids(self, index_fields, fields):
+        # Sorted IDs of the documents whose indexed fields equal the given values
+        self._ensure_indexes()
+        key = tuple(fields[field] for field in index_fields)
+        try:
+            return sorted(self._indexes[index_fields].get(key, ()))
+        except TypeError:
+            # Unhashable values are never indexed
+            return []
+
+    def _ensure_indexes(self):
+        if self._indexes is not None:
+            return
+
+        with self._index_build_lock:
+            if self._indexes is not None:
+                return
+            indexes = {index_fields: {} for index_fields in self.indexed_fields}
+            self._doc_keys = {}
+            raw_table = self._read_table()
+            for doc_id, document in raw_table.items():
+                self._index_document(self.document_id_class(doc_id), document, indexes)
+            self._id_order = sorted(self.document_id_class(doc_id) for doc_id in raw_table)
+            # Ordered fields are sorted on first use
+            self._ordered = {}
+            self._order_keys = {}
+            # Publish the indexes only once complete, other readers use them unlocked
+            self._indexes = indexes
+
+    def _index_document(self, doc_id, document, indexes=None):
+        indexes = indexes if indexes is not None else self._indexes
+        keys = {}
+        for index_fields, index in indexes.items():
+            if not all(field in document for field in index_fields):
+                continue
+            key = tuple(document[field] for field in index_fields)
+            try:
+                index.setdefault(key, set()).add(doc_id)
+            except TypeError:
+                continue
+            keys[index_fields] = key
+        if keys:
+            self._doc_keys[doc_id] = keys
+
+    def _unindex_document(self, doc_id):
+        for index_fields, key in self._doc_keys.pop(doc_id, {}).items():
+            bucket = self._indexes[index_fields].get(key)
+            if bucket is None:
+                continue
+            bucket.discard(doc_id)
+            if not bucket:
+                del self._indexes[index_fields][key]
+
+    def _reindex(self, doc_ids, raw_table):
+        if self._indexes is None:
+            return
+        for doc_id in doc_ids:
+            self._unindex_document(doc_id)
+            document = raw_table.get(str(doc_id))
+            if document is not None:
+                self._index_document(doc_id, document)
+            position = bisect.bisect_left(self._id_order, doc_id)
+            listed = position < len(self._id_order) and self._id_order[position] == doc_id
+            if document is not None and not listed:
+                self._id_order.insert(position, doc_id)
+            elif document is None and listed:
+                del self._id_order[position]
+            self._reorder_document(doc_id, document)
+
+    def _ordered_entries(self, field):
+        # Sorted (sort value, doc_id) pairs of a field, built on first use like the indexes
+        self._ensure_indexes()
+        entries = self._ordered.get(field)
+        if entries is not None:
+            return entries
+
+        with self._index_build_lock:
+            entries = self._ordered.get(field)
+            if entries is not None:
+                return entries
+            entries = []
+            for doc_id, document in self._read_table().items():
+                doc_id = self.document_id_class(doc_id)
+                key = sort_value(document, field)
+                self._order_keys.setdefault(doc_id, {})[field] = key
+                entries.append((key, doc_id))
+            entries.sort()
+            self._ordered[field] = entries
+            return entries
+
+    def _reorder_document(self, doc_id, document):
+        keys = self._order_keys.pop(doc_id, {})
+        for field, entries in self._ordered.items():
+            if field in keys:
+                position = bisect.bisect_left(entries, (keys[field], doc_id))
+                if position < len(entries) and entries[position] == (keys[field], doc_id):
+                    del entries[position]
+            if document is not None:
+                keys[field] = sort_value(document, field)
+                bisect.insort(entries, (keys[field], doc_id))
+        if document is not None and keys:
+            self._order_keys[doc_id] = keys
+
+    def _find_ordered_scan(self, table_query):
+        # Field, direction and whether the scan yields the documents in the order of the sort key
+        if len(table_query.sort) == 1 and table_query.sort[0][0] in self.ordered_fields:
+            field, descending = table_query.sort[0]
+            return field, descending, True
+        if not table_query.sort:
+            for field in self.ordered_fields:
+                if table_query.bounds(field) != (None, None):
+                    return field, False, False
+        return None
+
+    def _ordered_ids(self, field, descending, table_query, cursor):
+        # IDs of the documents within the bounds of the filters and after the cursor, in sort value order
+        entries = self._ordered_entries(field)
+        low, high = table_query.bounds(field)
+        start = bisect.bisect_left(entries, (low,)) if low is not None else 0
+        end = bisect.bisect_right(entries, (high, math.inf)) if high is not None else len(entries)
+        if cursor:
+            # Documents sharing the value of the cursor are left to the cursor check of the page
+            value = table_query.after_values(cursor)[0]
+            if descending:
+                end = min(end, bisect.bisect_right(entries, (value, math.inf)))
+            else:
+                start = max(start, bisect.bisect_left(entries, (value,)))
+
+        if not descending:
+            for position in range(start, end):
+                yield entries[position][1]
+            return
+        # Descending by value, but ties stay in ascending document ID order like the sort key
+        position = end
+        while position > start:
+            run_start = max(start, bisect.bisect_left(entries, (entries[position - 1][0],), start, position))
+            for run_position in range(run_start, position):
+                yield entries[run_position][1]
+            position = run_start
+
+    def _update_table(self, updater):
+        """
+        Perform a table update operation.
+
+        Unlike the TinyDB implementation the updater works on a tracked view
+        of the stored table, which lets us update only the index entries of
+        the documents that were actually touched. Storages supporting
+        ``commit`` are handed just those documents to persist.
+
+        The engine lock is held shared and the table lock exclusively. Waiting
+        for the commit is deferred until the outermost write of the thread
+        has released its locks, so other writers can join the group commit.
+        """
+        with self._writing():
+            tables = self._storage.read()
+
+            if tables is None:
+                # The database is empty
+                tables = {}
+
+            raw_table = tables.setdefault(self.name, {})
+            transaction = self._engine_lock.transaction()
+            capture = transaction is not None or self._captures_before()
+            tracked = _TrackedTable(raw_table, self.document_id_class, capture=capture)
+
+            # Perform the table update operation
+            updater(tracked)
+
+            # Persist the ID sequence in the same commit as the documents
+            sequence_change = self._sequence_change(tables, tracked.touched)
+
+            # Write the newly updated data back to the storage
+            changes = None
+            commit = getattr(self._storage, 'commit', None)
+            if commit is not None:
+                changes = [
+                    Change(self.name, str(doc_id), raw_table.get(str(doc_id)))
+                    for doc_id in sorted(tracked.touched)
+                ]
+                if sequence_change is not None:
+                    changes.append(sequence_change)
+                if transaction is None:
+                    ticket = commit(tables, changes)
+                    if ticket is not None:
+                        self._engine_lock.defer(ticket)
+            else:
+                self._storage.write(tables)
+            self._engine_lock.mark_written()
+
+            self._reindex(tracked.touched, raw_table)
+            self._bump_versions(tracked.touched, raw_table)
+            if transaction is not None and changes is not None:
+                # Committed together with the rest of the transaction, the versions
+                # tell a rollback which documents nobody else wrote since
+                versions = {doc_id: self._versions.get(doc_id, 0) for doc_id in tracked.before}
+                transaction.record(self, tracked.before, changes, versions)
+            self._publish(tracked.touched, raw_table)
+
+            # Clear the query cache, as the table contents have changed
+            self.clear_cache()
+            self._notify(tracked.touched, raw_table, tracked.before)
@@ -0,0 +1,52 @@
+class Transaction():
+    """
+    Writes of an engine transaction, committed to the storage together
+    when the transaction ends.
+
+    The tables apply the writes to the cache right away and record the
+    previous state and the new version of every touched document, so the
+    transaction can be rolled back when it fails without undoing what
+    other threads wrote meanwhile.
+    """
+
+    def __init__(self):
+        self.changes = []
+        # Table name to the table and its undo entries, document ID to [document before the transaction, version]
+        self._undo = {}
+
+    def record(self, table, before, changes, versions):
+        """
+        Record the changes of one table update.
+        :param table: The IndexedTable that was updated.
+        :param before: Dictionary of document ID to the document before the update, None if it did not exist.
+        :param changes: List of Change records of the update.
+        :param versions: Dictionary of document ID to the version of the document after the update.
+        """
+        self.changes.extend(changes)
+        if before:
+            undo = self._undo.setdefault(table.name, (table, {}))[1]
+            for doc_id, document in before.items():
+                # The first write of a document saw it as it was before the transaction
+                undo.setdefault(doc_id, [document, None])[1] = versions.get(doc_id, 0)
+
+    def merged_changes(self):
+        """
+        Return the changes keeping only the latest one of each document.
+        """
+        merged = {}
+        for change in self.changes:
+            key = (change.table, change.doc_id)
+            merged.pop(key, None)
+            merged[key] = change
+        return list(merged.values())
+
+    def rollback(self):
+        """
+        Restore every touched document that is still at the version this
+        transaction left it at.
+        """
+        for table, undo in self._undo.values():
+            table.restore({doc_id: entry[0] for doc_id, entry in undo.items()},
+                          {doc_id: entry[1] for doc_id, entry in undo.items()})
+        self.changes = []
+        self._undo = {}
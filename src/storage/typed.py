@@ -0,0 +1,172 @@
+"""
+Typed tables for the entity types that used to share TinyDB's default
+table, and the online migration moving existing documents into them.
+"""
+import time
+import threading
+import logging
+
+from tinydb.table import Document
+
+logging.basicConfig(level=logging.DEBUG)
+
+DEFAULT_TABLE = '_default'
+
+# Entity tables, in the order documents of the default table are classified
+TYPED_TABLES = ('pip', 'policies', 'resource', 'fl_services', 'users', 'connectors', 'ml_models')
+
+
+def classify(document):
+    """
+    Return the typed table a document of the default table belongs to.
+    :param document: A document of the default table.
+    :return: Name of the typed table, or None if the document is not recognized.
+    """
+    doc_type = document.get('doc_type')
+    if doc_type == 'pip':
+        return 'pip'
+    if doc_type == 'policy' or 'policy_id' in document:
+        return 'policies'
+    if doc_type == 'resource' or 'asset_id' in document:
+        return 'resource'
+    if doc_type == 'fl_service' or 'fl_session' in document:
+        return 'fl_services'
+    if 'email' in document:
+        return 'users'
+    if 'access_url' in document:
+        return 'connectors'
+    if 'model_id' in document or 'ml_flow_model_path' in document or 'semantics' in document:
+        return 'ml_models'
+    return None
+
+
+class DefaultTableMigrator():
+    """
+    Move the documents of the default table into their typed tables while
+    the service keeps running.
+
+    A background thread moves the documents in small batches. Each batch is
+    one engine transaction, so a document is never lost or duplicated, not
+    even when the process stops in the middle of the migration. Until the
+    migration is done the typed tables call ``migrate_matching`` before a
+    lookup, which moves the documents the lookup needs right away.
+    """
+
+    def __init__(self, engine, batch_size=100, interval=0.05):
+        """
+        :param engine: The StorageEngine to migrate.
+        :param batch_size: Number of documents moved in one transaction.
+        :param interval: Seconds to pause between two batches.
+        """
+        self._engine = engine
+        self.batch_size = batch_size
+        self.interval = interval
+        self.done = False
+        self._stopped = threading.Event()
+        # Serializes the moves of this process, other processes are held off by the engine lock
+        self._move_lock = threading.Lock()
+        self._moved = {}
+        self._stats_lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """
+        Start the background migration, if there is anything to migrate.
+        """
+        if self.done:
+            return
+        self._stopped = threading.Event()
+        pending = self._pending_ids()
+        if not pending:
+            self.done = True
+            return
+        logging.info("Migrating %s documents of the default table into typed tables", len(pending))
+        self._thread = threading.Thread(target=self._run, args=(pending,), name='typed-table-migrator', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def pause(self):
+        """
+        Wait for the current batch and hold off further moves until resume().
+        """
+        self._move_lock.acquire()
+
+    def resume(self):
+        self._move_lock.release()
+
+    def migrate_matching(self, table_name, fields):
+        """
+        Move the documents of one typed table matching a lookup.
+        :param table_name: Name of the typed table.
+        :param fields: field names and the values they have to match.
+        """
+        source = self._engine.table(DEFAULT_TABLE)
+        doc_ids = [document.doc_id for document in source.lookup(**fields) if classify(document) == table_name]
+        if doc_ids:
+            self._move(doc_ids)
+
+    def migrate_all(self):
+        """
+        Move every remaining document at once.
+        """
+        doc_ids = self._pending_ids()
+        for start in range(0, len(doc_ids), self.batch_size):
+            self._move(doc_ids[start:start + self.batch_size])
+        self.done = True
+
+    def stats(self):
+        """
+        Return the number of moved documents per typed table.
+        """
+        with self._stats_lock:
+            return {'done': self.done, 'moved': dict(self._moved)}
+
+    # ----------------
+    # Helper Functions
+    # ----------------
+
+    def _run(self, pending):
+        try:
+            while pending and not self.done:
+                for start in range(0, len(pending), self.batch_size):
+                    if self._stopped.is_set() or self.done:
+                        return
+                    self._move(pending[start:start + self.batch_size])
+                    self._stopped.wait(self.interval)
+                # Pick up documents written to the default table during the migration
+                pending = self._pending_ids()
+            self.done = True
+            logging.info("Migration into typed tables finished: %s", self.stats()['moved'])
+        except Exception as e:
+            logging.error("Migration into typed tables failed %s", str(e))
+
+    def _pending_ids(self):
+        source = self._engine.table(DEFAULT_TABLE)
+        return [document.doc_id for document in source if classify(document) is not None]
+
+    def _move(self, doc_ids):
+        source = self._engine.table(DEFAULT_TABLE)
+        moved = {}
+        with self._move_lock, self._engine.transaction():
+            for doc_id in doc_ids:
+                # Another thread or process may have moved it meanwhile
+                document = source.get(doc_id=doc_id)
+                if document is None:
+                    continue
+                table_name = classify(document)
+                target = self._engine.table(table_name)
+                new_id = target.allocate_id()
+                document = dict(document)
+                if 'doc_id' in document:
+                    document['doc_id'] = new_id
+                target.insert(Document(document, doc_id=new_id))
+                source.remove(doc_ids=[doc_id])
+                moved[table_name] = moved.get(table_name, 0) + 1
+
+        with self._stats_lock:
+            for table_name, count in moved.items():
+                self._moved[table_name] = self._moved.get(table_name, 0) + count
@@ -0,0 +1,93 @@
+"""
+Group commit: flushing waits for the batch being committed, and the
+cache never drifts away from the storage when a commit fails.
+"""
+import os
+import threading
+import time
+
+import pytest
+
+from config import settings
+from src.storage import get_db, close_all
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    previous = settings.get('STORAGE_BACKEND', 'json')
+    settings.set('STORAGE_BACKEND', 'sqlite')
+    close_all()
+    yield os.path.join(str(tmp_path), 'db.json')
+    close_all()
+    settings.set('STORAGE_BACKEND', previous)
+
+
+def test_flush_waits_for_the_batch_being_committed(db_path, monkeypatch):
+    db = get_db(db_path)
+    storage = db.storage.storage
+    commit = storage.commit
+    started = threading.Event()
+    finished = threading.Event()
+
+    def slow_commit(data, changes):
+        started.set()
+        time.sleep(0.3)
+        commit(data, changes)
+        finished.set()
+
+    monkeypatch.setattr(storage, 'commit', slow_commit)
+    writer = threading.Thread(target=db.table('resource').insert, args=({'resource_id': 'r1'},))
+    writer.start()
+    assert started.wait(5)
+
+    db.storage.committer.flush()
+    assert finished.is_set()
+    assert db.storage.committer.stats()['pending'] == 0
+    writer.join()
+
+
+def fail_first_commit(storage, monkeypatch):
+    commit = storage.commit
+    calls = []
+
+    def failing_commit(data, changes):
+        calls.append(len(changes))
+        if len(calls) == 1:
+            raise OSError("disk full")
+        commit(data, changes)
+
+    monkeypatch.setattr(storage, 'commit', failing_commit)
+    return calls
+
+
+def test_failed_commit_is_committed_with_the_next_batch(db_path, monkeypatch):
+    db = get_db(db_path)
+    calls = fail_first_commit(db.storage.storage, monkeypatch)
+    table = db.table('resource')
+
+    with pytest.raises(OSError):
+        table.insert({'resource_id': 'r1'})
+    table.insert({'resource_id': 'r2'})
+    assert db.storage.committer.stats()['failed_commits'] == 1
+
+    close_all()
+    table = get_db(db_path).table('resource')
+    assert sorted(document['resource_id'] for document in table.all()) == ['r1', 'r2']
+    assert len(calls) >= 2
+
+
+def test_failed_commit_is_retried_without_further_writes(db_path, monkeypatch):
+    db = get_db(db_path)
+    calls = fail_first_commit(db.storage.storage, monkeypatch)
+
+    with pytest.raises(OSError):
+        db.table('resource').insert({'resource_id': 'r1'})
+    deadline = time.monotonic() + 5
+    while db.storage.committer.stats()['retrying'] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert db.storage.committer.stats()['retrying'] == 0
+    # The retry committed the same changes again
+    assert len(calls) == 2 and calls[0] == calls[1]
+
+    close_all()
+    assert [document['resource_id'] for document in get_db(db_path).table('resource').all()] == ['r1']
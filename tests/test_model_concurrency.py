@@ -0,0 +1,115 @@
+"""
+Concurrent requests against the models: access counts must count every
+access, and concurrent updates of one record must neither lose an update
+nor leave a mix of two updates behind, after the database is reopened too.
+"""
+import os
+import shutil
+
+import pytest
+
+from config import settings
+from src.storage import get_db, close_all
+from test_storage_concurrency import THREADS, ITERATIONS, run_threads
+
+MODEL_PATH = 'mlflow-artifacts:/1/{0}/artifacts/model'
+
+
+@pytest.fixture(scope='module')
+def models(tmp_path_factory):
+    # Importing the models opens the default database, keep the one of the repository out of it
+    workdir = tmp_path_factory.mktemp('models')
+    shutil.copytree('policies', str(workdir / 'policies'))
+    os.makedirs(str(workdir / 'src' / 'db'))
+    previous = os.getcwd()
+    os.chdir(str(workdir))
+    try:
+        from src.models.pip_model import PIPModel
+        from src.models.ml_model import MlModel
+        from src.models.ds_resource_model import DataSpaceResource
+    finally:
+        os.chdir(previous)
+    return PIPModel, MlModel, DataSpaceResource
+
+
+@pytest.fixture(params=['json', 'sqlite', 'journal'])
+def db_path(request, tmp_path, models):
+    previous = settings.get('STORAGE_BACKEND', 'json')
+    settings.set('STORAGE_BACKEND', request.param)
+    close_all()
+    yield os.path.join(str(tmp_path), 'db.json')
+    close_all()
+    settings.set('STORAGE_BACKEND', previous)
+
+
+def test_access_counts_count_every_access(models, db_path):
+    PIPModel = models[0]
+    times = THREADS * ITERATIONS + 10
+    get_db(db_path).table('policies').insert(
+        {'resource_id': 'r1', 'policy_type': 'N_TIMES', 'policy_metadata': {'TIMES': times}})
+    pip = PIPModel(db_path)
+    counts = []
+
+    def access(index):
+        for _ in range(ITERATIONS):
+            counts.append(pip.get_access_count('consumer', 'http://connector/r1'))
+
+    run_threads(access)
+    # Every access saw its own count, from the allowed number of times downwards
+    assert sorted(counts) == list(range(times - THREADS * ITERATIONS + 1, times + 1))
+
+    close_all()
+    records = get_db(db_path).table('pip').lookup(resource_id='r1', consumer_uri='consumer')
+    assert len(records) == 1
+    assert records[0]['access_count'] == times - THREADS * ITERATIONS
+
+
+def test_update_model_keeps_one_complete_update(models, db_path):
+    MlModel = models[1]
+    ml_model = MlModel(db_path)
+    model_id = ml_model.add_model('model', 'v0', 'initial', MODEL_PATH.format('initial'))['model_id']
+    table = ml_model.models
+    doc_id = table.lookup(model_id=model_id)[0].doc_id
+    initial_version = table.version_of(doc_id)
+
+    def update(index):
+        for iteration in range(ITERATIONS):
+            tag = '{0}-{1}'.format(index, iteration)
+            assert ml_model.update_model(model_id, 'model-' + tag, 'v' + tag, 'update ' + tag, MODEL_PATH.format(tag))
+
+    run_threads(update)
+    document = table.get(doc_id=doc_id)
+    assert table.version_of(doc_id) == initial_version + THREADS * ITERATIONS
+
+    close_all()
+    (reopened,) = MlModel(db_path).models.lookup(model_id=model_id)
+    assert reopened == document
+    # All fields come from the same update
+    tag = reopened['name'][len('model-'):]
+    assert reopened['version'] == 'v' + tag
+    assert reopened['description'] == 'update ' + tag
+    assert reopened['ml_flow_model_path'] == MODEL_PATH.format(tag)
+
+
+def test_update_resource_loses_no_update(models, db_path):
+    DataSpaceResource = models[2]
+    previous = settings.get('ID_SCHEME', 'hash')
+    # Hash IDs change with every update, so only ULIDs can be updated concurrently by ID
+    settings.set('ID_SCHEME', 'ulid')
+    try:
+        resources = DataSpaceResource(db_path)
+        resource_id = resources.create_resource('connector', 'asset')[0]['resource_id']
+
+        def update(index):
+            for iteration in range(ITERATIONS):
+                _, status = resources.update_resource(resource_id, **{'field{0}'.format(index): iteration})
+                assert status == 200
+
+        run_threads(update)
+    finally:
+        settings.set('ID_SCHEME', previous)
+
+    close_all()
+    (document,) = DataSpaceResource(db_path).resource.lookup(resource_id=resource_id)
+    assert document['asset_id'] == 'asset'
+    assert all(document['field{0}'.format(index)] == ITERATIONS - 1 for index in range(THREADS))
@@ -0,0 +1,75 @@
+"""
+Table snapshots: publishing a write must cost the same however large the
+table is, and older snapshots must stay unchanged.
+"""
+import random
+import time
+
+from src.storage.persistent import PersistentMap
+from src.storage.snapshot import TableSnapshot
+from src.storage.table import VersionedDocument
+
+INDEXED_FIELDS = (('resource_id',), ('resource_id', 'doc_type'))
+WRITES = 500
+
+
+def build_snapshot(size):
+    raw_table = {str(doc_id): {'resource_id': 'r{0}'.format(doc_id), 'doc_type': 'resource'}
+                 for doc_id in range(1, size + 1)}
+    return TableSnapshot.build(raw_table, {}, INDEXED_FIELDS, int, VersionedDocument)
+
+
+def time_writes(snapshot):
+    # Best of three, so a single slow run does not count
+    best = None
+    for _ in range(3):
+        current = snapshot
+        started = time.perf_counter()
+        for write in range(WRITES):
+            doc_id = len(snapshot) + 1 + write
+            current = current.apply({doc_id: ({'resource_id': 'new{0}'.format(write)}, 1)}, current.version + 1)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def test_write_cost_does_not_grow_with_the_table():
+    small = time_writes(build_snapshot(1000))
+    large = time_writes(build_snapshot(50000))
+    # Copying the document map on every write made this about 50 times slower
+    assert large < small * 5
+
+
+def test_apply_leaves_older_snapshots_unchanged():
+    snapshot = build_snapshot(100)
+    updated = snapshot.apply({5: ({'resource_id': 'changed'}, 1), 6: (None, 0)}, 1)
+
+    assert snapshot.get(5)['resource_id'] == 'r5'
+    assert snapshot.get(6) is not None
+    assert snapshot.lookup(resource_id='changed') == []
+    assert updated.get(5)['resource_id'] == 'changed'
+    assert updated.get(6) is None
+    assert [document.doc_id for document in updated.lookup(resource_id='changed')] == [5]
+    assert updated.lookup(resource_id='r5') == []
+    assert len(updated) == 99
+
+
+def test_persistent_map_matches_dict():
+    rng = random.Random(7)
+    expected = {}
+    current = PersistentMap()
+    history = []
+    for _ in range(5000):
+        key = rng.choice([rng.randrange(2000), ('key', rng.randrange(200))])
+        history.append((current, dict(expected)))
+        if rng.random() < 0.3:
+            current = current.remove(key)
+            expected.pop(key, None)
+        else:
+            current = current.set(key, rng.random())
+            expected[key] = current[key]
+    assert dict(current.items()) == expected
+    assert len(current) == len(expected)
+    for previous, contents in history[::250]:
+        assert dict(previous.items()) == contents
+    assert dict(PersistentMap.from_items(expected.items()).items()) == expected
@@ -0,0 +1,131 @@
+"""
+Concurrent writes against every storage backend: no update may be lost,
+no document ID handed out twice, and everything has to be there again
+after the database is reopened.
+"""
+import os
+import threading
+import time
+
+import pytest
+
+from config import settings
+from src.storage import get_db, close_all
+
+THREADS = 16
+ITERATIONS = 40
+
+
+@pytest.fixture(params=['json', 'sqlite', 'journal'])
+def db_path(request, tmp_path):
+    previous = settings.get('STORAGE_BACKEND', 'json')
+    settings.set('STORAGE_BACKEND', request.param)
+    close_all()
+    yield os.path.join(str(tmp_path), 'db.json')
+    close_all()
+    settings.set('STORAGE_BACKEND', previous)
+
+
+def run_threads(target):
+    errors = []
+
+    def run(index):
+        try:
+            target(index)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+
+def test_modify_loses_no_update(db_path):
+    table = get_db(db_path).table('pip')
+    doc_id = table.insert({'resource_id': 'r1', 'count': 0})
+
+    def increment(index):
+        for _ in range(ITERATIONS):
+            assert table.modify(doc_id, lambda document: {'count': document['count'] + 1}) is not None
+
+    run_threads(increment)
+    assert table.get(doc_id=doc_id)['count'] == THREADS * ITERATIONS
+
+    close_all()
+    assert get_db(db_path).table('pip').get(doc_id=doc_id)['count'] == THREADS * ITERATIONS
+
+
+def test_insert_if_absent_inserts_once(db_path):
+    table = get_db(db_path).table('resource')
+    inserted = []
+
+    def insert(index):
+        for iteration in range(ITERATIONS):
+            # Every thread tries to insert the same resources
+            resource_id = 'r{0}'.format(iteration)
+            _, created = table.insert_if_absent({'resource_id': resource_id, 'thread': index}, resource_id=resource_id)
+            if created:
+                inserted.append(resource_id)
+
+    run_threads(insert)
+    assert sorted(inserted) == sorted('r{0}'.format(iteration) for iteration in range(ITERATIONS))
+    assert len(table) == ITERATIONS
+
+    close_all()
+    table = get_db(db_path).table('resource')
+    assert sorted(document['resource_id'] for document in table.all()) == sorted(inserted)
+
+
+def test_allocate_ids_never_repeats(db_path):
+    table = get_db(db_path).table('policies')
+    allocated = []
+
+    def allocate(index):
+        for _ in range(ITERATIONS):
+            doc_ids = table.allocate_ids(2)
+            table.insert({'policy_id': 'p{0}'.format(doc_ids[0]), 'thread': index})
+            allocated.extend(doc_ids)
+
+    run_threads(allocate)
+    assert len(allocated) == len(set(allocated)) == THREADS * ITERATIONS * 2
+    doc_ids = [document.doc_id for document in table.all()]
+    assert len(doc_ids) == len(set(doc_ids)) == THREADS * ITERATIONS
+
+    close_all()
+    table = get_db(db_path).table('policies')
+    assert len(table) == THREADS * ITERATIONS
+    # The persisted sequence continues after every ID handed out before the restart
+    assert table.allocate_ids(1)[0] > max(allocated + doc_ids)
+
+
+def test_rollback_keeps_concurrent_writes(db_path):
+    db = get_db(db_path)
+    table = db.table('resource')
+    first = table.insert({'resource_id': 'r1', 'value': 'initial'})
+    second = table.insert({'resource_id': 'r2', 'value': 'initial'})
+
+    def write_meanwhile():
+        table.update({'value': 'other thread'}, doc_ids=[first])
+
+    writer = threading.Thread(target=write_meanwhile)
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            table.update({'value': 'transaction'}, doc_ids=[first, second])
+            writer.start()
+            # The write shows as soon as it is made, its commit may wait for the transaction
+            while table.get(doc_id=first)['value'] != 'other thread':
+                time.sleep(0.001)
+            raise RuntimeError("abort")
+    writer.join()
+
+    # Only the document nobody else wrote is rolled back
+    assert table.get(doc_id=first)['value'] == 'other thread'
+    assert table.get(doc_id=second)['value'] == 'initial'
+
+    close_all()
+    table = get_db(db_path).table('resource')
+    assert table.get(doc_id=first)['value'] == 'other thread'
+    assert table.get(doc_id=second)['value'] == 'initial'